@@ -4,10 +4,12 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import os
 
-from .database import SessionLocal
+from .database import AsyncSessionLocal, SessionLocal
 from .models import User
 
 # Configuración de seguridad
@@ -62,30 +64,49 @@ def get_db():
         db.close()
 
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Obtiene el usuario actual desde el token JWT"""
-    credentials_exception = HTTPException(
+async def get_async_db():
+    """Dependency con una sesión async, para los endpoints async def"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar las credenciales",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    token = credentials.credentials
-    payload = verify_token(token)
-    
-    if payload is None:
-        raise credentials_exception
-    
-    email: str = payload.get("sub")
+
+
+def _token_email(credentials: HTTPAuthorizationCredentials) -> str:
+    """Email (sub) del token JWT, o 401 si el token no es válido"""
+    payload = verify_token(credentials.credentials)
+    email = payload.get("sub") if payload is not None else None
     if email is None:
-        raise credentials_exception
-    
+        raise _credentials_exception()
+    return email
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> User:
+    """Obtiene el usuario actual desde el token JWT"""
+    email = _token_email(credentials)
     user = db.query(User).filter(User.email == email).first()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     
     return user
 
+
+async def get_current_user_async(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db),
+) -> User:
+    """get_current_user con la sesión async (para los endpoints async)"""
+    email = _token_email(credentials)
+    user = (await db.execute(select(User).where(User.email == email))).scalars().first()
+    if user is None:
+        raise _credentials_exception()
+    return user
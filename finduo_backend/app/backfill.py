@@ -0,0 +1,478 @@
+"""Importación del historial completo de un buzón, reanudable.
+
+Uso: python -m app.backfill --email usuario@dominio [--workers N]
+         [--chunk-size N] [--max-rate N] [--restart]
+
+A diferencia de /sync-email, que en la primera sincronización solo toma los
+últimos EMAIL_INITIAL_SYNC_LIMIT correos, recorre todos los correos del banco de
+cada carpeta en orden de UID y en lotes de tamaño fijo. Después de cada lote se
+hace commit de las transacciones junto con un checkpoint (último UID importado
+de la carpeta), así que si el proceso muere o se pausa se retoma desde ahí.
+
+La descarga se hace en el proceso principal; decodificar y parsear (CPU) se
+reparte en un ProcessPoolExecutor y al proceso principal solo vuelven las
+transacciones parseadas. Los jobs de un mismo proceso (la API o
+app.sync_worker) comparten un único pool de BACKFILL_WORKERS procesos. El ritmo se limita a BACKFILL_MAX_RATE correos por
+segundo para no competir con la API por el servidor IMAP y la base de datos.
+
+También se puede lanzar como job con POST /backfill (lo ejecutan los mismos
+workers que /sync-email) y pausar con POST /backfill/pause.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import bank_parser
+from .database import SessionLocal, init_db
+from .email_sync import (
+    BANK_SENDERS,
+    SYNC_LOCATIONS,
+    fetch_batches,
+    insert_parsed,
+    message_key,
+    open_imap_session,
+    update_sync_state,
+)
+from .imap_client import decode_message
+from .logging_config import setup_logging
+from .mailboxes import get_credentials
+from .metrics import SyncStats
+from .models import BackfillCheckpoint, SyncJob, SyncJobStatus, User
+
+logger = logging.getLogger(__name__)
+
+
+# Procesos para decodificar y parsear, compartidos por todos los backfills del
+# proceso; el pool puede vivir dentro de la API, así que son pocos por defecto
+BACKFILL_WORKERS = max(int(os.getenv("BACKFILL_WORKERS", "2")), 1)
+
+# Correos por lote; cada lote termina con un commit y un checkpoint
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "200"))
+
+# Correos por segundo como máximo (0 = sin límite)
+BACKFILL_MAX_RATE = float(os.getenv("BACKFILL_MAX_RATE", "50"))
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def _new_pool(workers):
+    # spawn: el pool se puede crear desde un hilo de la API o del worker
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def shared_pool():
+    """Pool de procesos de los jobs de backfill de este proceso (se crea al primer uso)."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = _new_pool(BACKFILL_WORKERS)
+        return _shared_pool
+
+
+def _discard_shared_pool(pool):
+    """Descarta el pool compartido si se rompió (murió un proceso) para crear otro."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is pool:
+            _shared_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_shared_pool(wait=True):
+    """Cierra el pool compartido; lo llaman los runners al detenerse."""
+    global _shared_pool
+    with _shared_pool_lock:
+        pool, _shared_pool = _shared_pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def parse_raw_chunk(raws):
+    """Decodifica y parsea un lote de RawMessage en un proceso del pool.
+
+    Devuelve ([(clave del correo, ParsedTransaction o None)], [(UID, error)] de
+    los correos que fallaron, segundos de CPU). Como en /sync-email, un correo
+    que falla se cuenta como error y no detiene el lote.
+    """
+    start = time.process_time()
+    records = []
+    errors = []
+    for raw in raws:
+        try:
+            message = decode_message(raw)
+            parsed = bank_parser.parse(message) if message.body else None
+        except Exception as e:
+            errors.append((raw.uid, repr(e)))
+            continue
+        records.append((message_key(message), parsed))
+    return records, errors, time.process_time() - start
+
+
+class Throttle:
+    """Espera lo necesario para no pasar de rate correos por segundo."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.count = 0
+
+    def wait(self, count):
+        """Registra count correos y duerme si se va adelantado; devuelve los segundos."""
+        self.count += count
+        if not self.rate:
+            return 0.0
+        delay = self.started + self.count / self.rate - time.monotonic()
+        if delay <= 0:
+            return 0.0
+        time.sleep(delay)
+        return delay
+
+
+class _Stats:
+    """Tiempo y correos procesados por etapa."""
+
+    def __init__(self):
+        self.seconds = {"fetch": 0.0, "parse": 0.0, "insert": 0.0, "throttle": 0.0}
+        self.messages = {"fetch": 0, "parse": 0, "insert": 0, "throttle": 0}
+        self.counts = dict(imported=0, skipped=0, unparsed=0, errors=0)
+
+    def add(self, stage, seconds, messages):
+        self.seconds[stage] += seconds
+        self.messages[stage] += messages
+
+    def to_dict(self, elapsed):
+        stages = {}
+        for stage, seconds in self.seconds.items():
+            messages = self.messages[stage]
+            stages[stage] = {
+                "seconds": round(seconds, 3),
+                "messages": messages,
+                "per_second": round(messages / seconds, 1) if seconds else None,
+            }
+        return dict(
+            self.counts,
+            seconds=round(elapsed, 3),
+            per_second=round(self.messages["fetch"] / elapsed, 1) if elapsed else None,
+            stages=stages,
+        )
+
+
+def checkpoint_to_dict(checkpoint: BackfillCheckpoint):
+    return {
+        "folder": checkpoint.folder,
+        "last_uid": checkpoint.last_uid,
+        "processed": checkpoint.processed or 0,
+        "total": checkpoint.total,
+        "finished": bool(checkpoint.finished),
+        "updated_at": checkpoint.updated_at.isoformat() if checkpoint.updated_at else None,
+    }
+
+
+def get_checkpoints(db, user_id: int):
+    return (
+        db.query(BackfillCheckpoint)
+        .filter(BackfillCheckpoint.user_id == user_id)
+        .order_by(BackfillCheckpoint.id)
+        .all()
+    )
+
+
+def reset_checkpoints(db, user_id: int):
+    """Descarta el avance para que el próximo backfill recorra todo de nuevo (sin commit)."""
+    db.query(BackfillCheckpoint).filter(BackfillCheckpoint.user_id == user_id).delete(
+        synchronize_session=False
+    )
+
+
+def _get_checkpoint(db, user_id, location):
+    checkpoint = (
+        db.query(BackfillCheckpoint)
+        .filter(
+            BackfillCheckpoint.user_id == user_id,
+            BackfillCheckpoint.folder == location,
+        )
+        .first()
+    )
+    if checkpoint is None:
+        checkpoint = BackfillCheckpoint(
+            user_id=user_id, folder=location, last_uid=0, processed=0, finished=False
+        )
+        db.add(checkpoint)
+    return checkpoint
+
+
+class _Backfill:
+    """Recorre las carpetas de un usuario guardando un checkpoint por lote."""
+
+    def __init__(self, db, user, session, pool, workers, chunk_size, max_rate, job_id):
+        self.db = db
+        self.user = user
+        self.session = session
+        self.pool = pool
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.throttle = Throttle(max_rate)
+        self.job_id = job_id
+        self.stats = _Stats()
+        # Mismas métricas que /sync-email (parse incluye la decodificación)
+        self.metrics = SyncStats()
+        self.paused = False
+
+    def _commit_chunk(self, future, chunk, checkpoint):
+        # Si el lote no se pudo parsear (murió un proceso del pool, etc.) la
+        # excepción sube antes de tocar el checkpoint: al reintentar se retoma
+        # desde el último lote confirmado
+        records, errors, cpu_seconds = future.result()
+        self.stats.add("parse", cpu_seconds, len(chunk))
+        self.metrics.observe("parse", cpu_seconds)
+        for _, parsed in records:
+            self.metrics.template(parsed.template if parsed else None)
+        for uid, error in errors:
+            logger.error(f"Correo UID {uid}: Error al procesar - {error}")
+        self.stats.counts["errors"] += len(errors)
+        self.metrics.count("error", len(errors))
+
+        start = time.perf_counter()
+        items = [(key, parsed) for key, parsed in records if parsed is not None]
+        imported = insert_parsed(self.db, self.user.id, items)
+        counts = self.stats.counts
+        counts["unparsed"] += len(records) - len(items)
+        counts["imported"] += imported
+        counts["skipped"] += len(items) - imported
+        self.metrics.count("imported", imported)
+        self.metrics.count("duplicate", len(items) - imported)
+        self.metrics.count("unparsed", len(records) - len(items))
+
+        # El checkpoint va en el mismo commit que las transacciones del lote
+        checkpoint.last_uid = max(raw.uid for raw in chunk)
+        checkpoint.processed = (checkpoint.processed or 0) + len(chunk)
+        if self.job_id:
+            # Un job que avanza no cuenta como intento fallido si hay que retomarlo
+            self.db.query(SyncJob).filter(SyncJob.id == self.job_id).update(
+                {
+                    "imported": counts["imported"],
+                    "skipped": counts["skipped"],
+                    "errors": counts["errors"],
+                    "attempts": 0,
+                },
+                synchronize_session=False,
+            )
+        self.db.commit()
+        self.stats.add("insert", time.perf_counter() - start, len(chunk))
+        self.metrics.observe("insert", time.perf_counter() - start)
+
+    def _commit_next(self, pending, checkpoint):
+        """Confirma el lote en vuelo más antiguo.
+
+        Si falla, los lotes siguientes se descartan sin confirmar: el checkpoint
+        es el último UID confirmado y no puede saltarse el lote que falló. Con
+        la excepción la carpeta tampoco queda finished ni avanza la marca de agua.
+        """
+        future, chunk = pending.popleft()
+        try:
+            self._commit_chunk(future, chunk, checkpoint)
+        except BaseException:
+            for later, _ in pending:
+                later.cancel()
+            pending.clear()
+            self.db.rollback()
+            raise
+
+    def _pause_requested(self):
+        if self.job_id and not self.paused:
+            status = (
+                self.db.query(SyncJob.status).filter(SyncJob.id == self.job_id).scalar()
+            )
+            self.db.rollback()
+            # Pausado, reemplazado o borrado: cualquier status que no sea running
+            self.paused = status != SyncJobStatus.running
+        return self.paused
+
+    def folder(self, location):
+        with self.metrics.time("select"):
+            folder = self.session.resolve_folder(location)
+            if folder is None:
+                logger.info(f"La carpeta {location} no existe, saltando...")
+                return
+            uidvalidity, uidnext = self.session.select(folder)
+
+        checkpoint = _get_checkpoint(self.db, self.user.id, location)
+        if checkpoint.uidvalidity != uidvalidity:
+            # Carpeta nueva o con UIDs renumerados: se recorre desde el principio
+            checkpoint.uidvalidity = uidvalidity
+            checkpoint.last_uid = 0
+            checkpoint.processed = 0
+            checkpoint.finished = False
+        if checkpoint.finished:
+            self.db.commit()
+            return
+
+        with self.metrics.time("search"):
+            uids = self.session.search_from(BANK_SENDERS, min_uid=checkpoint.last_uid + 1)
+        checkpoint.total = (checkpoint.processed or 0) + len(uids)
+        self.db.commit()
+        logger.info(
+            f"Backfill de {folder}: {len(uids)} correos pendientes desde UID {checkpoint.last_uid + 1}"
+        )
+
+        # A lo más dos lotes por proceso en vuelo; se confirman en orden de UID
+        pending = deque()
+        chunks = fetch_batches(self.session, uids, self.chunk_size, self.metrics)
+        try:
+            while not self._pause_requested():
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                self.stats.add("fetch", time.perf_counter() - start, len(chunk))
+                pending.append((self.pool.submit(parse_raw_chunk, chunk), chunk))
+                while len(pending) >= self.workers * 2:
+                    self._commit_next(pending, checkpoint)
+                self.stats.add("throttle", self.throttle.wait(len(chunk)), len(chunk))
+        finally:
+            # Aunque falle la descarga se guardan los lotes ya descargados
+            chunks.close()
+            while pending:
+                self._commit_next(pending, checkpoint)
+        if self.paused:
+            logger.info(f"Backfill de {folder} pausado en UID {checkpoint.last_uid}")
+            return
+
+        checkpoint.finished = True
+        # Las próximas sincronizaciones incrementales siguen desde aquí
+        if uidvalidity is not None:
+            update_sync_state(
+                self.db,
+                self.user.id,
+                location,
+                uidvalidity,
+                uidnext - 1 if uidnext else None,
+            )
+        self.db.commit()
+
+
+def backfill_user(
+    user_email,
+    locations=None,
+    workers=None,
+    chunk_size=None,
+    max_rate=None,
+    job_id=None,
+):
+    """Importa (o sigue importando) todo el historial bancario del usuario.
+
+    Retoma desde los checkpoints guardados; para empezar de cero usar
+    reset_checkpoints. Con workers se usa un pool propio de ese tamaño; si no,
+    el pool compartido del proceso. Con job_id se va guardando el avance en el
+    job y se detiene si el job deja de estar running (por ejemplo, pausado).
+    Devuelve los contadores (imported, skipped, unparsed, errors), si quedó
+    pausado, el avance por carpeta y el tiempo y la velocidad de cada etapa.
+    """
+    own_pool = bool(workers)
+    workers = workers or BACKFILL_WORKERS
+    chunk_size = chunk_size or BACKFILL_CHUNK_SIZE
+    max_rate = BACKFILL_MAX_RATE if max_rate is None else max_rate
+    started = time.perf_counter()
+
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == user_email).first()
+        if user is None:
+            raise RuntimeError(f"Usuario {user_email} no encontrado")
+        credentials = get_credentials(db, user)
+        pool = _new_pool(workers) if own_pool else shared_pool()
+        backfill = _Backfill(
+            db, user, None, pool, workers, chunk_size, max_rate, job_id
+        )
+        try:
+            with open_imap_session(credentials, backfill.metrics) as session:
+                backfill.session = session
+                for location in locations or SYNC_LOCATIONS:
+                    backfill.folder(location)
+                    if backfill.paused:
+                        break
+        except BrokenProcessPool:
+            if not own_pool:
+                _discard_shared_pool(pool)
+            raise
+        finally:
+            if own_pool:
+                pool.shutdown()
+        folders = [checkpoint_to_dict(c) for c in get_checkpoints(db, user.id)]
+    finally:
+        db.close()
+
+    result = backfill.stats.to_dict(time.perf_counter() - started)
+    result.update(
+        paused=backfill.paused, folders=folders, metrics=backfill.metrics.to_dict()
+    )
+    logger.info(
+        f"Backfill de {user_email}{' pausado' if backfill.paused else ''}: "
+        f"{result['imported']} importadas, {result['skipped']} duplicadas, "
+        f"{result['unparsed']} sin parsear, {result['errors']} errores en {result['seconds']}s"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill del historial de correos")
+    parser.add_argument("--email", required=True, help="Correo del usuario FinDuo")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=BACKFILL_WORKERS,
+        help="Procesos para decodificar y parsear",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=BACKFILL_CHUNK_SIZE,
+        help="Correos por lote (y por checkpoint)",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=BACKFILL_MAX_RATE,
+        help="Correos por segundo como máximo (0 = sin límite)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Descarta los checkpoints y recorre todo el buzón de nuevo",
+    )
+    parser.add_argument(
+        "--folders", nargs="*", default=None, help="Carpetas (por defecto SYNC_LOCATIONS)"
+    )
+    args = parser.parse_args()
+
+    # El resultado va en JSON por stdout, los logs por stderr
+    setup_logging(stream=sys.stderr)
+    init_db()
+    if args.restart:
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.email == args.email).first()
+            if user is not None:
+                reset_checkpoints(db, user.id)
+                db.commit()
+        finally:
+            db.close()
+
+    result = backfill_user(
+        args.email, args.folders, args.workers, args.chunk_size, args.max_rate
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
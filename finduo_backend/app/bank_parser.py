@@ -0,0 +1,370 @@
+"""Parser de correos bancarios basado en un registro de plantillas.
+
+Cada banco se describe de forma declarativa (remitentes, asunto, palabras clave,
+regex de los campos y formato de fecha) y las plantillas se compilan una sola
+vez al importar el módulo. Antes de correr cualquier regex, un único pase sobre
+el cuerpo busca todas las palabras clave registradas y descarta las plantillas
+que no pueden coincidir, así que agregar bancos no multiplica el costo por correo.
+
+Se pueden agregar bancos sin tocar el código con BANK_TEMPLATES_FILE, un JSON
+con una lista de plantillas en el mismo formato que BANCO_DE_CHILE.
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+PURCHASE = "purchase"
+TRANSFER = "transfer_out"
+ALL_KINDS = (PURCHASE, TRANSFER)
+
+# Máximo de caracteres entre dos campos de una plantilla
+GAP = 300
+
+# JSON opcional con plantillas de otros bancos
+BANK_TEMPLATES_FILE = os.getenv("BANK_TEMPLATES_FILE")
+
+_FLAGS = re.IGNORECASE | re.DOTALL
+
+
+class ParsedTransaction(NamedTuple):
+    type: str
+    amount: int
+    description: str
+    date_time: datetime
+    # Nombre de la plantilla que coincidió (para métricas)
+    template: Optional[str] = None
+
+
+class BankTemplate(NamedTuple):
+    """Plantilla compilada de un tipo de correo de un banco.
+
+    patterns se prueban en orden; cada uno tiene el grupo amount y opcionalmente
+    merchant, date y time. Si el patrón no trae la fecha se buscan date_patterns
+    (pares regex, formato con grupos date y time).
+    """
+
+    name: str
+    bank: str
+    kind: str
+    senders: tuple
+    subject: Optional[re.Pattern]
+    keywords: frozenset
+    required: frozenset
+    patterns: tuple
+    date_format: str
+    date_patterns: tuple
+    description: str
+
+
+# Plantillas de Banco de Chile. Los patrones son los que usaba email_sync, con
+# grupos con nombre; la primera plantilla registrada tiene prioridad.
+BANCO_DE_CHILE = [
+    {
+        "name": "bancochile_compra",
+        "bank": "Banco de Chile",
+        "kind": PURCHASE,
+        "senders": ["enviodigital@bancochile.cl"],
+        "subject": r"compra|cargo",
+        "keywords": ["compra", "cargo", "pago"],
+        "required": ["$"],
+        "patterns": [
+            r"compra por \$(?P<amount>[\d\.]+)\s+con cargo a Cuenta \*+\d+\s+en (?P<merchant>.+?) el (?P<date>\d{2}/\d{2}/\d{4}) (?P<time>\d{2}:\d{2})",
+            r"compra por \$(?P<amount>[\d\.]+)\s+con cargo a Cuenta\s+\d+\s+en (?P<merchant>.+?) el (?P<date>\d{2}/\d{2}/\d{4}) (?P<time>\d{2}:\d{2})",
+            r"cargo.*?cuenta.*?\$(?P<amount>[\d\.]+).*?en (?P<merchant>.+?)(?: el| fecha|,)\s*(?P<date>\d{2}/\d{2}/\d{4})(?:\s+(?P<time>\d{2}:\d{2}))?",
+            r"(?:cargo|compra).*?\$(?P<amount>[\d\.]+).*?(?:en|de)\s+(?P<merchant>.+?)(?:\s+el|\s+fecha|,)\s*(?P<date>\d{2}/\d{2}/\d{4})(?:\s+(?P<time>\d{2}:\d{2}))?",
+            r"compra.*?\$(?P<amount>[\d\.]+).*?en (?P<merchant>.+?) el (?P<date>\d{2}/\d{2}/\d{4}) (?P<time>\d{2}:\d{2})",
+            r"\$(?P<amount>[\d\.]+).*?(?:cargo|compra|pago).*?(?P<date>\d{2}/\d{2}/\d{4})(?:\s+(?P<time>\d{2}:\d{2}))?",
+        ],
+        "date_format": "%d/%m/%Y",
+        "description": "Compra",
+    },
+    {
+        "name": "bancochile_transferencia",
+        "bank": "Banco de Chile",
+        "kind": TRANSFER,
+        "senders": ["serviciodetransferencias@bancochile.cl"],
+        "subject": r"transferencia",
+        "keywords": ["transferencia", "monto"],
+        "patterns": [
+            r"monto\s+\$(?P<amount>[\d\.]+)",
+            r"transferencia.*?a\s+terceros.*?\$(?P<amount>[\d\.]+)",
+            r"transferencia.*?\$(?P<amount>[\d\.]+)",
+            r"\$(?P<amount>[\d\.]+).*?transferencia",
+            r"monto(?-s:.*?)(?P<amount>\d+[\.\d]*)",
+        ],
+        "date_patterns": [
+            [r"(?P<date>\d{2}/\d{2}/\d{4})\s+(?P<time>\d{2}:\d{2})", "%d/%m/%Y %H:%M"],
+            [r"(?P<date>\d{2}-\d{2}-\d{4})\s+(?P<time>\d{2}:\d{2})", "%d-%m-%Y %H:%M"],
+        ],
+        "description": "Transferencia a terceros",
+    },
+]
+
+
+def _gap(pattern: str) -> str:
+    """Reemplaza los huecos .*? por huecos acotados."""
+    return pattern.replace(".*?", f".{{0,{GAP}}}?")
+
+
+def _compile(pattern: str):
+    return re.compile(_gap(pattern), _FLAGS)
+
+
+def compile_template(spec: dict) -> BankTemplate:
+    """Convierte la definición declarativa de una plantilla en un BankTemplate."""
+    if spec["kind"] not in ALL_KINDS:
+        raise ValueError(f"Tipo de plantilla desconocido: {spec['kind']}")
+    return BankTemplate(
+        name=spec["name"],
+        bank=spec.get("bank", spec["name"]),
+        kind=spec["kind"],
+        senders=tuple(s.lower() for s in spec.get("senders", ())),
+        subject=re.compile(spec["subject"], re.IGNORECASE)
+        if spec.get("subject")
+        else None,
+        keywords=frozenset(k.lower() for k in spec.get("keywords", ())),
+        required=frozenset(k.lower() for k in spec.get("required", ())),
+        patterns=tuple(_compile(p) for p in spec["patterns"]),
+        date_format=spec.get("date_format", "%d/%m/%Y"),
+        date_patterns=tuple(
+            (_compile(p), fmt) for p, fmt in spec.get("date_patterns", ())
+        ),
+        description=spec.get("description", ""),
+    )
+
+
+TEMPLATES = []
+
+# Alternancia con todas las palabras clave registradas (ver _rebuild_prefilter)
+_keyword_re = None
+
+
+def _trie_pattern(words) -> str:
+    """Alternancia con prefijos comunes factorizados (un trie como regex).
+
+    Hace las veces de un autómata Aho–Corasick con el módulo re: en cada
+    posición se sigue una sola rama por carácter en vez de probar cada palabra.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        if list(node) == [""]:
+            return ""
+        branches = []
+        optional = False
+        for char, child in sorted(node.items()):
+            if char == "":
+                optional = True
+            else:
+                branches.append(re.escape(char) + build(child))
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        pattern = "(?:" + "|".join(branches) + ")"
+        return pattern + "?" if optional else pattern
+
+    return build(trie)
+
+
+def _rebuild_prefilter():
+    global _keyword_re
+    words = set()
+    for template in TEMPLATES:
+        words |= template.keywords | template.required
+    # Sin IGNORECASE (se busca sobre el cuerpo en minúsculas) re puede saltar
+    # directo a las posiciones que empiezan con la primera letra de alguna palabra
+    _keyword_re = re.compile(_trie_pattern(words)) if words else None
+
+
+def register_templates(specs):
+    """Agrega plantillas al registro, después de las existentes."""
+    TEMPLATES.extend(compile_template(spec) for spec in specs)
+    _rebuild_prefilter()
+    select_templates.cache_clear()
+
+
+def load_templates_file(path: str):
+    with open(path, encoding="utf-8") as f:
+        register_templates(json.load(f))
+    logger.info(f"Plantillas bancarias cargadas desde {path}")
+
+
+def sender_addresses():
+    """Remitentes exactos de todas las plantillas (para la búsqueda IMAP)."""
+    addresses = []
+    for template in TEMPLATES:
+        for sender in template.senders:
+            if "@" in sender and sender not in addresses:
+                addresses.append(sender)
+    return addresses
+
+
+_ADDRESS_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+
+def _sender_address(sender: str) -> str:
+    # Más barato que email.utils.parseaddr y suficiente para comparar remitentes
+    m = _ADDRESS_RE.search(sender)
+    return m.group(0).lower() if m else ""
+
+
+def _sender_matches(sender: str, address: str) -> bool:
+    # Un remitente de plantilla puede ser una dirección o un dominio completo
+    return sender == address or sender == address.rpartition("@")[2]
+
+
+@lru_cache(maxsize=1024)
+def select_templates(sender: Optional[str] = None, subject: Optional[str] = None):
+    """Plantillas candidatas para un correo según remitente y asunto.
+
+    El dominio del remitente acota el banco; dentro del banco el asunto decide el
+    tipo y, si el asunto no dice nada, se usan las plantillas de ese remitente.
+    Los bancos repiten remitentes y asuntos, así que el resultado se cachea.
+    """
+    candidates = TEMPLATES
+    exact = []
+    address = _sender_address(sender) if sender else ""
+    if address:
+        domain = address.rpartition("@")[2]
+        banks = {
+            t.bank
+            for t in TEMPLATES
+            if any(s.rpartition("@")[2] == domain for s in t.senders)
+        }
+        if banks:
+            candidates = [t for t in TEMPLATES if t.bank in banks]
+        exact = [
+            t
+            for t in candidates
+            if any(_sender_matches(s, address) for s in t.senders)
+        ]
+    if subject:
+        by_subject = [
+            t for t in candidates if t.subject is not None and t.subject.search(subject)
+        ]
+        if by_subject:
+            return tuple(by_subject)
+    return tuple(exact or candidates)
+
+
+def _keywords_in(body: str):
+    """Palabras clave presentes en el cuerpo, en un solo recorrido."""
+    if _keyword_re is None:
+        return frozenset()
+    return frozenset(_keyword_re.findall(body.lower()))
+
+
+def _can_match(template: BankTemplate, found) -> bool:
+    if not template.required <= found:
+        return False
+    return not template.keywords or bool(template.keywords & found)
+
+
+def _to_int(amount: str) -> int:
+    return int(amount.replace(".", "").replace(",", "").strip())
+
+
+def _template_date(template: BankTemplate, groups: dict, body: str):
+    if groups.get("date"):
+        if groups.get("time"):
+            return datetime.strptime(
+                f"{groups['date']} {groups['time']}", f"{template.date_format} %H:%M"
+            )
+        return datetime.strptime(groups["date"], template.date_format)
+    for pattern, date_format in template.date_patterns:
+        m = pattern.search(body)
+        if m:
+            try:
+                return datetime.strptime(
+                    f"{m.group('date')} {m.group('time')}", date_format
+                )
+            except ValueError:
+                continue
+    return None
+
+
+def apply_template(
+    template: BankTemplate, body: str, default_date: Optional[datetime] = None
+) -> Optional[ParsedTransaction]:
+    for pattern in template.patterns:
+        m = pattern.search(body)
+        if not m:
+            continue
+        groups = m.groupdict()
+        try:
+            amount = _to_int(groups["amount"])
+            dt = _template_date(template, groups, body)
+        except (ValueError, IndexError):
+            continue
+        if not amount:
+            continue
+        # Limpiar descripción (tomar primeros 100 caracteres)
+        merchant = (groups.get("merchant") or "").strip()[:100].strip()
+        return ParsedTransaction(
+            template.kind,
+            amount,
+            merchant or template.description,
+            # Sin fecha en el cuerpo se usa la del correo (o la actual)
+            dt or default_date or datetime.utcnow(),
+            template.name,
+        )
+    return None
+
+
+def _parse_with(templates, body: str, default_date=None) -> Optional[ParsedTransaction]:
+    found = _keywords_in(body)
+    for template in templates:
+        if not _can_match(template, found):
+            continue
+        parsed = apply_template(template, body, default_date)
+        if parsed:
+            return parsed
+    return None
+
+
+def parse_body(body: str, kinds=ALL_KINDS) -> Optional[ParsedTransaction]:
+    """Parsea un cuerpo sin encabezados probando las plantillas de esos tipos."""
+    return _parse_with([t for t in TEMPLATES if t.kind in kinds], body)
+
+
+def parse(message) -> Optional[ParsedTransaction]:
+    """Parsea un correo bancario.
+
+    message puede ser un FetchedMessage (con headers y body) o directamente el
+    texto del cuerpo; en ese caso se prueban todas las plantillas.
+    """
+    if isinstance(message, str):
+        return parse_body(message)
+    headers = message.headers
+    templates = select_templates(headers.get("From"), headers.get("Subject"))
+    return _parse_with(templates, message.body, message_date(headers))
+
+
+def message_date(headers) -> Optional[datetime]:
+    """Fecha del encabezado Date en la hora local del remitente (sin zona horaria).
+
+    Las fechas de los cuerpos también son locales, así que se descarta la zona.
+    """
+    value = headers.get("Date")
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(str(value)).replace(tzinfo=None)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+register_templates(BANCO_DE_CHILE)
+if BANK_TEMPLATES_FILE:
+    load_templates_file(BANK_TEMPLATES_FILE)
@@ -1,5 +1,7 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # For local dev; in Railway you can replace with Postgres URL via env var
@@ -15,5 +17,52 @@ else:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_url(url: str):
+    """La misma base con el driver async: asyncpg para Postgres, aiosqlite para SQLite."""
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        return url.set(drivername="postgresql+asyncpg")
+    return url.set(drivername="sqlite+aiosqlite")
+
+
+# Engine async para los endpoints de lectura más usados (ver auth.get_async_db):
+# mientras esperan a la base no ocupan un hilo del threadpool de Starlette. Las
+# escrituras, los workers y las migraciones siguen con el engine sync.
+# ASYNC_DATABASE_URL permite otra URL (p. ej. con ?ssl=require para asyncpg).
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+
+if make_url(ASYNC_DATABASE_URL).get_backend_name() == "postgresql":
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, pool_size=ASYNC_DB_POOL_SIZE, max_overflow=ASYNC_DB_POOL_SIZE
+    )
+else:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+
+# Migraciones de Alembic (alembic.ini y migrations/ en la raíz del backend)
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations"
+)
+
+
+def init_db():
+    """Aplica las migraciones pendientes (equivale a alembic upgrade head).
+
+    La API y los workers la llaman al arrancar. Para bases creadas antes de
+    las migraciones la primera (0001) completa lo que falte en lugar de fallar.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    with engine.connect() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+        connection.commit()
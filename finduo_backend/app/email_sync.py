@@ -1,449 +1,577 @@
+import hashlib
 import imaplib
-import email
 import os
-import re
 import logging
-import sys
-from datetime import datetime
+import time
+from typing import NamedTuple, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 
 from .database import SessionLocal
-from .models import Transaction, User
-
-# Configurar logging para que se vea en Railway
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),  # Asegurar que va a stdout
-        logging.StreamHandler(sys.stderr),  # También a stderr por si acaso
-    ],
+from .models import Transaction, User, EmailSyncState
+from .imap_client import FETCH_CHUNK_SIZE, FetchedMessage, ImapSession, decode_message
+from . import bank_parser, rollups, versions
+from .metrics import SYNC_RUNS, SYNC_SECONDS, SyncStats
+from .pipeline import batched, staged
+from .mailboxes import (
+    DEFAULT_IMAP_HOST,
+    DEFAULT_IMAP_PORT,
+    MailboxCredentials,
+    get_credentials,
 )
+
+# El logging lo configura cada punto de entrada con logging_config.setup_logging
 logger = logging.getLogger(__name__)
 
 
-IMAP_HOST = "imap.gmail.com"  # Cambia según tu proveedor de correo
+def get_imap_conn(
+    credentials: Optional[MailboxCredentials] = None, stats: Optional[SyncStats] = None
+):
+    """Abre una conexión IMAP autenticada.
+
+    Sin credenciales usa EMAIL_USER/EMAIL_PASSWORD (modo de un solo buzón).
+    """
+    stats = stats or SyncStats()
+    if credentials is None:
+        user = os.getenv("EMAIL_USER")
+        password = os.getenv("EMAIL_PASSWORD")
+        if not user or not password:
+            raise RuntimeError("EMAIL_USER y EMAIL_PASSWORD deben estar configuradas")
+        credentials = MailboxCredentials(DEFAULT_IMAP_HOST, DEFAULT_IMAP_PORT, user, password)
+
+    with stats.time("connect"):
+        if credentials.security == "ssl":
+            mail = imaplib.IMAP4_SSL(credentials.host, credentials.port)
+        else:
+            mail = imaplib.IMAP4(credentials.host, credentials.port)
+            if credentials.security == "starttls":
+                mail.starttls()
+    with stats.time("login"):
+        mail.login(credentials.username, credentials.password)
+    return mail
+
+
+# Remitentes a buscar: los de las plantillas registradas en bank_parser
+BANK_SENDERS = bank_parser.sender_addresses()
 
+# Ubicaciones donde buscar (INBOX + etiquetas de Gmail)
+SYNC_LOCATIONS = ["INBOX", "INBOX/Compras", "INBOX/Bancos"]
 
-def get_imap_conn():
-    user = os.getenv("EMAIL_USER")
-    password = os.getenv("EMAIL_PASSWORD")
-    if not user or not password:
-        raise RuntimeError("EMAIL_USER y EMAIL_PASSWORD deben estar configuradas")
+# En la primera sincronización de una carpeta (o tras un cambio de
+# UIDVALIDITY) solo se importan los últimos N correos del banco
+INITIAL_SYNC_LIMIT = int(os.getenv("EMAIL_INITIAL_SYNC_LIMIT", "30"))
 
-    mail = imaplib.IMAP4_SSL(IMAP_HOST)
-    mail.login(user, password)
-    return mail
 
+def open_imap_session(
+    credentials: Optional[MailboxCredentials] = None, stats: Optional[SyncStats] = None
+):
+    """Abre una sesión IMAP autenticada (una sola conexión para todas las carpetas)."""
+    if credentials is None:
+        account = os.getenv("EMAIL_USER")
+    else:
+        account = f"{credentials.username}@{credentials.host}"
+    return ImapSession(get_imap_conn(credentials, stats), account)
 
-def fetch_bank_emails():
-    """Obtiene los últimos correos del Banco de Chile desde INBOX y etiquetas."""
-    mail = get_imap_conn()
 
-    # Lista de ubicaciones donde buscar (INBOX + etiquetas de Gmail)
-    locations = ["INBOX", "INBOX/Compras", "INBOX/Bancos"]
+def _get_sync_state(db, user_id, folder):
+    return (
+        db.query(EmailSyncState)
+        .filter(EmailSyncState.user_id == user_id, EmailSyncState.folder == folder)
+        .first()
+    )
 
-    # Buscar correos de ambas direcciones en todas las ubicaciones
-    all_email_ids = set()
 
-    # Buscar en cada ubicación
-    for location in locations:
+def update_sync_state(db, user_id, location, uidvalidity, last_uid, state=None):
+    """Guarda la marca de agua de una carpeta (sin commit).
+
+    Si UIDVALIDITY cambió la marca se reemplaza; si no, solo avanza.
+    """
+    state = state or _get_sync_state(db, user_id, location)
+    if state is None or state.uidvalidity != uidvalidity:
+        if state is None:
+            state = EmailSyncState(user_id=user_id, folder=location)
+            db.add(state)
+        state.uidvalidity = uidvalidity
+        state.last_uid = last_uid or 0
+    elif last_uid is not None and last_uid > state.last_uid:
+        state.last_uid = last_uid
+    return state
+
+
+class FolderPlan(NamedTuple):
+    """Carpeta seleccionada y UIDs a sincronizar."""
+
+    location: str
+    folder: str
+    uidvalidity: Optional[int]
+    uidnext: Optional[int]
+    uids: list
+    state: Optional[EmailSyncState]
+
+
+def plan_folder(
+    session, location, db=None, user_id=None, stats: Optional[SyncStats] = None
+) -> Optional[FolderPlan]:
+    """Selecciona la carpeta y busca los UIDs del banco que faltan por importar.
+
+    Con db y user_id la sincronización es incremental: se guarda UIDVALIDITY y el
+    último UID visto de la carpeta, y solo se buscan UIDs posteriores. Si
+    UIDVALIDITY cambia se descarta la marca y se resincroniza la carpeta.
+    Devuelve None si la carpeta no existe o no se pudo consultar.
+    """
+    incremental = db is not None and user_id is not None
+    stats = stats or SyncStats()
+
+    with stats.time("select"):
+        folder = session.resolve_folder(location)
+        if folder is None:
+            logger.info(f"La carpeta {location} no existe, saltando...")
+            return None
         try:
-            # Intentar seleccionar la ubicación
-            try:
-                status = mail.select(location)
-                logger.info(f"Seleccionando {location}: {status}")
-            except Exception as e:
-                # Si falla, intentar con formato alternativo
-                try:
-                    alt_location = location.replace("INBOX/", "")
-                    status = mail.select(f'"[Gmail]/{alt_location}"')
-                    logger.info(f"Seleccionando [Gmail]/{alt_location}: {status}")
-                except Exception:
-                    logger.warning(f"No se pudo acceder a {location}, saltando...")
-                    continue
-
-            # Buscar correos de enviodigital@bancochile.cl
-            try:
-                status, data = mail.search(None, "FROM", "enviodigital@bancochile.cl")
-                logger.info(f"Búsqueda enviodigital en {location}: status={status}")
-                if status == "OK" and data and data[0]:
-                    email_ids_str = (
-                        data[0].decode() if isinstance(data[0], bytes) else str(data[0])
-                    )
-                    email_ids_str = email_ids_str.strip()
-                    if email_ids_str:
-                        found_ids = email_ids_str.split()
-                        logger.info(
-                            f"Encontrados {len(found_ids)} correos de enviodigital@bancochile.cl en {location}"
-                        )
-                        all_email_ids.update(found_ids)
-                else:
-                    logger.debug(
-                        f"No se encontraron correos de enviodigital en {location}"
-                    )
-            except Exception as e:
-                logger.warning(f"Error buscando enviodigital en {location}: {e}")
+            uidvalidity, uidnext = session.select(folder)
+        except Exception as e:
+            logger.warning(f"No se pudo acceder a {folder}: {e}")
+            return None
 
-            # Buscar correos de serviciodetransferencias@bancochile.cl
-            try:
-                status, data = mail.search(
-                    None, "FROM", "serviciodetransferencias@bancochile.cl"
-                )
+    state = _get_sync_state(db, user_id, location) if incremental else None
+    search_started = time.perf_counter()
+    try:
+        if state is not None and state.uidvalidity == uidvalidity:
+            uids = session.search_from(BANK_SENDERS, min_uid=state.last_uid + 1)
+        else:
+            if state is not None:
                 logger.info(
-                    f"Búsqueda serviciodetransferencias en {location}: status={status}"
+                    f"UIDVALIDITY de {location} cambió ({state.uidvalidity} -> {uidvalidity}), resincronizando"
                 )
-                if status == "OK" and data and data[0]:
-                    email_ids_str = (
-                        data[0].decode() if isinstance(data[0], bytes) else str(data[0])
-                    )
-                    email_ids_str = email_ids_str.strip()
-                    if email_ids_str:
-                        found_ids = email_ids_str.split()
-                        logger.info(
-                            f"Encontrados {len(found_ids)} correos de serviciodetransferencias@bancochile.cl en {location}"
-                        )
-                        all_email_ids.update(found_ids)
-                else:
-                    logger.debug(
-                        f"No se encontraron correos de serviciodetransferencias en {location}"
-                    )
-            except Exception as e:
-                logger.warning(
-                    f"Error buscando serviciodetransferencias en {location}: {e}"
+            uids = session.search_from(BANK_SENDERS)
+            if len(uids) > INITIAL_SYNC_LIMIT:
+                logger.info(
+                    f"Primera sincronización de {location}: procesando últimos {INITIAL_SYNC_LIMIT} de {len(uids)}"
                 )
+                uids = uids[-INITIAL_SYNC_LIMIT:]
+    except Exception as e:
+        logger.warning(f"Error buscando correos en {folder}: {e}")
+        return None
+    finally:
+        stats.observe("search", time.perf_counter() - search_started)
+
+    logger.info(f"Procesando {len(uids)} correos de {folder}")
+    return FolderPlan(location, folder, uidvalidity, uidnext, uids, state)
+
+
+def finish_folder(db, user_id, plan: FolderPlan, failed_uid=None):
+    """Avanza la marca de agua de la carpeta (sin commit).
+
+    Si un fetch falló en failed_uid la próxima sincronización sigue desde ahí.
+    """
+    if plan.uidvalidity is None:
+        return
+    if failed_uid is not None:
+        new_last_uid = failed_uid - 1
+    elif plan.uidnext:
+        new_last_uid = plan.uidnext - 1
+    else:
+        new_last_uid = plan.uids[-1] if plan.uids else None
+    update_sync_state(
+        db, user_id, plan.location, plan.uidvalidity, new_last_uid, plan.state
+    )
 
-        except Exception as e:
-            logger.warning(f"Error procesando ubicación {location}: {e}")
-            continue
-
-    logger.info(f"Total de IDs de correos encontrados: {len(all_email_ids)}")
 
-    if not all_email_ids:
-        logger.warning(
-            "No se encontraron correos. Verificando si hay correos en el INBOX..."
+def _log_fetched(message):
+    # Se llama por cada correo: leer los encabezados cuesta más que el log, así
+    # que solo se hace si DEBUG está activo
+    if logger.isEnabledFor(logging.DEBUG):
+        subject = str(message.headers.get("Subject", "Sin asunto"))
+        from_addr = str(message.headers.get("From", "Sin remitente"))
+        logger.debug(
+            "Correo UID %s: From=%s, Subject=%s", message.uid, from_addr[:50], subject[:50]
         )
-        try:
-            # Intentar buscar todos los correos recientes para debug
-            status, data = mail.search(None, "ALL")
-            if status == "OK" and data and data[0]:
-                all_ids = (
-                    data[0].decode() if isinstance(data[0], bytes) else str(data[0])
-                )
-                all_ids = all_ids.strip()
-                total = len(all_ids.split()) if all_ids else 0
-                logger.info(f"Total de correos en INBOX: {total}")
-        except Exception as e:
-            logger.error(f"Error contando correos: {e}", exc_info=True)
+    if not message.body:
+        logger.warning("Correo UID %s: No se pudo extraer contenido", message.uid)
 
-        mail.logout()
-        return []
 
-    # Cerrar conexión actual y abrir una nueva para leer los correos desde INBOX
-    mail.logout()
-    mail = get_imap_conn()
-    mail.select("INBOX")  # Seleccionar INBOX para leer los correos
+def _raw_size(raw):
+    return len(raw.raw_headers or b"") + sum(len(part[3] or b"") for part in raw.parts)
 
-    # Ordenar y tomar los últimos 30
-    try:
-        email_ids = sorted(
-            list(all_email_ids),
-            key=lambda x: int(x.decode() if isinstance(x, bytes) else x),
-        )[-30:]
-    except Exception as e:
-        logger.error(f"Error ordenando IDs: {e}", exc_info=True)
-        email_ids = list(all_email_ids)[-30:]
 
-    logger.info(
-        f"Procesando {len(email_ids)} correos (últimos 30 de {len(all_email_ids)} encontrados)"
-    )
+def fetch_batches(session, uids, size=None, stats: Optional[SyncStats] = None):
+    """Descarga los RawMessage por lotes registrando la latencia y los bytes de cada lote."""
+    size = size or FETCH_CHUNK_SIZE
+    stats = stats or SyncStats()
+    batches = batched(session.fetch_raw(uids, size), size)
+    try:
+        while True:
+            start = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                return
+            stats.observe("fetch", time.perf_counter() - start)
+            stats.fetched(len(batch), sum(_raw_size(raw) for raw in batch))
+            yield batch
+    finally:
+        batches.close()
+
+
+def sync_folder(session, location, db=None, user_id=None, stats=None):
+    """Obtiene los correos nuevos del banco de una carpeta usando una sesión abierta.
+
+    Ver plan_folder para el modo incremental. Los cambios de estado quedan en la
+    sesión de base de datos sin commit. Devuelve los FetchedMessage que tienen
+    contenido.
+    """
     messages = []
-    for i, eid in enumerate(email_ids):
-        try:
-            eid_str = eid.decode() if isinstance(eid, bytes) else str(eid)
-            status, msg_data = mail.fetch(eid_str, "(RFC822)")
-            if status != "OK":
-                logger.warning(
-                    f"Error fetch correo {i+1} (ID: {eid_str}): status={status}"
-                )
-                continue
-            msg = email.message_from_bytes(msg_data[0][1])
+    stats = stats or SyncStats()
+    plan = plan_folder(session, location, db, user_id, stats)
+    if plan is None:
+        return messages
 
-            # Log del asunto para debugging
-            subject = msg.get("Subject", "Sin asunto")
-            from_addr = msg.get("From", "Sin remitente")
-            logger.info(f"Correo {i+1}: From={from_addr[:50]}, Subject={subject[:50]}")
+    done = set()
+    failed_uid = None
+    try:
+        for raws in fetch_batches(session, plan.uids, stats=stats):
+            with stats.time("decode"):
+                batch = [decode_message(raw) for raw in raws]
+            for fetched in batch:
+                done.add(fetched.uid)
+                _log_fetched(fetched)
+                if fetched.body:
+                    messages.append(fetched)
+                else:
+                    stats.count("empty")
+    except Exception as e:
+        logger.error(f"Error obteniendo correos de {plan.folder}: {e}", exc_info=True)
+        failed_uid = min(uid for uid in plan.uids if uid not in done)
 
-        except Exception as e:
-            logger.error(
-                f"Error procesando correo {i+1} (ID: {eid}): {e}", exc_info=True
-            )
-            continue
+    if db is not None and user_id is not None:
+        finish_folder(db, user_id, plan, failed_uid)
+    return messages
 
-        if msg.is_multipart():
-            body = ""
-            html_body = ""
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                if content_type == "text/plain":
-                    try:
-                        payload = part.get_payload(decode=True)
-                        if payload:
-                            body += payload.decode("utf-8", errors="ignore")
-                    except Exception as e:
-                        logger.debug(f"Error decodificando text/plain: {e}")
-                elif content_type == "text/html":
-                    try:
-                        payload = part.get_payload(decode=True)
-                        if payload:
-                            html_body += payload.decode("utf-8", errors="ignore")
-                    except Exception as e:
-                        logger.debug(f"Error decodificando text/html: {e}")
-
-            # Si no hay texto plano, usar HTML
-            if not body and html_body:
-                # Intentar extraer texto del HTML (básico)
-                import re as re_module
-
-                body = re_module.sub(r"<[^>]+>", " ", html_body)
-                body = re_module.sub(r"\s+", " ", body)
-
-            if body:
-                messages.append(body)
-            else:
-                logger.warning(f"Correo {i+1}: No se pudo extraer contenido")
-        else:
-            try:
-                body = msg.get_payload(decode=True)
-                if body:
-                    body = body.decode("utf-8", errors="ignore")
-                    messages.append(body)
-                else:
-                    logger.warning(f"Correo {i+1}: Payload vacío")
-            except Exception as e:
-                logger.error(f"Error decodificando correo simple: {e}", exc_info=True)
 
-    mail.logout()
+def fetch_bank_emails(
+    db=None, user_id=None, credentials=None, session=None, locations=None, stats=None
+):
+    """Obtiene los correos nuevos del Banco de Chile desde INBOX y etiquetas.
+
+    Ver sync_folder para el modo incremental. El llamador hace el commit del
+    estado junto con las transacciones importadas. Sin credentials se usa el
+    buzón de EMAIL_USER; con session se reutiliza una conexión ya abierta. Los
+    tiempos y contadores se acumulan en stats (un SyncStats) si se entrega.
+    """
+    messages = []
+    locations = locations or SYNC_LOCATIONS
+    stats = stats or SyncStats()
+    if session is not None:
+        for location in locations:
+            messages += sync_folder(session, location, db, user_id, stats)
+    else:
+        with open_imap_session(credentials, stats) as session:
+            for location in locations:
+                messages += sync_folder(session, location, db, user_id, stats)
+
+    logger.info(f"Total de correos obtenidos: {len(messages)}")
     return messages
 
 
 def parse_purchase(body: str):
-    # Patrones más flexibles para compras/cargos
-    patterns = [
-        # Patrón original
-        re.compile(
-            r"compra por \$([\d\.]+)\s+con cargo a Cuenta \*+(\d+)\s+en (.+?) el (\d{2}/\d{2}/\d{4}) (\d{2}:\d{2})",
-            re.IGNORECASE | re.DOTALL,
-        ),
-        # Variación sin asteriscos en cuenta
-        re.compile(
-            r"compra por \$([\d\.]+)\s+con cargo a Cuenta\s+(\d+)\s+en (.+?) el (\d{2}/\d{2}/\d{4}) (\d{2}:\d{2})",
-            re.IGNORECASE | re.DOTALL,
-        ),
-        # Cargo en Cuenta - formato común
-        re.compile(
-            r"cargo.*?cuenta.*?\$([\d\.]+).*?en (.+?)(?: el| fecha|,)\s*(\d{2}/\d{2}/\d{4})(?:\s+(\d{2}:\d{2}))?",
-            re.IGNORECASE | re.DOTALL,
-        ),
-        # Variación con "Cargo en Cuenta" en el título
-        re.compile(
-            r"(?:cargo|compra).*?\$([\d\.]+).*?(?:en|en|de)\s+(.+?)(?:\s+el|\s+fecha|,)\s*(\d{2}/\d{2}/\d{4})(?:\s+(\d{2}:\d{2}))?",
-            re.IGNORECASE | re.DOTALL,
-        ),
-        # Variación más flexible
-        re.compile(
-            r"compra.*?\$([\d\.]+).*?en (.+?) el (\d{2}/\d{2}/\d{4}) (\d{2}:\d{2})",
-            re.IGNORECASE | re.DOTALL,
-        ),
-        # Buscar cualquier monto seguido de fecha
-        re.compile(
-            r"\$([\d\.]+).*?(?:cargo|compra|pago).*?(\d{2}/\d{2}/\d{4})(?:\s+(\d{2}:\d{2}))?",
-            re.IGNORECASE | re.DOTALL,
-        ),
-    ]
+    """Parsea un correo de compra/cargo; devuelve un dict o None."""
+    parsed = bank_parser.parse_body(body, (bank_parser.PURCHASE,))
+    return parsed._asdict() if parsed else None
 
-    for pattern_num, pattern in enumerate(patterns):
-        m = pattern.search(body)
-        if m:
-            try:
-                groups = m.groups()
-                logger.debug(
-                    f"Patrón {pattern_num + 1} coincidió, grupos: {len(groups)}"
-                )
 
-                if len(groups) >= 3:
-                    # Extraer monto
-                    amount_str = groups[0].replace(".", "").replace(",", "").strip()
-                    amount = int(amount_str)
-
-                    # Extraer descripción
-                    if len(groups) >= 4:
-                        merchant = groups[1].strip()
-                        date_str = groups[2]
-                        time_str = (
-                            groups[3] if len(groups) > 3 and groups[3] else "00:00"
-                        )
-                    elif len(groups) == 3:
-                        # Formato: monto, fecha, hora opcional
-                        merchant = "Compra"  # Descripción por defecto
-                        date_str = groups[1] if "/" in groups[1] else groups[2]
-                        time_str = groups[2] if ":" in str(groups[2]) else "00:00"
-                    else:
-                        continue
-
-                    # Limpiar descripción (tomar primeros 100 caracteres)
-                    merchant = merchant[:100].strip() if merchant else "Compra"
-
-                    # Parsear fecha y hora
-                    if time_str and ":" in str(time_str):
-                        dt = datetime.strptime(
-                            f"{date_str} {time_str}", "%d/%m/%Y %H:%M"
-                        )
-                    else:
-                        dt = datetime.strptime(f"{date_str}", "%d/%m/%Y")
-
-                    logger.info(f"Compra parseada: ${amount} CLP en {merchant} el {dt}")
-                    return dict(
-                        type="purchase",
-                        amount=amount,
-                        description=merchant,
-                        date_time=dt,
-                    )
-            except (ValueError, IndexError, AttributeError) as e:
-                logger.debug(
-                    f"Error parseando compra con patrón {pattern_num + 1}: {e}"
-                )
-                continue
+def parse_transfer(body: str):
+    """Parsea un correo de transferencia; devuelve un dict o None."""
+    parsed = bank_parser.parse_body(body, (bank_parser.TRANSFER,))
+    return parsed._asdict() if parsed else None
+
+
+def message_key(message) -> str:
+    """Clave de deduplicación de un correo: su Message-ID o un hash del contenido."""
+    if isinstance(message, str):
+        body = message
+    else:
+        message_id = str(message.headers.get("Message-ID") or "").strip()
+        if message_id:
+            return message_id[:255]
+        body = message.body
+    return "sha256:" + hashlib.sha256(body.encode("utf-8", "ignore")).hexdigest()
+
+
+def _insert_ignore(db):
+    """INSERT que ignora las filas cuya clave (user_id, source_message_id) ya existe.
+
+    Con RETURNING solo vuelven las filas insertadas, con las columnas que
+    necesitan los resúmenes (app.rollups).
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        stmt = postgresql_insert(Transaction).on_conflict_do_nothing(
+            index_elements=["user_id", "source_message_id"]
+        )
+    else:
+        stmt = insert(Transaction).prefix_with("OR IGNORE")
+    return stmt.returning(
+        Transaction.id,
+        Transaction.user_id,
+        Transaction.duo_room_id,
+        Transaction.type,
+        Transaction.amount,
+        Transaction.date_time,
+    )
 
-    return None
 
+def _legacy_duplicates(db, user_id, items):
+    """Claves de items que coinciden con transacciones importadas sin clave.
 
-def parse_transfer(body: str):
-    # Patrones más flexibles para transferencias
-    patterns = [
-        re.compile(r"monto\s+\$([\d\.]+)", re.IGNORECASE),
-        re.compile(
-            r"transferencia.*?a\s+terceros.*?\$([\d\.]+)", re.IGNORECASE | re.DOTALL
-        ),
-        re.compile(r"transferencia.*?\$([\d\.]+)", re.IGNORECASE | re.DOTALL),
-        re.compile(r"\$([\d\.]+).*?transferencia", re.IGNORECASE | re.DOTALL),
-        re.compile(r"monto.*?(\d+[\.\d]*)", re.IGNORECASE),
+    Las transacciones anteriores a source_message_id no tienen clave; se
+    comparan por tipo, monto, descripción y fecha en una sola consulta.
+    """
+    dates = {parsed.date_time for _, parsed in items}
+    existing = set(
+        db.query(
+            Transaction.type,
+            Transaction.amount,
+            Transaction.description,
+            Transaction.date_time,
+        )
+        .filter(
+            Transaction.user_id == user_id,
+            Transaction.source_message_id.is_(None),
+            Transaction.date_time.in_(dates),
+        )
+        .all()
+    )
+    if not existing:
+        return set()
+    return {
+        key
+        for key, parsed in items
+        if (parsed.type, parsed.amount, parsed.description, parsed.date_time)
+        in existing
+    }
+
+
+def insert_parsed(db, user_id: int, items) -> int:
+    """Inserta transacciones parseadas omitiendo las ya importadas (sin commit).
+
+    items son pares (clave del correo, ParsedTransaction). La deduplicación la
+    hace la base de datos con el índice único (user_id, source_message_id):
+    una sentencia INSERT ... ON CONFLICT DO NOTHING (Postgres) o INSERT OR
+    IGNORE (SQLite) por lote, que SQLAlchemy envía como INSERT de varias filas.
+    Las filas nuevas se suman a los resúmenes de gasto, aumentan la versión
+    de datos del usuario y quedan marcadas con ella (para
+    /transactions/changes) en la misma transacción. Devuelve cuántas filas se
+    insertaron.
+    """
+    unique = dict(items)  # una sola fila por correo dentro del lote
+    if not unique:
+        return 0
+    legacy = _legacy_duplicates(db, user_id, unique.items())
+    rows = [
+        dict(
+            user_id=user_id,
+            type=parsed.type,
+            description=parsed.description,
+            amount=parsed.amount,
+            currency="CLP",
+            date_time=parsed.date_time,
+            source_message_id=key,
+        )
+        for key, parsed in unique.items()
+        if key not in legacy
     ]
+    if not rows:
+        return 0
+    inserted = db.execute(_insert_ignore(db), rows).all()
+    rollups.apply(db, inserted)
+    versions.touch(db, inserted)
+    return len(inserted)
 
-    amount = None
-    for pattern in patterns:
-        m = pattern.search(body)
-        if m:
-            try:
-                amount_str = m.group(1).replace(".", "").replace(",", "").strip()
-                amount = int(amount_str)
-                break
-            except (ValueError, IndexError):
-                continue
 
-    if not amount:
-        return None
+def import_parsed(db, user: User, results, start=1):
+    """Agrega a la sesión las transacciones nuevas (sin commit).
 
-    # Intentar parsear fecha del correo
-    date_patterns = [
-        re.compile(r"(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2})", re.IGNORECASE),
-        re.compile(r"(\d{2}-\d{2}-\d{4})\s+(\d{2}:\d{2})", re.IGNORECASE),
-    ]
+    results son pares (mensaje, parseado), donde parseado es un
+    ParsedTransaction, None si el correo no coincide con ninguna plantilla o la
+    excepción si falló el parseo. Devuelve un dict con los contadores imported,
+    skipped y errors.
+    """
+    items = []
+    errors = 0
 
-    dt = datetime.utcnow()  # Por defecto usar fecha actual
-    for pattern in date_patterns:
-        m = pattern.search(body)
-        if m:
-            try:
-                date_str, time_str = m.groups()
-                if "/" in date_str:
-                    dt = datetime.strptime(f"{date_str} {time_str}", "%d/%m/%Y %H:%M")
-                else:
-                    dt = datetime.strptime(f"{date_str} {time_str}", "%d-%m-%Y %H:%M")
-                break
-            except ValueError:
-                continue
-
-    return dict(
-        type="transfer_out",
-        amount=amount,
-        description="Transferencia a terceros",
-        date_time=dt,
-    )
+    for i, (message, parsed) in enumerate(results, start):
+        if isinstance(parsed, Exception):
+            logger.error("Correo %s: Error al procesar - %s", i, parsed, exc_info=parsed)
+            errors += 1
+            continue
+        if not parsed:
+            logger.warning("Correo %s: No se pudo parsear (no coincide con patrones)", i)
+            if logger.isEnabledFor(logging.DEBUG):
+                # Mostrar un preview del correo para debugging
+                body = message if isinstance(message, str) else message.body
+                logger.debug("Preview: %s...", body[:200].replace("\n", " ").strip())
+            continue
+        items.append((message_key(message), parsed))
 
+    imported = insert_parsed(db, user.id, items)
+    skipped = len(items) - imported
+    if items:
+        logger.info(
+            f"Lote de {len(items)} transacciones: {imported} nuevas, {skipped} duplicadas"
+        )
+    return dict(imported=imported, skipped=skipped, errors=errors)
 
-def sync_emails_to_db(user_email: str):
-    """Lee correos y crea transacciones para un usuario."""
-    db = SessionLocal()
-    user = db.query(User).filter(User.email == user_email).first()
-    if not user:
-        user = User(email=user_email, name="Usuario FinDuo")
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-
-    logger.info("Iniciando sincronización de correos...")
+
+def _parse_safely(message):
     try:
-        bodies = fetch_bank_emails()
-        logger.info(f"Se encontraron {len(bodies)} correos para procesar")
+        return bank_parser.parse(message)
     except Exception as e:
-        logger.error(f"Error al obtener correos: {e}", exc_info=True)
-        db.close()
-        return 0
+        return e
 
-    count = 0
-    skipped = 0
-    errors = 0
 
-    for i, body in enumerate(bodies):
-        try:
-            info = parse_purchase(body) or parse_transfer(body)
-            if not info:
-                # Mostrar un preview del correo para debugging
-                preview = body[:200].replace("\n", " ").strip()
-                logger.warning(
-                    f"Correo {i+1}: No se pudo parsear (no coincide con patrones)"
-                )
-                logger.debug(f"Preview: {preview}...")
-                continue
-
-            # Verificar si la transacción ya existe (evitar duplicados)
-            existing = (
-                db.query(Transaction)
-                .filter(
-                    Transaction.user_id == user.id,
-                    Transaction.type == info["type"],
-                    Transaction.amount == info["amount"],
-                    Transaction.description == info["description"],
-                    Transaction.date_time == info["date_time"],
-                )
-                .first()
-            )
+def import_messages(db, user: User, messages):
+    """Parsea los correos y agrega las transacciones nuevas a la sesión (sin commit).
 
-            if existing:
-                logger.info(
-                    f"Correo {i+1}: Transacción duplicada - {info['type']} ${info['amount']} CLP en {info['date_time']}"
-                )
-                skipped += 1
-                continue
-
-            tx = Transaction(
-                user_id=user.id,
-                type=info["type"],
-                description=info["description"],
-                amount=info["amount"],
-                date_time=info["date_time"],
-            )
-            db.add(tx)
-            count += 1
-            logger.info(
-                f"Correo {i+1}: Transacción creada - {info['type']} ${info['amount']} CLP en {info['date_time']}"
-            )
+    messages son FetchedMessage (o textos de correo). Ver import_parsed.
+    """
+    return import_parsed(db, user, ((m, _parse_safely(m)) for m in messages))
+
+
+def _decode_and_parse(raws, stats: Optional[SyncStats] = None):
+    """Etapa de decodificación y parseo de un lote de RawMessage.
+
+    Devuelve (UIDs del lote, pares (mensaje, parseado) de los que tienen texto).
+    """
+    stats = stats or SyncStats()
+    results = []
+    decode_seconds = parse_seconds = 0.0
+    for raw in raws:
+        start = time.perf_counter()
+        try:
+            message = decode_message(raw)
         except Exception as e:
-            logger.error(f"Correo {i+1}: Error al procesar - {str(e)}", exc_info=True)
-            errors += 1
+            results.append((FetchedMessage(raw.uid, {}, ""), e))
+            stats.count("error")
             continue
-
+        finally:
+            decode_seconds += time.perf_counter() - start
+        _log_fetched(message)
+        if not message.body:
+            stats.count("empty")
+            continue
+        start = time.perf_counter()
+        parsed = _parse_safely(message)
+        parse_seconds += time.perf_counter() - start
+        if isinstance(parsed, Exception):
+            stats.count("error")
+        else:
+            stats.template(parsed.template if parsed else None)
+            if not parsed:
+                stats.count("unparsed")
+        results.append((message, parsed))
+    stats.observe("decode", decode_seconds)
+    stats.observe("parse", parse_seconds)
+    return [raw.uid for raw in raws], results
+
+
+def sync_folder_to_db(session, db, user: User, plan: FolderPlan, totals, stats=None):
+    """Importa una carpeta con un pipeline fetch -> decodificación/parseo -> inserción.
+
+    La descarga IMAP y la decodificación corren en sus propios hilos, unidas por
+    colas acotadas, mientras este hilo inserta y hace commit por lote; así la
+    memoria no depende de cuántos correos haya. Suma los contadores en totals.
+    """
+    stats = stats or SyncStats()
+    raw_batches = staged(
+        fetch_batches(session, plan.uids, stats=stats), name="imap-fetch"
+    )
+    parsed_batches = staged(
+        raw_batches, lambda raws: _decode_and_parse(raws, stats), name="decode-parse"
+    )
+    done = set()
+    failed_uid = None
+    try:
+        while True:
+            try:
+                batch = next(parsed_batches, None)
+            except Exception as e:
+                logger.error(
+                    f"Error obteniendo correos de {plan.folder}: {e}", exc_info=True
+                )
+                failed_uid = min(uid for uid in plan.uids if uid not in done)
+                break
+            if batch is None:
+                break
+            uids, results = batch
+            with stats.time("insert"):
+                result = import_parsed(db, user, results, start=totals["messages"] + 1)
+                db.commit()
+            stats.count("imported", result["imported"])
+            stats.count("duplicate", result["skipped"])
+            done.update(uids)
+            totals["messages"] += len(results)
+            for key, value in result.items():
+                totals[key] += value
+    finally:
+        parsed_batches.close()
+
+    finish_folder(db, user.id, plan, failed_uid)
     db.commit()
-    logger.info(f"Resumen: {count} importadas, {skipped} duplicadas, {errors} errores")
-    db.close()
-    return count
+
+
+def _sync_session(db, user: User, session, locations, stats):
+    totals = dict(imported=0, skipped=0, errors=0, messages=0)
+    for location in locations or SYNC_LOCATIONS:
+        plan = plan_folder(session, location, db, user.id, stats)
+        if plan is not None:
+            sync_folder_to_db(session, db, user, plan, totals, stats)
+
+    logger.info(f"Se procesaron {totals.pop('messages')} correos")
+    logger.info(
+        f"Resumen: {totals['imported']} importadas, {totals['skipped']} duplicadas, {totals['errors']} errores"
+    )
+    return totals
+
+
+def sync_emails_to_db(user_email: str, session=None, locations=None):
+    """Lee correos y crea transacciones para un usuario.
+
+    Devuelve un dict con los contadores imported, skipped y errors, y en metrics
+    el tiempo por etapa y los contadores de esta sincronización (ver SyncStats).
+    Si no se puede abrir la conexión IMAP la excepción se propaga al llamador.
+    Con session se reutiliza una conexión IMAP abierta (por ejemplo desde
+    idle_sync).
+    """
+    stats = SyncStats()
+    started = time.perf_counter()
+    status = "error"
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == user_email).first()
+        if not user:
+            user = User(email=user_email, name="Usuario FinDuo")
+            db.add(user)
+            db.commit()
+            db.refresh(user)
+
+        logger.info("Iniciando sincronización de correos...")
+        if session is not None:
+            result = _sync_session(db, user, session, locations, stats)
+        else:
+            try:
+                session = open_imap_session(get_credentials(db, user), stats)
+            except Exception as e:
+                logger.error(f"Error al obtener correos: {e}", exc_info=True)
+                raise
+            with session:
+                result = _sync_session(db, user, session, locations, stats)
+        status = "ok"
+    finally:
+        db.close()
+        elapsed = time.perf_counter() - started
+        SYNC_RUNS.inc(status=status)
+        SYNC_SECONDS.observe(elapsed)
+
+    metrics = stats.to_dict()
+    metrics["seconds"]["total"] = round(elapsed, 4)
+    result["metrics"] = metrics
+    return result
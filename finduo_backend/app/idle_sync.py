@@ -0,0 +1,197 @@
+"""Sincronización casi en tiempo real con IMAP IDLE.
+
+Uso: python -m app.idle_sync [--max-sessions N] [--shard I/N]
+
+Mantiene una conexión IDLE sobre INBOX por cada buzón registrado (hasta
+IDLE_MAX_SESSIONS por proceso). Cuando el servidor avisa de correos nuevos
+(EXISTS) se buscan solo los UIDs posteriores a la marca de agua y se importan
+con el mismo flujo que /sync-email. Si el servidor no soporta IDLE se
+consulta con NOOP cada IDLE_POLL_SECONDS y solo se sincroniza si respondió
+EXISTS. Con --shard los buzones se reparten entre varios procesos según
+user_id.
+"""
+import argparse
+import logging
+import os
+import random
+import signal
+import threading
+
+from .database import SessionLocal, init_db
+from .models import Mailbox, User
+from .mailboxes import get_credentials
+from .email_sync import open_imap_session, sync_emails_to_db
+from .logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+# Conexiones IDLE simultáneas por proceso
+IDLE_MAX_SESSIONS = int(os.getenv("IDLE_MAX_SESSIONS", "100"))
+
+# Segundos antes de renovar el IDLE (los servidores lo cortan a los ~29 minutos)
+IDLE_RENEW_SECONDS = int(os.getenv("IDLE_RENEW_SECONDS", str(25 * 60)))
+
+# Segundos entre consultas con NOOP si el servidor no soporta IDLE
+IDLE_POLL_SECONDS = int(os.getenv("IDLE_POLL_SECONDS", "300"))
+
+# Espera máxima entre reconexiones (backoff exponencial)
+IDLE_BACKOFF_MAX = int(os.getenv("IDLE_BACKOFF_MAX", "300"))
+
+# Cada cuánto se revisa si hay buzones nuevos o desactivados
+IDLE_REFRESH_SECONDS = int(os.getenv("IDLE_REFRESH_SECONDS", "60"))
+
+IDLE_FOLDER = "INBOX"
+
+
+class MailboxWatcher:
+    """Hilo que mantiene la sesión IDLE de un buzón y reconecta si se cae."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"idle-{user_id}", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _open_session(self):
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.id == self.user_id).first()
+            if user is None:
+                raise RuntimeError("Usuario no encontrado")
+            return user.email, open_imap_session(get_credentials(db, user))
+        finally:
+            db.close()
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                user_email, session = self._open_session()
+                with session:
+                    # Ponerse al día con lo que llegó mientras no había conexión
+                    sync_emails_to_db(user_email, session=session)
+                    session.select(session.resolve_folder(IDLE_FOLDER) or IDLE_FOLDER)
+                    backoff = 1
+                    while not self._stop.is_set():
+                        if session.supports_idle():
+                            has_new = session.idle(IDLE_RENEW_SECONDS, self._stop)
+                        else:
+                            self._stop.wait(IDLE_POLL_SECONDS)
+                            has_new = (
+                                not self._stop.is_set() and session.has_new_messages()
+                            )
+                        if has_new and not self._stop.is_set():
+                            # Deja INBOX seleccionada para el próximo IDLE
+                            result = sync_emails_to_db(
+                                user_email, session=session, locations=[IDLE_FOLDER]
+                            )
+                            if result["imported"]:
+                                logger.info(
+                                    f"IDLE usuario={self.user_id}: {result['imported']} transacciones nuevas"
+                                )
+            except Exception as e:
+                delay = min(backoff, IDLE_BACKOFF_MAX) * random.uniform(0.5, 1.5)
+                logger.warning(
+                    f"Sesión IDLE usuario={self.user_id} interrumpida: {e}. Reintentando en {delay:.0f}s"
+                )
+                backoff = min(backoff * 2, IDLE_BACKOFF_MAX)
+                self._stop.wait(delay)
+
+
+class IdleSyncManager:
+    """Mantiene un MailboxWatcher por buzón registrado, con un máximo por proceso."""
+
+    def __init__(self, max_sessions=IDLE_MAX_SESSIONS, shard=0, shards=1):
+        self.max_sessions = max_sessions
+        self.shard = shard
+        self.shards = shards
+        self.watchers = {}
+
+    def _wanted_user_ids(self):
+        db = SessionLocal()
+        try:
+            query = db.query(Mailbox.user_id).filter(Mailbox.enabled.is_(True))
+            if self.shards > 1:
+                query = query.filter(Mailbox.user_id % self.shards == self.shard)
+            rows = query.order_by(Mailbox.user_id).limit(self.max_sessions).all()
+            return {user_id for (user_id,) in rows}
+        finally:
+            db.close()
+
+    def refresh(self):
+        wanted = self._wanted_user_ids()
+        for user_id in list(self.watchers):
+            if user_id not in wanted:
+                self.watchers.pop(user_id).stop()
+        for user_id in wanted:
+            watcher = self.watchers.get(user_id)
+            if watcher is None or not watcher.is_alive():
+                watcher = MailboxWatcher(user_id)
+                self.watchers[user_id] = watcher
+                watcher.start()
+        logger.info(f"Sesiones IDLE activas: {len(self.watchers)}")
+
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error actualizando sesiones IDLE: {e}", exc_info=True)
+            stop_event.wait(IDLE_REFRESH_SECONDS)
+        self.stop()
+
+    def stop(self, timeout=10):
+        for watcher in self.watchers.values():
+            watcher.stop()
+        for watcher in self.watchers.values():
+            watcher.join(timeout)
+        self.watchers = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincronización IMAP IDLE de FinDuo")
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=IDLE_MAX_SESSIONS,
+        help="Conexiones IDLE simultáneas en este proceso",
+    )
+    parser.add_argument(
+        "--shard",
+        default=os.getenv("IDLE_SHARD", "0/1"),
+        help="Parte de los buzones a atender, como I/N",
+    )
+    args = parser.parse_args()
+    shard, shards = (int(x) for x in args.shard.split("/"))
+
+    setup_logging()
+    init_db()
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"Señal {signum} recibida, cerrando sesiones IDLE...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    IdleSyncManager(args.max_sessions, shard, shards).run(stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,646 @@
+import base64
+import logging
+import os
+import quopri
+import re
+import select
+import ssl
+import time
+from email.parser import BytesHeaderParser, BytesParser
+from email.policy import default as default_policy
+from html.parser import HTMLParser
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Cantidad de UIDs por comando UID FETCH
+FETCH_CHUNK_SIZE = int(os.getenv("IMAP_FETCH_CHUNK_SIZE", "100"))
+
+# Segundos que se reutiliza el resultado de LIST por cuenta
+FOLDER_LIST_TTL = int(os.getenv("IMAP_FOLDER_LIST_TTL", "3600"))
+
+# Bytes que se descargan como máximo de cada parte de texto (fetch parcial)
+BODY_MAX_BYTES = int(os.getenv("EMAIL_BODY_MAX_BYTES", "65536"))
+
+# Caracteres de texto que se conservan por correo; las plantillas de los bancos
+# solo necesitan el comienzo del cuerpo
+BODY_MAX_CHARS = int(os.getenv("EMAIL_BODY_MAX_CHARS", "20000"))
+
+# Cabeceras que se piden al servidor (no se descarga el mensaje completo)
+HEADER_FIELDS = ("FROM", "SUBJECT", "DATE", "MESSAGE-ID")
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\}$")
+_TOKEN_RE = re.compile(
+    rb"""\s*(?:
+        (?P<open>\()
+        |(?P<close>\))
+        |"(?P<quoted>(?:[^"\\]|\\.)*)"
+        |(?P<atom>[^\s()"\[\]]+(?:\[[^\]]*\](?:<\d+>)?)?)
+    )""",
+    re.VERBOSE,
+)
+_SECTION_RE = re.compile(r"^BODY\[([^\]]*)\]")
+
+
+class FetchedMessage(NamedTuple):
+    uid: int
+    headers: object  # email.message.EmailMessage solo con HEADER_FIELDS
+    body: str
+
+
+class RawMessage(NamedTuple):
+    """Mensaje descargado sin decodificar (se puede enviar a otro proceso)."""
+
+    uid: int
+    raw_headers: bytes
+    parts: tuple  # (subtype, encoding, charset, payload) de cada parte de texto
+
+
+_header_parser = BytesHeaderParser(policy=default_policy)
+
+
+def _tokenize(data):
+    """Convierte la respuesta cruda de imaplib en una secuencia de tokens.
+
+    imaplib entrega las respuestas con literales como tuplas (línea, literal),
+    seguidas del resto de la línea como bytes sueltos.
+    """
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            head, literal = item
+            head = _LITERAL_RE.sub(b"", head.rstrip())
+            yield from _tokenize_text(head)
+            yield literal
+        else:
+            yield from _tokenize_text(item)
+
+
+def _tokenize_text(text):
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"Respuesta IMAP inválida cerca de: {text[pos:pos + 40]!r}")
+        pos = m.end()
+        if m.group("open"):
+            yield "("
+        elif m.group("close"):
+            yield ")"
+        elif m.group("quoted") is not None:
+            yield re.sub(rb"\\(.)", rb"\1", m.group("quoted"))
+        else:
+            atom = m.group("atom")
+            yield None if atom.upper() == b"NIL" else atom
+
+
+def parse_response(data):
+    """Parsea una respuesta IMAP en listas anidadas de bytes/None."""
+    stack = [[]]
+    for token in _tokenize(data):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) == 1:
+                raise ValueError("Paréntesis desbalanceados en respuesta IMAP")
+            done = stack.pop()
+            stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    if len(stack) != 1:
+        raise ValueError("Paréntesis desbalanceados en respuesta IMAP")
+    return stack[0]
+
+
+def parse_fetch_response(data):
+    """Parsea la respuesta de un FETCH y devuelve una lista de dicts por mensaje.
+
+    Las claves son los nombres de los ítems en mayúsculas (por ejemplo "UID",
+    "BODYSTRUCTURE" o "BODY[1.2]").
+    """
+    result = []
+    for element in parse_response(data):
+        if not isinstance(element, list):
+            continue  # número de secuencia
+        items = {}
+        for i in range(0, len(element) - 1, 2):
+            key = element[i]
+            if isinstance(key, bytes):
+                items[key.decode("ascii", errors="ignore").upper()] = element[i + 1]
+        result.append(items)
+    return result
+
+
+def _params(value):
+    if not isinstance(value, list):
+        return {}
+    params = {}
+    for i in range(0, len(value) - 1, 2):
+        if isinstance(value[i], bytes) and isinstance(value[i + 1], bytes):
+            params[value[i].decode("ascii", errors="ignore").lower()] = value[
+                i + 1
+            ].decode("ascii", errors="ignore")
+    return params
+
+
+def find_text_parts(bodystructure, prefix=""):
+    """Devuelve las partes text/plain y text/html de un BODYSTRUCTURE.
+
+    Cada parte es (sección, subtipo, encoding, charset). Se ignoran adjuntos y
+    mensajes reenviados (message/rfc822).
+    """
+    if not isinstance(bodystructure, list) or not bodystructure:
+        return []
+
+    if isinstance(bodystructure[0], list):
+        parts = []
+        for i, child in enumerate(bodystructure):
+            if not isinstance(child, list):
+                break
+            section = f"{prefix}.{i + 1}" if prefix else str(i + 1)
+            parts.extend(find_text_parts(child, section))
+        return parts
+
+    def field(index):
+        value = bodystructure[index] if len(bodystructure) > index else None
+        return value.decode("ascii", errors="ignore").lower() if isinstance(value, bytes) else ""
+
+    if field(0) != "text" or field(1) not in ("plain", "html"):
+        return []
+
+    # Extensión de una parte text: md5 (8), disposition (9)
+    disposition = bodystructure[9] if len(bodystructure) > 9 else None
+    if isinstance(disposition, list) and disposition and isinstance(disposition[0], bytes):
+        if disposition[0].lower() == b"attachment":
+            return []
+
+    charset = _params(bodystructure[2]).get("charset", "utf-8")
+    return [(prefix or "1", field(1), field(5), charset)]
+
+
+def decode_part(payload, encoding, charset):
+    """Decodifica el contenido de una parte según su transfer-encoding y charset."""
+    if encoding == "base64":
+        data = b"".join(payload.split())
+        # Un fetch parcial puede cortar el último bloque de 4 caracteres
+        data = data[: len(data) - len(data) % 4]
+        try:
+            payload = base64.b64decode(data)
+        except ValueError:
+            pass
+    elif encoding == "quoted-printable":
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(charset or "utf-8", errors="ignore")
+    except LookupError:
+        return payload.decode("utf-8", errors="ignore")
+
+
+_SKIP_TAGS = {"script", "style"}
+
+# Tamaño de cada trozo de HTML que se entrega al parser
+_HTML_FEED_SIZE = 8192
+
+
+class _TextExtractor(HTMLParser):
+    """Junta el texto visible de un HTML con los espacios normalizados."""
+
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts = []
+        self.size = 0
+        self.skip = 0
+        self.space = True
+
+    @property
+    def full(self):
+        return self.size >= self.max_chars
+
+    def _emit(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        self.space = text.endswith(" ")
+
+    def _separate(self):
+        if not self.space:
+            self._emit(" ")
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self.skip += 1
+        self._separate()
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and self.skip:
+            self.skip -= 1
+        self._separate()
+
+    def handle_data(self, data):
+        if self.skip or self.full:
+            return
+        words = data.split()
+        if data[:1].isspace():
+            self._separate()
+        if words:
+            self._emit(" ".join(words))
+            if data[-1:].isspace():
+                self._separate()
+
+
+def html_to_text(html, max_chars=None):
+    """Convierte HTML a texto en un solo recorrido, hasta max_chars caracteres.
+
+    Cada etiqueta cuenta como un espacio, se decodifican las entidades y se
+    omiten script y style. Se deja de leer al llegar al límite.
+    """
+    extractor = _TextExtractor(max_chars or BODY_MAX_CHARS)
+    for start in range(0, len(html), _HTML_FEED_SIZE):
+        extractor.feed(html[start : start + _HTML_FEED_SIZE])
+        if extractor.full:
+            break
+    else:
+        extractor.close()
+    return "".join(extractor.parts)[: extractor.max_chars]
+
+
+def message_text(raw, max_chars=None):
+    """Texto de un mensaje RFC822 (completo o truncado) sin decodificar adjuntos."""
+    message = BytesParser(policy=default_policy).parsebytes(raw)
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None or part.get_content_maintype() != "text":
+        return ""
+    try:
+        text = part.get_content()
+    except (LookupError, ValueError):
+        return ""
+    if part.get_content_subtype() == "html":
+        return html_to_text(text, max_chars)
+    return text
+
+
+def uid_set(uids):
+    """Compacta una lista de UIDs en un conjunto IMAP (por ejemplo "1:5,8")."""
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def _uid_fetch(mail, uids, items):
+    status, data = mail.uid("FETCH", uid_set(uids), f"({items})")
+    if status != "OK":
+        raise RuntimeError(f"UID FETCH falló: status={status}")
+    return parse_fetch_response(data)
+
+
+def _item_uid(item) -> Optional[int]:
+    uid = item.get("UID")
+    try:
+        return int(uid) if uid is not None else None
+    except ValueError:
+        return None
+
+
+def fetch_raw_messages(mail, uids, chunk_size=None):
+    """Descarga cabeceras y partes de texto de los UIDs dados, por lotes.
+
+    Por cada lote se hacen dos UID FETCH sobre la carpeta ya seleccionada:
+    uno con BODYSTRUCTURE y las cabeceras de HEADER_FIELDS, y otro con solo
+    las partes de texto necesarias (text/plain o, si no hay, text/html), de a lo
+    más BODY_MAX_BYTES bytes cada una. No se descargan adjuntos ni se marcan los
+    correos como leídos. Los RawMessage se
+    entregan en orden de UID a medida que se completa cada lote.
+    """
+    chunk_size = chunk_size or FETCH_CHUNK_SIZE
+    uids = sorted(uids)
+    header_item = f"BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})]"
+
+    for start in range(0, len(uids), chunk_size):
+        chunk = uids[start : start + chunk_size]
+
+        # 1) Estructura y cabeceras de todo el lote
+        structure = {}
+        for item in _uid_fetch(mail, chunk, f"UID BODYSTRUCTURE {header_item}"):
+            uid = _item_uid(item)
+            if uid is None:
+                continue
+            raw_headers = next(
+                (v for k, v in item.items() if k.startswith("BODY[HEADER")), b""
+            )
+            bodystructure = item.get("BODYSTRUCTURE")
+            if bodystructure is None:
+                # Sin BODYSTRUCTURE se descarga el comienzo del mensaje completo
+                parts = [("", "rfc822", None, None)]
+            else:
+                parts = find_text_parts(bodystructure)
+            plain = [p for p in parts if p[1] == "plain"]
+            structure[uid] = (raw_headers or b"", plain or parts)
+
+        # 2) Partes de texto, agrupando mensajes con la misma estructura
+        groups = {}
+        for uid, (_, parts) in structure.items():
+            if parts:
+                groups.setdefault(tuple(p[0] for p in parts), []).append(uid)
+
+        contents = {}
+        for sections, group_uids in groups.items():
+            # El mensaje completo (sección "") no se corta: un multipart truncado
+            # pierde su estructura
+            items = " ".join(
+                f"BODY.PEEK[{section}]<0.{BODY_MAX_BYTES}>"
+                if section
+                else "BODY.PEEK[]"
+                for section in sections
+            )
+            for item in _uid_fetch(mail, group_uids, f"UID {items}"):
+                uid = _item_uid(item)
+                if uid is None:
+                    continue
+                for key, value in item.items():
+                    m = _SECTION_RE.match(key)
+                    if m and isinstance(value, bytes):
+                        contents[(uid, m.group(1))] = value
+
+        for uid in sorted(structure):
+            raw_headers, parts = structure[uid]
+            yield RawMessage(
+                uid=uid,
+                raw_headers=raw_headers,
+                parts=tuple(
+                    (subtype, encoding, charset, contents.get((uid, section)))
+                    for section, subtype, encoding, charset in parts
+                ),
+            )
+
+
+def decode_message(raw: RawMessage) -> FetchedMessage:
+    """Decodifica las cabeceras y el texto de un RawMessage.
+
+    El cuerpo se corta en BODY_MAX_CHARS caracteres.
+    """
+    texts = []
+    size = 0
+    for subtype, encoding, charset, payload in raw.parts:
+        if not payload or size >= BODY_MAX_CHARS:
+            continue
+        if subtype == "rfc822":
+            text = message_text(payload)
+        elif subtype == "html":
+            text = html_to_text(decode_part(payload, encoding, charset))
+        else:
+            text = decode_part(payload, encoding, charset)
+        texts.append(text)
+        size += len(text)
+    return FetchedMessage(
+        uid=raw.uid,
+        headers=_header_parser.parsebytes(raw.raw_headers),
+        body="".join(texts)[:BODY_MAX_CHARS],
+    )
+
+
+def fetch_messages(mail, uids, chunk_size=None):
+    """Como fetch_raw_messages, pero entrega FetchedMessage ya decodificados."""
+    for raw in fetch_raw_messages(mail, uids, chunk_size):
+        yield decode_message(raw)
+
+
+_EXISTS_RE = re.compile(rb"^\* \d+ EXISTS", re.IGNORECASE)
+
+
+# Segundos que se espera el resto de una línea ya empezada
+IDLE_LINE_TIMEOUT = 30
+
+
+def _has_buffered_data(mail):
+    """True si hay bytes para leer sin bloquear, en el buffer de imaplib o en el socket.
+
+    Con el socket en modo no bloqueante, peek llena el buffer con lo que haya
+    (también lo ya descifrado en SSL) sin esperar.
+    """
+    sock = mail.socket()
+    previous = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(previous)
+
+
+def _readline(mail, timeout):
+    """Lee una línea por el buffer de imaplib; None si no llegó nada en timeout segundos.
+
+    No se lee del socket por otro lado: lo que imaplib ya tenga en su buffer
+    (por ejemplo un EXISTS que llegó junto con la respuesta anterior) se ve, y
+    al terminar el IDLE imaplib sigue leyendo desde donde corresponde.
+    """
+    sock = mail.socket()
+    deadline = time.monotonic() + timeout
+    while not _has_buffered_data(mail):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        readable, _, _ = select.select([sock], [], [], remaining)
+        if readable and not _has_buffered_data(mail):
+            # Legible pero sin datos: conexión cerrada, readline lo confirma
+            break
+
+    previous = sock.gettimeout()
+    # Un timeout deja inutilizable el archivo del socket: solo para no colgarse
+    sock.settimeout(IDLE_LINE_TIMEOUT)
+    try:
+        line = mail.readline()
+    finally:
+        sock.settimeout(previous)
+    if not line:
+        raise ConnectionError("El servidor IMAP cerró la conexión")
+    return line.rstrip(b"\r\n")
+
+
+# Cache de LIST por cuenta: {cuenta: (timestamp, set de carpetas)}
+_folder_cache = {}
+
+
+def _quote(name):
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _or_from(senders):
+    """Criterio de búsqueda que coincide con cualquiera de los remitentes."""
+    if len(senders) == 1:
+        return ["FROM", senders[0]]
+    return ["OR", "FROM", senders[0]] + _or_from(senders[1:])
+
+
+class ImapSession:
+    """Una conexión IMAP autenticada que se reutiliza para todas las carpetas.
+
+    El resultado de LIST se guarda por cuenta durante FOLDER_LIST_TTL segundos,
+    de modo que resolver etiquetas de Gmail no cuesta SELECTs fallidos en cada
+    sincronización.
+    """
+
+    def __init__(self, mail, account):
+        self.mail = mail
+        self.account = account
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        try:
+            self.mail.logout()
+        except Exception:
+            pass
+
+    def list_folders(self):
+        cached = _folder_cache.get(self.account)
+        if cached and time.monotonic() - cached[0] < FOLDER_LIST_TTL:
+            return cached[1]
+
+        status, data = self.mail.list()
+        if status != "OK":
+            raise RuntimeError(f"LIST falló: status={status}")
+        elements = parse_response(data)
+        folders = set()
+        # Cada carpeta viene como (flags) delimitador nombre
+        for i in range(0, len(elements) - 2, 3):
+            flags, name = elements[i], elements[i + 2]
+            if not isinstance(name, bytes):
+                continue
+            if isinstance(flags, list) and any(
+                isinstance(f, bytes) and f.lower() == b"\\noselect" for f in flags
+            ):
+                continue
+            folders.add(name.decode("utf-8", errors="ignore"))
+        _folder_cache[self.account] = (time.monotonic(), folders)
+        return folders
+
+    def resolve_folder(self, location):
+        """Devuelve el nombre real de una carpeta o None si no existe.
+
+        Para "INBOX/X" también se prueban las etiquetas de Gmail "X" y "[Gmail]/X".
+        """
+        candidates = [location]
+        if location.startswith("INBOX/"):
+            label = location[len("INBOX/") :]
+            candidates += [label, f"[Gmail]/{label}"]
+
+        try:
+            folders = self.list_folders()
+        except Exception as e:
+            logger.warning(f"No se pudo listar carpetas: {e}")
+            return candidates[0]
+
+        for candidate in candidates:
+            if candidate in folders or (
+                candidate.upper() == "INBOX" and any(f.upper() == "INBOX" for f in folders)
+            ):
+                return candidate
+        return None
+
+    def select(self, folder):
+        """Selecciona una carpeta en modo lectura; devuelve (uidvalidity, uidnext)."""
+        status, data = self.mail.select(_quote(folder), readonly=True)
+        if status != "OK":
+            # La lista en cache puede estar desactualizada
+            _folder_cache.pop(self.account, None)
+            raise RuntimeError(f"SELECT {folder} falló: {data}")
+
+        _, uidvalidity = self.mail.response("UIDVALIDITY")
+        _, uidnext = self.mail.response("UIDNEXT")
+        # El EXISTS del SELECT no es un aviso de correos nuevos (ver has_new_messages)
+        self.mail.response("EXISTS")
+        uidvalidity = int(uidvalidity[0]) if uidvalidity and uidvalidity[0] else None
+        uidnext = int(uidnext[0]) if uidnext and uidnext[0] else None
+        return uidvalidity, uidnext
+
+    def search_from(self, senders, min_uid=None):
+        """Un único UID SEARCH por los remitentes dados, opcionalmente desde min_uid."""
+        criteria = _or_from(list(senders))
+        if min_uid is not None:
+            criteria = ["UID", f"{min_uid}:*"] + criteria
+
+        status, data = self.mail.uid("SEARCH", None, *criteria)
+        if status != "OK":
+            raise RuntimeError(f"UID SEARCH falló: status={status}")
+        if not data or not data[0]:
+            return []
+        ids_str = data[0].decode() if isinstance(data[0], bytes) else str(data[0])
+        uids = [int(uid) for uid in ids_str.split()]
+        # "n:*" siempre incluye el último mensaje aunque su UID sea menor que n
+        if min_uid is not None:
+            uids = [uid for uid in uids if uid >= min_uid]
+        return sorted(uids)
+
+    def fetch(self, uids, chunk_size=None):
+        return fetch_messages(self.mail, uids, chunk_size)
+
+    def fetch_raw(self, uids, chunk_size=None):
+        return fetch_raw_messages(self.mail, uids, chunk_size)
+
+    def has_new_messages(self):
+        """NOOP en la carpeta seleccionada; True si el servidor avisó EXISTS.
+
+        Para servidores sin IDLE. imaplib acumula las respuestas no pedidas, así
+        que también cuenta un EXISTS recibido durante los comandos anteriores.
+        """
+        status, _ = self.mail.noop()
+        if status != "OK":
+            raise RuntimeError(f"NOOP falló: status={status}")
+        _, exists = self.mail.response("EXISTS")
+        return bool(exists and exists[-1] is not None)
+
+    def supports_idle(self):
+        return "IDLE" in getattr(self.mail, "capabilities", ())
+
+    def idle(self, timeout, stop_event=None, poll=1.0):
+        """Espera con IDLE en la carpeta seleccionada hasta que lleguen correos.
+
+        Devuelve True si el servidor notificó EXISTS (correos nuevos) y False si
+        se cumplió el timeout o se activó stop_event. Siempre termina el IDLE con
+        DONE antes de volver, así la conexión queda lista para otros comandos.
+        """
+        self._idle_count = getattr(self, "_idle_count", 0) + 1
+        tag = f"IDLE{self._idle_count}".encode()
+        self.mail.send(tag + b" IDLE\r\n")
+        got_new = False
+        while True:
+            line = _readline(self.mail, IDLE_LINE_TIMEOUT)
+            if line is not None and line.startswith(b"+"):
+                break
+            if line is None or not line.startswith(b"*"):
+                raise RuntimeError(f"El servidor rechazó IDLE: {line!r}")
+            # Respuestas pendientes de antes del IDLE (quedaron en el buffer)
+            got_new = got_new or bool(_EXISTS_RE.match(line))
+
+        deadline = time.monotonic() + timeout
+        while not got_new and time.monotonic() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                break
+            line = _readline(self.mail, min(poll, max(deadline - time.monotonic(), 0)))
+            if line is not None and _EXISTS_RE.match(line):
+                got_new = True
+                break
+
+        self.mail.send(b"DONE\r\n")
+        while True:
+            line = _readline(self.mail, IDLE_LINE_TIMEOUT)
+            if line is None:
+                raise RuntimeError("Sin respuesta del servidor al terminar IDLE")
+            if line.startswith(tag + b" "):
+                if not line[len(tag) + 1 :].upper().startswith(b"OK"):
+                    raise RuntimeError(f"IDLE terminó con error: {line!r}")
+                return got_new
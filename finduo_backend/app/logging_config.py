@@ -0,0 +1,117 @@
+"""Configuración de logging de la API, los workers y los scripts.
+
+Los registros pasan por una cola (QueueHandler) y un hilo aparte
+(QueueListener) los formatea y escribe, así que un request o una
+sincronización no esperan a que se escriba en stdout. Por defecto hay un único
+handler a stdout con una línea JSON por registro.
+
+Variables de entorno:
+- LOG_LEVEL: nivel general (INFO por defecto).
+- LOG_LEVELS: niveles por logger, por ejemplo "app.email_sync=DEBUG,sqlalchemy.engine=INFO".
+- LOG_FORMAT: "json" (por defecto) o "text".
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Atributos estándar de LogRecord; el resto (extra=...) va como campo del JSON
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de extra=... incluidos."""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Los argumentos se resuelven aquí (pueden cambiar después), pero el
+        # formato final lo hace el hilo del listener. Este es el último
+        # handler que ve el registro, así que no hace falta copiarlo
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level=None, levels=None, fmt=None, stream=None):
+    """Configura el logger raíz con una cola y un handler en otro hilo.
+
+    Se puede llamar varias veces: la segunda reemplaza la configuración
+    anterior. Los argumentos reemplazan a las variables de entorno.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    if (fmt or LOG_FORMAT) == "text":
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(_QueueHandler(log_queue))
+    root.setLevel(level or LOG_LEVEL)
+    for name, logger_level in _parse_levels(
+        LOG_LEVELS if levels is None else levels
+    ).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Escribe los registros pendientes y detiene el hilo de logging."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,230 @@
+import imaplib
+import ipaddress
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from .models import Mailbox, User
+
+
+# Clave Fernet (base64 de 32 bytes) para cifrar las contraseñas de los buzones.
+# Generar con: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+MAILBOX_ENCRYPTION_KEY = os.getenv("MAILBOX_ENCRYPTION_KEY")
+
+# Cada cuánto se sincroniza un buzón registrado (segundos) y su variación aleatoria
+MAILBOX_SYNC_INTERVAL = int(os.getenv("MAILBOX_SYNC_INTERVAL", "900"))
+MAILBOX_SYNC_JITTER = float(os.getenv("MAILBOX_SYNC_JITTER", "0.2"))
+
+# Servidor IMAP de los buzones que no indican uno y del modo EMAIL_USER
+DEFAULT_IMAP_HOST = os.getenv("IMAP_HOST", "imap.gmail.com")
+DEFAULT_IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+
+# Cifrado de la conexión: "ssl" (IMAPS), "starttls" o "none" (solo servidores locales)
+IMAP_SECURITY = os.getenv("IMAP_SECURITY", "ssl").lower()
+
+# Servidores IMAP que un usuario puede registrar en su buzón. Con "*" se acepta
+# cualquiera que resuelva solo a direcciones públicas (nunca la red interna).
+IMAP_ALLOWED_HOSTS = {
+    host.strip().lower()
+    for host in os.getenv(
+        "IMAP_ALLOWED_HOSTS",
+        "imap.gmail.com,outlook.office365.com,imap-mail.outlook.com,"
+        "imap.mail.yahoo.com,imap.mail.me.com,imap.zoho.com,imap.aol.com",
+    ).split(",")
+    if host.strip()
+} | {DEFAULT_IMAP_HOST.lower()}
+
+# Puertos IMAP permitidos en los buzones registrados (ver mailbox_security)
+IMAP_ALLOWED_PORTS = {
+    int(port) for port in os.getenv("IMAP_ALLOWED_PORTS", "993,143").split(",") if port.strip()
+} | {DEFAULT_IMAP_PORT}
+
+
+class MailboxCredentials(NamedTuple):
+    host: str
+    port: int
+    username: str
+    password: str
+    security: str = IMAP_SECURITY
+
+
+def mailbox_security(host: str, port: int) -> str:
+    """Cifrado de la conexión a un buzón registrado.
+
+    El servidor configurado (IMAP_HOST e IMAP_PORT) usa IMAP_SECURITY; en los
+    demás el puerto lo determina: 143 es IMAP con STARTTLS y el resto IMAPS.
+    """
+    if (host or "").lower() == DEFAULT_IMAP_HOST.lower() and port == DEFAULT_IMAP_PORT:
+        return IMAP_SECURITY
+    return "starttls" if port == 143 else "ssl"
+
+
+def _fernet():
+    if not MAILBOX_ENCRYPTION_KEY:
+        raise RuntimeError("MAILBOX_ENCRYPTION_KEY debe estar configurada")
+    return Fernet(MAILBOX_ENCRYPTION_KEY.encode())
+
+
+def encrypt_secret(value: str) -> str:
+    return _fernet().encrypt(value.encode()).decode()
+
+
+def decrypt_secret(token: str) -> str:
+    try:
+        return _fernet().decrypt(token.encode()).decode()
+    except InvalidToken:
+        raise RuntimeError("No se pudo descifrar la contraseña del buzón")
+
+
+def next_sync_time(now: Optional[datetime] = None, interval: Optional[int] = None):
+    """Próxima sincronización con variación aleatoria para repartir la carga."""
+    now = now or datetime.utcnow()
+    interval = interval or MAILBOX_SYNC_INTERVAL
+    jitter = interval * MAILBOX_SYNC_JITTER
+    return now + timedelta(seconds=interval + random.uniform(-jitter, jitter))
+
+
+def _is_public_host(host: str) -> bool:
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (socket.gaierror, UnicodeError):
+        return False
+    # Sin red interna, loopback, link-local ni rangos reservados
+    return bool(addresses) and all(
+        ipaddress.ip_address(address.split("%")[0]).is_global for address in addresses
+    )
+
+
+def validate_imap_server(host: str, port: int) -> str:
+    """Comprueba que el servidor IMAP de un buzón esté permitido y devuelve el host normalizado.
+
+    Los jobs se conectan desde dentro del despliegue, así que un host o puerto
+    arbitrario serviría para llegar a servicios internos. Lanza ValueError.
+    """
+    host = (host or "").strip().lower().rstrip(".")
+    if port not in IMAP_ALLOWED_PORTS:
+        raise ValueError("Puerto IMAP no permitido")
+    if host in IMAP_ALLOWED_HOSTS:
+        return host
+    if "*" not in IMAP_ALLOWED_HOSTS or not _is_public_host(host):
+        raise ValueError("Servidor IMAP no permitido")
+    return host
+
+
+def sync_error_message(error: Exception) -> str:
+    """Mensaje de error de una sincronización que se puede mostrar al usuario.
+
+    No incluye el texto de la excepción (direcciones, respuestas del servidor);
+    ese queda en el log.
+    """
+    if isinstance(error, imaplib.IMAP4.error):
+        return "El servidor IMAP rechazó la conexión o las credenciales"
+    if isinstance(error, OSError):
+        return "No se pudo conectar con el servidor IMAP"
+    if isinstance(error, RuntimeError):
+        # Errores propios de la app (buzón sin configurar, clave de cifrado, etc.)
+        return str(error)
+    return "Error al sincronizar el buzón"
+
+
+def mailbox_to_dict(mailbox: Mailbox):
+    return {
+        "imap_host": mailbox.imap_host,
+        "imap_port": mailbox.imap_port,
+        "security": mailbox_security(mailbox.imap_host, mailbox.imap_port),
+        "username": mailbox.username,
+        "enabled": mailbox.enabled,
+        "last_synced_at": mailbox.last_synced_at.isoformat()
+        if mailbox.last_synced_at
+        else None,
+        "next_sync_at": mailbox.next_sync_at.isoformat()
+        if mailbox.next_sync_at
+        else None,
+        "last_error": mailbox.last_error,
+    }
+
+
+def save_mailbox(
+    db, user: User, username: str, password: str, imap_host=None, imap_port=None
+) -> Mailbox:
+    """Registra o actualiza el buzón del usuario.
+
+    Lanza ValueError si el servidor IMAP no está permitido.
+    """
+    imap_host = validate_imap_server(
+        imap_host or DEFAULT_IMAP_HOST, imap_port or DEFAULT_IMAP_PORT
+    )
+    mailbox = db.query(Mailbox).filter(Mailbox.user_id == user.id).first()
+    if mailbox is None:
+        mailbox = Mailbox(user_id=user.id)
+        db.add(mailbox)
+        # La primera sincronización se reparte dentro del intervalo
+        mailbox.next_sync_at = datetime.utcnow() + timedelta(
+            seconds=random.uniform(0, MAILBOX_SYNC_INTERVAL * MAILBOX_SYNC_JITTER)
+        )
+
+    mailbox.imap_host = imap_host
+    mailbox.imap_port = imap_port or DEFAULT_IMAP_PORT
+    mailbox.username = username
+    mailbox.password_encrypted = encrypt_secret(password)
+    mailbox.enabled = True
+    mailbox.last_error = None
+    db.commit()
+    db.refresh(mailbox)
+    return mailbox
+
+
+def get_credentials(db, user: User) -> MailboxCredentials:
+    """Credenciales IMAP del usuario.
+
+    Si el usuario no registró un buzón solo se usan EMAIL_USER/EMAIL_PASSWORD
+    cuando corresponden a su propio correo, para no leer el buzón de otra persona.
+    """
+    mailbox = (
+        db.query(Mailbox)
+        .filter(Mailbox.user_id == user.id, Mailbox.enabled.is_(True))
+        .first()
+    )
+    if mailbox is not None:
+        # Los buzones guardados antes de la validación (o con un DNS que cambió)
+        try:
+            validate_imap_server(mailbox.imap_host, mailbox.imap_port)
+        except ValueError as e:
+            raise RuntimeError(str(e))
+        return MailboxCredentials(
+            host=mailbox.imap_host,
+            port=mailbox.imap_port,
+            username=mailbox.username,
+            password=decrypt_secret(mailbox.password_encrypted),
+            security=mailbox_security(mailbox.imap_host, mailbox.imap_port),
+        )
+
+    env_user = os.getenv("EMAIL_USER")
+    env_password = os.getenv("EMAIL_PASSWORD")
+    if env_user and env_password and env_user.lower() == (user.email or "").lower():
+        return MailboxCredentials(
+            host=DEFAULT_IMAP_HOST,
+            port=DEFAULT_IMAP_PORT,
+            username=env_user,
+            password=env_password,
+        )
+
+    raise RuntimeError("El usuario no tiene un buzón de correo configurado")
+
+
+def mailbox_host(db, user_id: int) -> str:
+    mailbox = db.query(Mailbox).filter(Mailbox.user_id == user_id).first()
+    return mailbox.imap_host if mailbox else DEFAULT_IMAP_HOST
+
+
+def record_mailbox_sync(db, user_id: int, error: Optional[str] = None):
+    """Guarda el resultado de la última sincronización del buzón (sin commit)."""
+    mailbox = db.query(Mailbox).filter(Mailbox.user_id == user_id).first()
+    if mailbox is None:
+        return
+    mailbox.last_synced_at = datetime.utcnow()
+    mailbox.last_error = error
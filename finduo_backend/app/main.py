@@ -1,10 +1,16 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, status
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
+from typing import List, Optional
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from datetime import timedelta
+from datetime import date, datetime, timedelta
+from contextlib import asynccontextmanager
 
-from .database import Base, engine, SessionLocal
+from .database import SessionLocal, async_engine, init_db
 from .models import (
     Transaction,
     User,
@@ -12,23 +18,67 @@ from .models import (
     DuoMembership,
     DuoStatus,
     DuoRole,
+    SyncJob,
+    SyncJobStatus,
+    Mailbox,
+    TransactionTombstone,
 )
-from .email_sync import sync_emails_to_db
+from .sync_jobs import (
+    JOB_KIND_BACKFILL,
+    active_job,
+    enqueue_sync_job,
+    job_to_dict,
+    start_in_process_runner,
+    stop_in_process_runner,
+    update_released_job,
+    wake_runner,
+)
+from .backfill import checkpoint_to_dict, get_checkpoints, reset_checkpoints
+from .sync_scheduler import SYNC_SCHEDULER_ENABLED, SyncScheduler
+from . import metrics, rollups, versions
+from .logging_config import setup_logging
+from .mailboxes import save_mailbox, mailbox_to_dict
+from .responses import json_response
 from .auth import (
     get_current_user,
+    get_current_user_async,
     get_password_hash,
     verify_password,
     create_access_token,
     get_db,
+    get_async_db,
     ACCESS_TOKEN_EXPIRE_MINUTES,
 )
+import base64
+import binascii
+import csv
+import io
+import orjson
 import secrets
 
-Base.metadata.create_all(bind=engine)
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Migraciones pendientes al arrancar (ya no al importar el módulo)
+    init_db()
+    # Ejecutar sincronizaciones dentro del proceso (salvo SYNC_IN_PROCESS=0)
+    start_in_process_runner()
+    scheduler = SyncScheduler() if SYNC_SCHEDULER_ENABLED else None
+    if scheduler:
+        scheduler.start()
+    yield
+    if scheduler:
+        scheduler.stop()
+    stop_in_process_runner()
+    await async_engine.dispose()
+
 
 app = FastAPI(
     title="FinDuo Backend",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 
@@ -37,6 +87,12 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Métricas de sincronización de este proceso en formato Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # ==================== AUTENTICACIÓN ====================
 
 
@@ -132,65 +188,632 @@ def get_me(current_user: User = Depends(get_current_user)):
     }
 
 
-@app.post("/sync-email")
-def sync_email(current_user: User = Depends(get_current_user)):
-    import logging
+class MailboxRequest(BaseModel):
+    username: str
+    password: str
+    imap_host: Optional[str] = None
+    imap_port: Optional[int] = None
 
-    logger = logging.getLogger(__name__)
-    logger.info(f"Iniciando sincronización de correo para: {current_user.email}")
+
+@app.get("/mailbox")
+def get_mailbox(
+    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """Buzón de correo registrado por el usuario (sin la contraseña)"""
+    mailbox = db.query(Mailbox).filter(Mailbox.user_id == current_user.id).first()
+    if not mailbox:
+        raise HTTPException(status_code=404, detail="No hay un buzón configurado")
+    return mailbox_to_dict(mailbox)
+
+
+@app.put("/mailbox")
+def put_mailbox(
+    req: MailboxRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Registra o actualiza las credenciales IMAP del usuario"""
     try:
-        count = sync_emails_to_db(current_user.email)
-        logger.info(f"Sincronización completada: {count} correos importados")
-        return {"imported": count}
-    except Exception as e:
-        logger.error(f"Error en sincronización: {e}", exc_info=True)
-        return {"imported": 0, "error": str(e)}
+        mailbox = save_mailbox(
+            db,
+            current_user,
+            username=req.username,
+            password=req.password,
+            imap_host=req.imap_host,
+            imap_port=req.imap_port,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        db.rollback()
+        raise HTTPException(status_code=503, detail=str(e))
+    return mailbox_to_dict(mailbox)
 
 
-@app.get("/transactions")
-def list_transactions(
-    mode: str = Query("individual"),
+@app.delete("/mailbox")
+def delete_mailbox(
+    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    mailbox = db.query(Mailbox).filter(Mailbox.user_id == current_user.id).first()
+    if not mailbox:
+        raise HTTPException(status_code=404, detail="No hay un buzón configurado")
+    db.delete(mailbox)
+    db.commit()
+    return {"status": "deleted"}
+
+
+@app.post("/sync-email", status_code=status.HTTP_202_ACCEPTED)
+def sync_email(
+    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """Encola una sincronización de correo y devuelve el job sin esperar."""
+    job = enqueue_sync_job(db, current_user)
+    return job_to_dict(job)
+
+
+@app.get("/sync-email/{job_id}")
+def get_sync_job(
+    job_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    if mode == "duo":
-        membership = (
-            db.query(DuoMembership)
-            .filter(
-                DuoMembership.user_id == current_user.id,
-                DuoMembership.status == DuoStatus.active,
+    """Estado y contadores de una sincronización"""
+    job = (
+        db.query(SyncJob)
+        .filter(SyncJob.id == job_id, SyncJob.user_id == current_user.id)
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Sincronización no encontrada")
+    return job_to_dict(job)
+
+
+def _backfill_status(db: Session, user: User, job: Optional[SyncJob]):
+    return {
+        "job": job_to_dict(job) if job else None,
+        "folders": [checkpoint_to_dict(c) for c in get_checkpoints(db, user.id)],
+    }
+
+
+@app.post("/backfill", status_code=status.HTTP_202_ACCEPTED)
+def start_backfill(
+    restart: bool = Query(False),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Encola (o reanuda) la importación del historial completo del buzón.
+
+    Sigue desde el último checkpoint; con restart=true recorre todo de nuevo.
+    Un backfill pausado se puede reanudar o reiniciar recién cuando el worker
+    lo suelta (al terminar el lote en curso); antes responde 409.
+    """
+    job = active_job(
+        db,
+        current_user,
+        JOB_KIND_BACKFILL,
+        [SyncJobStatus.pending, SyncJobStatus.running, SyncJobStatus.paused],
+    )
+    if job and restart and job.status == SyncJobStatus.running:
+        raise HTTPException(
+            status_code=409, detail="Pausa el backfill en curso antes de reiniciarlo"
+        )
+    if job and (restart or job.status == SyncJobStatus.paused):
+        if restart:
+            values = {
+                "status": SyncJobStatus.error,
+                "error_message": "Reemplazado por un backfill nuevo",
+            }
+        else:
+            values = {"status": SyncJobStatus.pending, "finished_at": None}
+        if not update_released_job(db, job.id, values):
+            db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="El backfill se está deteniendo; intenta de nuevo en unos segundos",
             )
-            .first()
+        if restart:
+            job = None
+        else:
+            db.commit()
+            db.refresh(job)
+            wake_runner()
+    if job is None:
+        if restart:
+            reset_checkpoints(db, current_user.id)
+        job = enqueue_sync_job(db, current_user, kind=JOB_KIND_BACKFILL)
+    return _backfill_status(db, current_user, job)
+
+
+@app.post("/backfill/pause")
+def pause_backfill(
+    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """Pausa el backfill; el worker se detiene al terminar el lote en curso."""
+    job = active_job(db, current_user, JOB_KIND_BACKFILL)
+    # Condicionado al status: el worker puede haber terminado mientras tanto
+    if not job or not (
+        db.query(SyncJob)
+        .filter(
+            SyncJob.id == job.id,
+            SyncJob.status.in_([SyncJobStatus.pending, SyncJobStatus.running]),
         )
-        if not membership:
-            return []
-        room_id = membership.room_id
-        txs = (
-            db.query(Transaction)
-            .filter(Transaction.duo_room_id == room_id)
-            .order_by(Transaction.date_time.desc())
-            .all()
+        .update({"status": SyncJobStatus.paused}, synchronize_session=False)
+    ):
+        raise HTTPException(status_code=404, detail="No hay un backfill en curso")
+    db.commit()
+    db.refresh(job)
+    return _backfill_status(db, current_user, job)
+
+
+@app.get("/backfill")
+def get_backfill(
+    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+):
+    """Último job de backfill y avance por carpeta"""
+    job = (
+        db.query(SyncJob)
+        .filter(SyncJob.user_id == current_user.id, SyncJob.kind == JOB_KIND_BACKFILL)
+        .order_by(SyncJob.id.desc())
+        .first()
+    )
+    return _backfill_status(db, current_user, job)
+
+
+# Tamaño de página de /transactions cuando se pide cursor sin limit, y máximo
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _naive(value: Optional[datetime]) -> Optional[datetime]:
+    # date_time se guarda sin zona horaria
+    return value.replace(tzinfo=None) if value is not None else None
+
+
+def encode_cursor(transaction: Transaction) -> str:
+    """Cursor opaco con la posición (date_time, id) de la última transacción."""
+    raw = f"{transaction.date_time.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        date_time, tx_id = raw.split("|")
+        return datetime.fromisoformat(date_time), int(tx_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def active_duo_room_query(user_id: int):
+    """SELECT de (room_id, data_version) de la sala duo activa del usuario."""
+    return (
+        select(DuoMembership.room_id, DuoRoom.data_version)
+        .join(DuoRoom, DuoRoom.id == DuoMembership.room_id)
+        .where(
+            DuoMembership.user_id == user_id,
+            DuoMembership.status == DuoStatus.active,
         )
+        .limit(1)
+    )
+
+
+def active_duo_room(db: Session, user_id: int):
+    """(room_id, data_version) de la sala duo activa del usuario, o None."""
+    return db.execute(active_duo_room_query(user_id)).first()
+
+
+# Las respuestas con ETag se pueden guardar, pero siempre se revalidan
+CACHE_CONTROL = "private, no-cache"
+
+
+def not_modified(request: Request, response: Response, tag: str):
+    """Pone el ETag en la respuesta, o devuelve un 304 si el cliente ya tiene esa versión."""
+    headers = {"ETag": tag, "Cache-Control": CACHE_CONTROL}
+    if versions.matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+# Campos de una transacción en los listados. Se seleccionan esas columnas como
+# tuplas (sin cargar objetos Transaction) y cada fila pasa a dict con zip
+TRANSACTION_FIELDS = ("id", "type", "description", "amount", "currency", "date_time")
+TRANSACTION_COLUMNS = tuple(getattr(Transaction, field) for field in TRANSACTION_FIELDS)
+
+
+def transactions_query(
+    user_id: Optional[int] = None,
+    room_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    types: Optional[List[str]] = None,
+    after=None,
+):
+    """SELECT de TRANSACTION_COLUMNS de un usuario o de una sala duo en el orden del listado.
+
+    after es la posición (date_time, id) de un cursor. El filtro y el orden
+    coinciden con ix_transactions_user_date / ix_transactions_room_date. Se
+    ejecuta con la sesión sync o la async.
+    """
+    query = select(*TRANSACTION_COLUMNS)
+    if room_id is not None:
+        query = query.where(Transaction.duo_room_id == room_id)
     else:
-        txs = (
-            db.query(Transaction)
-            .filter(Transaction.user_id == current_user.id)
-            .order_by(Transaction.date_time.desc())
-            .all()
+        query = query.where(Transaction.user_id == user_id)
+    if date_from is not None:
+        query = query.where(Transaction.date_time >= _naive(date_from))
+    if date_to is not None:
+        query = query.where(Transaction.date_time < _naive(date_to))
+    if types:
+        query = query.where(Transaction.type.in_(types))
+    if after is not None:
+        # Keyset: lo que viene después de (date_time, id) en el orden descendente
+        after_time, after_id = after
+        query = query.where(
+            or_(
+                Transaction.date_time < after_time,
+                and_(Transaction.date_time == after_time, Transaction.id < after_id),
+            )
+        )
+    return query.order_by(Transaction.date_time.desc(), Transaction.id.desc())
+
+
+@app.get("/transactions")
+async def list_transactions(
+    request: Request,
+    response: Response,
+    mode: str = Query("individual"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    types: Optional[List[str]] = Query(None, alias="type"),
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Transacciones del usuario (o de su sala duo), de la más reciente a la más antigua.
+
+    from es inclusivo y to exclusivo; type se puede repetir. Sin limit ni
+    cursor devuelve la lista completa, como siempre. Con limit o cursor
+    devuelve una página {"items": [...], "next_cursor": ...}; next_cursor es
+    null en la última página y si no se pasa al siguiente request.
+
+    El ETag sale de la versión de datos del usuario (y de la sala en modo duo);
+    con If-None-Match igual se responde 304 sin consultar las transacciones.
+    La respuesta se serializa con orjson (ver app.responses).
+    """
+    paginated = limit is not None or cursor is not None
+    query_params = request.query_params.multi_items()
+
+    if mode == "duo":
+        room = (await db.execute(active_duo_room_query(current_user.id))).first()
+        tag = versions.etag(
+            "d",
+            current_user.id,
+            current_user.data_version,
+            *(room if room else ("-",)),
+            query=query_params,
+        )
+        cached = not_modified(request, response, tag)
+        if cached is not None:
+            return cached
+        if room is None:
+            return {"items": [], "next_cursor": None} if paginated else []
+        owner = dict(room_id=room.room_id)
+    else:
+        tag = versions.etag(
+            "u", current_user.id, current_user.data_version, query=query_params
         )
+        cached = not_modified(request, response, tag)
+        if cached is not None:
+            return cached
+        owner = dict(user_id=current_user.id)
 
-    result = [
+    query = transactions_query(
+        date_from=date_from,
+        date_to=date_to,
+        types=types,
+        after=decode_cursor(cursor) if cursor is not None else None,
+        **owner,
+    )
+
+    if paginated:
+        limit = limit or DEFAULT_PAGE_SIZE
+        # Una fila de más para saber si hay otra página
+        txs = (await db.execute(query.limit(limit + 1))).all()
+        next_cursor = encode_cursor(txs[limit - 1]) if len(txs) > limit else None
+        result = [dict(zip(TRANSACTION_FIELDS, row)) for row in txs[:limit]]
+        return json_response({"items": result, "next_cursor": next_cursor}, response)
+
+    # La lista completa puede tener decenas de miles de filas: se serializa
+    # fuera del event loop para no frenar los demás requests
+    txs = (await db.execute(query)).all()
+    return await run_in_threadpool(
+        lambda: json_response([dict(zip(TRANSACTION_FIELDS, row)) for row in txs], response)
+    )
+
+
+def encode_changes_cursor(scope: str, version: int, tx_id: Optional[int] = None) -> str:
+    """Cursor opaco de /transactions/changes: dueño ("u<id>" o "r<id>") y versión vista.
+
+    tx_id es el último id entregado cuando la página terminó a mitad de una
+    versión (una importación escribe muchas filas con la misma versión).
+    """
+    raw = f"{scope}|{version}|{'' if tx_id is None else tx_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_changes_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        scope, version, tx_id = raw.split("|")
+        return scope, int(version), int(tx_id) if tx_id else None
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+CHANGE_FIELDS = TRANSACTION_FIELDS + ("updated_at",)
+
+
+@app.get("/transactions/changes")
+async def transaction_changes(
+    request: Request,
+    response: Response,
+    since: Optional[str] = Query(None),
+    mode: str = Query("individual"),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Transacciones creadas, editadas o borradas desde el cursor since.
+
+    Devuelve {"changed": [...], "deleted": [ids], "next_cursor", "has_more",
+    "reset"}. Sin since, changed trae todas las transacciones vigentes. El
+    cliente aplica primero deleted y después changed (SQLite puede reutilizar
+    el id de una transacción borrada), guarda next_cursor para el próximo
+    request y, si has_more, pide enseguida la página siguiente. reset indica
+    que el cursor era de otro dueño (el usuario cambió de sala duo): el
+    cliente descarta lo que tenía y empieza de nuevo con esta respuesta.
+
+    Mientras no haya cambios next_cursor no cambia y el ETag tampoco, así que
+    con If-None-Match la consulta periódica se responde con 304.
+    """
+    query_params = request.query_params.multi_items()
+
+    if mode == "duo":
+        room = (await db.execute(active_duo_room_query(current_user.id))).first()
+        tag = versions.etag(
+            "c",
+            current_user.id,
+            current_user.data_version,
+            *(room if room else ("-",)),
+            query=query_params,
+        )
+        cached = not_modified(request, response, tag)
+        if cached is not None:
+            return cached
+        if room is None:
+            return {
+                "changed": [],
+                "deleted": [],
+                "next_cursor": None,
+                "has_more": False,
+                "reset": since is not None,
+            }
+        scope = f"r{room.room_id}"
+        tx_owner = Transaction.duo_room_id == room.room_id
+        tombstone_owner = TransactionTombstone.duo_room_id == room.room_id
+        version_attr = "room_version"
+        owner_version = room.data_version
+    else:
+        tag = versions.etag("c", current_user.id, current_user.data_version, query=query_params)
+        cached = not_modified(request, response, tag)
+        if cached is not None:
+            return cached
+        scope = f"u{current_user.id}"
+        tx_owner = Transaction.user_id == current_user.id
+        tombstone_owner = TransactionTombstone.user_id == current_user.id
+        version_attr = "version"
+        owner_version = current_user.data_version
+    tx_version = getattr(Transaction, version_attr)
+    tombstone_version = getattr(TransactionTombstone, version_attr)
+
+    since_version = since_id = None
+    reset = False
+    if since is not None:
+        since_scope, since_version, since_id = decode_changes_cursor(since)
+        if since_scope != scope:
+            reset = True
+            since_version = since_id = None
+
+    # La versión va al final: zip con CHANGE_FIELDS la deja fuera de la respuesta
+    query = select(*TRANSACTION_COLUMNS, Transaction.updated_at, tx_version.label("version"))
+    query = query.where(tx_owner)
+    if since_version is not None:
+        if since_id is None:
+            query = query.where(tx_version > since_version)
+        else:
+            query = query.where(
+                or_(
+                    tx_version > since_version,
+                    and_(tx_version == since_version, Transaction.id > since_id),
+                )
+            )
+    txs = (await db.execute(query.order_by(tx_version, Transaction.id).limit(limit + 1))).all()
+    has_more = len(txs) > limit
+    txs = txs[:limit]
+
+    deleted = []
+    if since_version is not None:
+        # Las lápidas de las versiones que cubre esta página; las de la última
+        # versión ya van aquí aunque la página siguiente la continúe
+        tombstones = select(TransactionTombstone.transaction_id, tombstone_version).where(
+            tombstone_owner, tombstone_version > since_version
+        )
+        if has_more:
+            tombstones = tombstones.where(tombstone_version <= txs[-1].version)
+        deleted = (await db.execute(tombstones.order_by(tombstone_version))).all()
+
+    if has_more:
+        next_cursor = encode_changes_cursor(scope, txs[-1].version, txs[-1].id)
+    else:
+        seen = [row.version for row in txs] + [version for _, version in deleted]
+        if since_version is None:
+            # Sin cursor lo devuelto ya refleja todo hasta la versión del dueño
+            # (leída antes de la consulta), borrados incluidos: el cursor parte
+            # de ahí para no repetir esas lápidas en el próximo request
+            seen.append(owner_version)
+        else:
+            seen.append(since_version)
+        next_cursor = encode_changes_cursor(scope, max(seen))
+
+    return json_response(
         {
-            "id": t.id,
-            "type": t.type,
-            "description": t.description,
-            "amount": t.amount,
-            "currency": t.currency,
-            "date_time": t.date_time.isoformat(),
-        }
-        for t in txs
-    ]
-    return result
+            "changed": [dict(zip(CHANGE_FIELDS, row)) for row in txs],
+            "deleted": [tx_id for tx_id, _ in deleted],
+            "next_cursor": next_cursor,
+            "has_more": has_more,
+            "reset": reset,
+        },
+        response,
+    )
+
+
+# Filas por lote del export: se leen del cursor de la base y se envían como
+# un trozo de la respuesta
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+# Celdas de texto que Excel interpretaría como fórmula al abrir el CSV
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_text(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def export_chunks(export_format: str, **filters):
+    """Bytes del export de transactions_query(**filters), un lote de filas a la vez.
+
+    Abre su propia sesión, que vive lo que dure la respuesta (la del request
+    se cierra antes). Con yield_per la consulta usa stream_results (cursor del
+    lado del servidor en Postgres), así la memoria no depende de cuántas
+    transacciones tenga el historial.
+    """
+    db = SessionLocal()
+    try:
+        statement = transactions_query(**filters).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        result = db.execute(statement)
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(TRANSACTION_FIELDS)
+            for rows in result.partitions():
+                for tx_id, tx_type, description, amount, currency, date_time in rows:
+                    writer.writerow(
+                        (
+                            tx_id,
+                            _csv_text(tx_type),
+                            _csv_text(description),
+                            amount,
+                            currency,
+                            date_time.isoformat() if date_time else "",
+                        )
+                    )
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+        else:
+            for rows in result.partitions():
+                yield b"".join(
+                    orjson.dumps(dict(zip(TRANSACTION_FIELDS, row))) + b"\n" for row in rows
+                )
+    finally:
+        db.close()
+
+
+@app.get("/transactions/export")
+def export_transactions(
+    export_format: str = Query("csv", alias="format"),
+    mode: str = Query("individual"),
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    types: Optional[List[str]] = Query(None, alias="type"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Descarga todas las transacciones en CSV o NDJSON (una por línea).
+
+    Acepta los mismos filtros que /transactions y usa el mismo orden. Las
+    filas se envían a medida que se leen de la base.
+    """
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"format debe ser uno de: {', '.join(EXPORT_MEDIA_TYPES)}",
+        )
+    if mode == "duo":
+        room = active_duo_room(db, current_user.id)
+        # Sin sala activa no hay transacciones duo; room_id=0 no coincide con ninguna
+        owner = dict(room_id=room.room_id if room else 0)
+    else:
+        owner = dict(user_id=current_user.id)
+
+    return StreamingResponse(
+        export_chunks(
+            export_format, date_from=date_from, date_to=date_to, types=types, **owner
+        ),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="transacciones.{export_format}"'
+        },
+    )
+
+
+class TransactionCreate(BaseModel):
+    type: str
+    description: str
+    amount: int
+    date_time: str
+    mode: str = "individual"
+
+
+@app.post("/transactions")
+def create_transaction(
+    tx: TransactionCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    transaction = Transaction(
+        user_id=current_user.id,
+        type=tx.type,
+        description=tx.description,
+        amount=tx.amount,
+        currency="CLP",
+        date_time=datetime.fromisoformat(tx.date_time.replace("Z", "+00:00")),
+    )
+    # Si es modo duo, agregar a la sala
+    if tx.mode == "duo":
+        room = active_duo_room(db, current_user.id)
+        transaction.duo_room_id = room.room_id if room else None
+
+    db.add(transaction)
+    rollups.apply(db, [transaction])
+    versions.touch(db, [transaction])
+    db.commit()
+    db.refresh(transaction)
+
+    return {
+        "id": transaction.id,
+        "type": transaction.type,
+        "description": transaction.description,
+        "amount": transaction.amount,
+        "currency": transaction.currency,
+        "date_time": transaction.date_time.isoformat(),
+    }
 
 
 class TransactionUpdate(BaseModel):
@@ -224,10 +847,14 @@ def update_transaction(
 
     date_time = datetime.fromisoformat(tx.date_time.replace("Z", "+00:00"))
 
+    # Los resúmenes restan los valores anteriores y suman los nuevos
+    rollups.apply(db, [transaction], sign=-1)
     transaction.type = tx.type
     transaction.description = tx.description
     transaction.amount = tx.amount
     transaction.date_time = date_time
+    rollups.apply(db, [transaction])
+    versions.touch(db, [transaction])
 
     db.commit()
     db.refresh(transaction)
@@ -266,8 +893,9 @@ def delete_transaction(
         # Guardar ID antes de eliminar
         transaction_id_backup = transaction.id
 
-        # Eliminar usando el método correcto de SQLAlchemy
-        db.delete(transaction)
+        # Eliminar dejando una lápida para /transactions/changes
+        rollups.apply(db, [transaction], sign=-1)
+        versions.delete(db, transaction)
         db.commit()
 
         return {"status": "deleted", "id": transaction_id_backup}
@@ -281,6 +909,60 @@ def delete_transaction(
         )
 
 
+@app.get("/summary")
+async def get_summary(
+    mode: str = Query("individual"),
+    period: str = Query("month"),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    types: Optional[List[str]] = Query(None, alias="type"),
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Totales por período (day, week o month) y por tipo del usuario o su sala duo.
+
+    Se leen de spending_rollups, así que el costo depende de la cantidad de
+    períodos y no de transacciones. Con from (inclusivo) y to (exclusivo) se
+    devuelven completos los períodos que se superponen con ese rango.
+    """
+    if period not in rollups.GRANULARITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"period debe ser uno de: {', '.join(rollups.GRANULARITIES)}",
+        )
+    result = {"mode": mode, "period": period, "periods": [], "by_type": {}}
+    if mode == "duo":
+        room = (await db.execute(active_duo_room_query(current_user.id))).first()
+        if room is None:
+            return result
+        owner = (rollups.OWNER_ROOM, room.room_id)
+    else:
+        owner = (rollups.OWNER_USER, current_user.id)
+
+    periods = {}
+    by_type = result["by_type"]
+    rows = await db.execute(
+        rollups.summary_query(*owner, period, date_from=date_from, date_to=date_to, types=types)
+    )
+    for start, tx_type, count, total in rows:
+        entry = periods.get(start)
+        if entry is None:
+            entry = periods[start] = {
+                "period_start": start.isoformat(),
+                "count": 0,
+                "total": 0,
+                "by_type": {},
+            }
+        entry["count"] += count
+        entry["total"] += total
+        entry["by_type"][tx_type] = {"count": count, "total": total}
+        totals = by_type.setdefault(tx_type, {"count": 0, "total": 0})
+        totals["count"] += count
+        totals["total"] += total
+    result["periods"] = list(periods.values())
+    return result
+
+
 class JoinRequest(BaseModel):
     invite_code: str
 
@@ -309,6 +991,8 @@ def create_duo_invite(
         status=DuoStatus.active,
     )
     db.add(owner)
+    # Cambia el "duo" de /me y las transacciones del modo duo
+    versions.bump(db, user_ids=[current_user.id])
     db.commit()
     return {"invite_code": code}
 
@@ -336,26 +1020,39 @@ def join_duo(
         status=DuoStatus.active,
     )
     db.add(membership)
+    versions.bump(db, user_ids=[current_user.id])
     db.commit()
     return {"status": "joined"}
 
 
 @app.get("/me")
-def me(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def me(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    cached = not_modified(
+        request, response, versions.etag("m", current_user.id, current_user.data_version)
+    )
+    if cached is not None:
+        return cached
     membership = (
-        db.query(DuoMembership)
-        .filter(
-            DuoMembership.user_id == current_user.id,
-            DuoMembership.status == DuoStatus.active,
+        await db.execute(
+            select(DuoRoom.id, DuoRoom.invite_code, DuoMembership.role)
+            .join(DuoRoom, DuoRoom.id == DuoMembership.room_id)
+            .where(
+                DuoMembership.user_id == current_user.id,
+                DuoMembership.status == DuoStatus.active,
+            )
+            .limit(1)
         )
-        .first()
-    )
+    ).first()
     duo = None
     if membership:
-        room = db.query(DuoRoom).filter(DuoRoom.id == membership.room_id).first()
         duo = {
-            "room_id": room.id,
-            "invite_code": room.invite_code,
+            "room_id": membership.id,
+            "invite_code": membership.invite_code,
             "role": membership.role.value,
         }
     return {
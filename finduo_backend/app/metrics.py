@@ -0,0 +1,210 @@
+"""Métricas de la sincronización de correo en formato de texto de Prometheus.
+
+Los contadores e histogramas son del proceso (API o sync_worker) y se exponen
+en GET /metrics. Además cada sincronización acumula sus propios números en un
+SyncStats, que se guarda en el resultado del job para ver en qué se fue el
+tiempo de un buzón lento.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Límites de los histogramas de tiempo (segundos)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por cada combinación de etiquetas: [cuentas por bucket..., suma, total]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, data in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, data):
+                    lines.append(
+                        f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {count}"
+                    )
+                lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {data[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(data[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {data[-1]}")
+        return lines
+
+
+def render():
+    """Todas las métricas del proceso en formato de texto de Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """Expone /metrics en un hilo; lo usan los procesos sin API (sync_worker)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
+
+
+SYNC_RUNS = Counter(
+    "finduo_sync_runs_total", "Sincronizaciones terminadas por resultado", ["status"]
+)
+SYNC_SECONDS = Histogram("finduo_sync_duration_seconds", "Duración de cada sincronización")
+STAGE_SECONDS = Histogram(
+    "finduo_sync_stage_seconds",
+    "Tiempo por etapa: connect, login, select, search, fetch (por lote), decode, parse, insert",
+    ["stage"],
+)
+FETCH_BYTES = Counter("finduo_sync_fetch_bytes_total", "Bytes descargados por UID FETCH")
+MESSAGES = Counter(
+    "finduo_sync_messages_total",
+    "Correos procesados: imported, duplicate, unparsed, empty o error",
+    ["result"],
+)
+TEMPLATE_MATCHES = Counter(
+    "finduo_parser_template_matches_total",
+    "Correos parseados por plantilla (none si ninguna coincidió)",
+    ["template"],
+)
+
+
+class SyncStats:
+    """Números de una sincronización; también actualiza las métricas del proceso.
+
+    Las etapas del pipeline corren en hilos distintos, así que todo pasa por un
+    lock.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.templates = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def fetched(self, count, size):
+        FETCH_BYTES.inc(size)
+        with self._lock:
+            self.counts["fetched"] += count
+            self.counts["fetch_bytes"] += size
+
+    def count(self, result, amount=1):
+        if not amount:
+            return
+        MESSAGES.inc(amount, result=result)
+        with self._lock:
+            self.counts[result] += amount
+
+    def template(self, name):
+        name = name or "none"
+        TEMPLATE_MATCHES.inc(template=name)
+        with self._lock:
+            self.templates[name] += 1
+
+    def to_dict(self):
+        with self._lock:
+            parsed = sum(self.templates.values())
+            matched = parsed - self.templates.get("none", 0)
+            return {
+                "seconds": {k: round(v, 4) for k, v in sorted(self.seconds.items())},
+                "counts": dict(sorted(self.counts.items())),
+                "templates": dict(sorted(self.templates.items())),
+                "parse_hit_rate": round(matched / parsed, 4) if parsed else None,
+            }
@@ -1,4 +1,17 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    Date,
+    DateTime,
+    ForeignKey,
+    Enum,
+    Index,
+    JSON,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -14,6 +27,8 @@ class User(Base):
     name = Column(String)
     password_hash = Column(String, nullable=True)  # Nullable para compatibilidad con usuarios existentes
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Aumenta con cada cambio en sus transacciones o en /me (ver app.versions)
+    data_version = Column(BigInteger, nullable=False, default=0, server_default="0")
 
     transactions = relationship("Transaction", back_populates="user")
     duo_memberships = relationship("DuoMembership", back_populates="user")
@@ -29,6 +44,14 @@ class DuoStatus(str, enum.Enum):
     active = "active"
 
 
+class SyncJobStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    paused = "paused"
+    done = "done"
+    error = "error"
+
+
 class DuoRoom(Base):
     __tablename__ = "duo_rooms"
 
@@ -36,6 +59,8 @@ class DuoRoom(Base):
     name = Column(String, default="FinDuo")
     invite_code = Column(String, unique=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Aumenta con cada cambio en las transacciones de la sala (ver app.versions)
+    data_version = Column(BigInteger, nullable=False, default=0, server_default="0")
 
     memberships = relationship("DuoMembership", back_populates="room")
     transactions = relationship("Transaction", back_populates="duo_room")
@@ -43,6 +68,10 @@ class DuoRoom(Base):
 
 class DuoMembership(Base):
     __tablename__ = "duo_memberships"
+    __table_args__ = (
+        # Búsqueda de la membresía activa del usuario en cada request duo
+        Index("ix_duo_memberships_user_status", "user_id", "status"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -67,6 +96,186 @@ class Transaction(Base):
     currency = Column(String, default="CLP")
     date_time = Column(DateTime, default=datetime.utcnow)
 
+    # Message-ID del correo de origen (o hash del contenido); NULL si se creó a mano
+    source_message_id = Column(String(255), nullable=True)
+
+    # Última modificación (NULL en las anteriores a /transactions/changes)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # data_version del usuario y de la sala con que se escribió por última vez;
+    # es la posición de la fila en /transactions/changes (ver app.versions)
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    room_version = Column(BigInteger, nullable=True)
+
     user = relationship("User", back_populates="transactions")
     duo_room = relationship("DuoRoom", back_populates="transactions")
 
+    __table_args__ = (
+        # Un mismo correo solo se importa una vez por usuario
+        Index(
+            "ix_transactions_user_source",
+            "user_id",
+            "source_message_id",
+            unique=True,
+        ),
+    )
+
+
+# Listado de /transactions: filtro por dueño y orden (date_time desc, id desc),
+# así cada página es un rango del índice sin ordenar
+Index(
+    "ix_transactions_user_date",
+    Transaction.user_id,
+    Transaction.date_time.desc(),
+    Transaction.id.desc(),
+)
+Index(
+    "ix_transactions_room_date",
+    Transaction.duo_room_id,
+    Transaction.date_time.desc(),
+    Transaction.id.desc(),
+)
+# /transactions/changes: lo escrito después de una versión, en orden de versión
+Index("ix_transactions_user_version", Transaction.user_id, Transaction.version, Transaction.id)
+Index(
+    "ix_transactions_room_version",
+    Transaction.duo_room_id,
+    Transaction.room_version,
+    Transaction.id,
+)
+
+
+class TransactionTombstone(Base):
+    """Transacción borrada, para que /transactions/changes informe el borrado.
+
+    version y room_version son las versiones de datos del usuario y de la sala
+    con que se borró, igual que Transaction.version en las filas vivas.
+    """
+
+    __tablename__ = "transaction_tombstones"
+    __table_args__ = (
+        Index("ix_transaction_tombstones_user_version", "user_id", "version"),
+        Index("ix_transaction_tombstones_room_version", "duo_room_id", "room_version"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    duo_room_id = Column(Integer, ForeignKey("duo_rooms.id"), nullable=True)
+    version = Column(BigInteger, nullable=False)
+    room_version = Column(BigInteger, nullable=True)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+
+class EmailSyncState(Base):
+    """Marca de agua de la sincronización IMAP por usuario y carpeta."""
+
+    __tablename__ = "email_sync_states"
+    __table_args__ = (
+        UniqueConstraint("user_id", "folder", name="uq_email_sync_state_user_folder"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    folder = Column(String, nullable=False)
+    # UIDVALIDITY y UID son enteros sin signo de 32 bits en IMAP
+    uidvalidity = Column(BigInteger, nullable=False)
+    last_uid = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SyncJob(Base):
+    """Sincronización de correo encolada por POST /sync-email."""
+
+    __tablename__ = "sync_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    status = Column(Enum(SyncJobStatus), default=SyncJobStatus.pending, index=True)
+    # "sync" (incremental) o "backfill" (historial completo); NULL en jobs antiguos
+    kind = Column(String, nullable=True, default="sync")
+    # Servidor IMAP del buzón, para limitar conexiones simultáneas por host
+    imap_host = Column(String, nullable=True)
+    imported = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    error_message = Column(String, nullable=True)
+    # Tiempo por etapa y contadores de la ejecución (ver app.metrics.SyncStats)
+    metrics = Column(JSON, nullable=True)
+    # Worker que tiene el job y hasta cuándo; si el lease vence se reintenta
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class BackfillCheckpoint(Base):
+    """Avance del backfill de una carpeta: se guarda después de cada lote."""
+
+    __tablename__ = "backfill_checkpoints"
+    __table_args__ = (
+        UniqueConstraint("user_id", "folder", name="uq_backfill_checkpoint_user_folder"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    folder = Column(String, nullable=False)
+    uidvalidity = Column(BigInteger, nullable=True)
+    # Último UID ya importado; se retoma desde el siguiente
+    last_uid = Column(BigInteger, nullable=False, default=0)
+    processed = Column(Integer, default=0)
+    total = Column(Integer, nullable=True)
+    finished = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Mailbox(Base):
+    """Buzón IMAP de un usuario. La contraseña se guarda cifrada."""
+
+    __tablename__ = "mailboxes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
+    imap_host = Column(String, nullable=False, default="imap.gmail.com")
+    imap_port = Column(Integer, nullable=False, default=993)
+    username = Column(String, nullable=False)
+    password_encrypted = Column(String, nullable=False)
+    enabled = Column(Boolean, default=True, nullable=False)
+    next_sync_at = Column(DateTime, nullable=True, index=True)
+    last_synced_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    user = relationship("User")
+
+
+class SpendingRollup(Base):
+    """Totales por dueño, período y tipo de transacción (ver app.rollups).
+
+    owner_type es "user" (todas las transacciones del usuario) o "room" (las de
+    la sala duo). Se actualiza en la misma transacción de base de datos que
+    cada alta, edición, borrado o importación de transacciones.
+    """
+
+    __tablename__ = "spending_rollups"
+    __table_args__ = (
+        UniqueConstraint(
+            "owner_type",
+            "owner_id",
+            "granularity",
+            "period_start",
+            "type",
+            name="uq_spending_rollup_key",
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    owner_type = Column(String(8), nullable=False)
+    owner_id = Column(Integer, nullable=False)
+    # "day", "week" (desde el lunes) o "month"
+    granularity = Column(String(8), nullable=False)
+    period_start = Column(Date, nullable=False)
+    type = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    total = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,81 @@
+"""Etapas de procesamiento encadenadas por colas acotadas.
+
+staged() consume un iterable en un hilo propio y entrega sus elementos (o el
+resultado de aplicarles una función) por una cola de tamaño fijo. Si la etapa
+siguiente se atrasa el productor queda bloqueado, así que la memoria no crece
+con el tamaño del buzón y las etapas (IMAP, decodificación, base de datos) se
+solapan en el tiempo.
+"""
+import os
+import queue
+import threading
+
+# Lotes en espera entre dos etapas
+PIPELINE_QUEUE_SIZE = int(os.getenv("SYNC_PIPELINE_QUEUE_SIZE", "2"))
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def batched(iterable, size):
+    """Agrupa los elementos de iterable en listas de a lo más size."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def staged(iterable, func=None, maxsize=None, name="pipeline"):
+    """Itera iterable en otro hilo a través de una cola acotada.
+
+    Las excepciones del productor se relanzan en el consumidor. Si el consumidor
+    deja de iterar se detiene el productor y se cierra el iterable de origen.
+    """
+    items = queue.Queue(maxsize or PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if func is not None:
+                    item = func(item)
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,27 @@
+"""Respuestas JSON serializadas con orjson para los listados."""
+import orjson
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse que serializa con orjson.
+
+    orjson escribe los datetime en ISO 8601 (igual que isoformat()), así que
+    las filas se pasan con sus valores de la base tal cual.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+def json_response(content, response: Response = None) -> ORJSONResponse:
+    """ORJSONResponse con los headers que el endpoint puso en response (ETag, etc.).
+
+    Se devuelve directamente desde el endpoint: FastAPI no pasa el contenido
+    por jsonable_encoder, pero tampoco copia los headers de response.
+    """
+    result = ORJSONResponse(content)
+    if response is not None:
+        result.headers.raw.extend(response.headers.raw)
+    return result
@@ -0,0 +1,127 @@
+"""Resúmenes de gasto mantenidos de forma incremental.
+
+Cada transacción suma su monto en spending_rollups para su usuario y, si tiene,
+para su sala duo, en los períodos day, week y month de su fecha. Los
+resúmenes de /summary leen esas filas (una por período y tipo) en lugar de
+recorrer todas las transacciones.
+
+Quien escribe transacciones llama a apply() antes del commit: con sign=1 al
+crear, sign=-1 al borrar, y las dos cosas (antes y después del cambio) al
+editar.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .models import SpendingRollup
+
+GRANULARITIES = ("day", "week", "month")
+OWNER_USER = "user"
+OWNER_ROOM = "room"
+
+
+def period_start(value, granularity) -> date:
+    """Primer día del período (día, semana desde el lunes o mes) de la fecha."""
+    day = value.date() if isinstance(value, datetime) else value
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Granularidad desconocida: {granularity}")
+
+
+def _upsert(db):
+    """INSERT que suma count y total si la fila del período ya existe."""
+    if db.get_bind().dialect.name == "postgresql":
+        stmt = postgresql_insert(SpendingRollup)
+    else:
+        stmt = sqlite_insert(SpendingRollup)
+    return stmt.on_conflict_do_update(
+        index_elements=["owner_type", "owner_id", "granularity", "period_start", "type"],
+        set_={
+            "count": SpendingRollup.count + stmt.excluded.count,
+            "total": SpendingRollup.total + stmt.excluded.total,
+        },
+    )
+
+
+def apply(db, transactions, sign=1):
+    """Suma (sign=1) o resta (sign=-1) transacciones en los resúmenes (sin commit).
+
+    transactions son objetos o filas con user_id, duo_room_id, type, amount y
+    date_time. Los valores se leen al llamar, así que al editar se llama con
+    sign=-1 antes de cambiar la transacción.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for t in transactions:
+        if t.date_time is None:
+            continue
+        owners = [(OWNER_USER, t.user_id)]
+        if t.duo_room_id is not None:
+            owners.append((OWNER_ROOM, t.duo_room_id))
+        for owner_type, owner_id in owners:
+            for granularity in GRANULARITIES:
+                key = (
+                    owner_type,
+                    owner_id,
+                    granularity,
+                    period_start(t.date_time, granularity),
+                    t.type or "",
+                )
+                deltas[key][0] += sign
+                deltas[key][1] += sign * (t.amount or 0)
+    if not deltas:
+        return
+    # Siempre en el mismo orden, para que dos escrituras concurrentes no se
+    # bloqueen mutuamente en Postgres
+    db.execute(
+        _upsert(db),
+        [
+            dict(
+                owner_type=owner_type,
+                owner_id=owner_id,
+                granularity=granularity,
+                period_start=start,
+                type=tx_type,
+                count=count,
+                total=total,
+            )
+            for (owner_type, owner_id, granularity, start, tx_type), (count, total) in sorted(
+                deltas.items()
+            )
+        ],
+    )
+
+
+def summary_query(owner_type, owner_id, granularity, date_from=None, date_to=None, types=None):
+    """SELECT de (period_start, type, count, total) del dueño, por período ascendente.
+
+    date_from (inclusivo) y date_to (exclusivo) son fechas (date). Los dos se
+    llevan al inicio de su período: se devuelven, completos, los períodos desde
+    el que contiene date_from hasta el que contiene el día anterior a date_to,
+    es decir, los que se superponen con [date_from, date_to).
+    """
+    query = select(
+        SpendingRollup.period_start,
+        SpendingRollup.type,
+        SpendingRollup.count,
+        SpendingRollup.total,
+    ).where(
+        SpendingRollup.owner_type == owner_type,
+        SpendingRollup.owner_id == owner_id,
+        SpendingRollup.granularity == granularity,
+        SpendingRollup.count != 0,
+    )
+    if date_from is not None:
+        query = query.where(SpendingRollup.period_start >= period_start(date_from, granularity))
+    if date_to is not None:
+        last = period_start(date_to - timedelta(days=1), granularity)
+        query = query.where(SpendingRollup.period_start <= last)
+    if types:
+        query = query.where(SpendingRollup.type.in_(types))
+    return query.order_by(SpendingRollup.period_start, SpendingRollup.type)
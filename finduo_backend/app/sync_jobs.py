@@ -0,0 +1,436 @@
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_
+
+from .database import SessionLocal, engine
+from .models import SyncJob, SyncJobStatus, User
+from . import backfill
+from .email_sync import sync_emails_to_db
+from .mailboxes import mailbox_host, record_mailbox_sync, sync_error_message
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+# Cantidad de sincronizaciones que se ejecutan en paralelo dentro del proceso
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "2"))
+
+# Si es "0" la API solo encola y los jobs los ejecuta `python -m app.sync_worker`
+SYNC_IN_PROCESS = os.getenv("SYNC_IN_PROCESS", "1") != "0"
+
+# Segundos de validez del lease de un job; el worker lo renueva mientras corre
+SYNC_LEASE_SECONDS = int(os.getenv("SYNC_LEASE_SECONDS", "120"))
+
+# Intentos máximos de un job cuyo worker murió antes de terminarlo
+SYNC_MAX_ATTEMPTS = int(os.getenv("SYNC_MAX_ATTEMPTS", "3"))
+
+# Segundos entre consultas a la tabla de jobs cuando no hay trabajo
+SYNC_POLL_INTERVAL = float(os.getenv("SYNC_POLL_INTERVAL", "5"))
+
+# Sincronizaciones simultáneas entre todos los workers, y por servidor IMAP
+SYNC_GLOBAL_CONCURRENCY = int(os.getenv("SYNC_GLOBAL_CONCURRENCY", "50"))
+SYNC_MAX_PER_HOST = int(os.getenv("SYNC_MAX_PER_HOST", "10"))
+
+# Lock para tomar jobs en SQLite, que no soporta FOR UPDATE SKIP LOCKED
+SYNC_CLAIM_LOCK_FILE = os.getenv(
+    "SYNC_CLAIM_LOCK_FILE", os.path.join(tempfile.gettempdir(), "finduo-sync-claim.lock")
+)
+
+# Tipos de job: sincronización incremental o historial completo (app.backfill)
+JOB_KIND_SYNC = "sync"
+JOB_KIND_BACKFILL = "backfill"
+
+_claim_thread_lock = threading.Lock()
+_runner = None
+
+
+def job_to_dict(job: SyncJob):
+    return {
+        "job_id": job.id,
+        "kind": job.kind or JOB_KIND_SYNC,
+        "status": job.status.value,
+        "imported": job.imported or 0,
+        "skipped": job.skipped or 0,
+        "errors": job.errors or 0,
+        "error": job.error_message,
+        "attempts": job.attempts or 0,
+        "metrics": job.metrics,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def active_job(db, user: User, kind=JOB_KIND_SYNC, statuses=None):
+    """Último job del tipo dado del usuario que sigue pendiente o en curso."""
+    statuses = statuses or [SyncJobStatus.pending, SyncJobStatus.running]
+    query = db.query(SyncJob).filter(
+        SyncJob.user_id == user.id, SyncJob.status.in_(statuses)
+    )
+    if kind == JOB_KIND_SYNC:
+        query = query.filter(or_(SyncJob.kind.is_(None), SyncJob.kind == kind))
+    else:
+        query = query.filter(SyncJob.kind == kind)
+    return query.order_by(SyncJob.id.desc()).first()
+
+
+def enqueue_sync_job(
+    db, user: User, imap_host=None, commit=True, kind=JOB_KIND_SYNC
+) -> SyncJob:
+    """Encola una sincronización para el usuario y devuelve el job.
+
+    Si el usuario ya tiene un job del mismo tipo pendiente o en curso se
+    devuelve ese mismo en lugar de crear otro. Con commit=False el llamador
+    hace el commit (por ejemplo el scheduler, que encola varios jobs a la vez).
+    """
+    job = active_job(db, user, kind)
+    if job:
+        return job
+
+    job = SyncJob(
+        user_id=user.id,
+        kind=kind,
+        status=SyncJobStatus.pending,
+        imap_host=imap_host or mailbox_host(db, user.id),
+    )
+    db.add(job)
+    if not commit:
+        db.flush()
+        return job
+
+    db.commit()
+    db.refresh(job)
+    wake_runner()
+    logger.info(f"Sincronización encolada: job={job.id} tipo={kind} usuario={user.email}")
+    return job
+
+
+def wake_runner():
+    """Avisa al runner de este proceso (si hay) que hay jobs nuevos."""
+    if _runner is not None:
+        _runner.wake()
+
+
+@contextmanager
+def claim_lock():
+    """Serializa la toma de jobs en SQLite entre hilos y procesos del mismo host."""
+    if engine.dialect.name == "postgresql":
+        yield
+        return
+
+    with _claim_thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(SYNC_CLAIM_LOCK_FILE, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def claim_job(worker_id: str):
+    """Toma el siguiente job disponible y devuelve su id, o None si no hay.
+
+    Un job está disponible si está pendiente o si su lease venció (el worker que
+    lo tenía murió). En Postgres se usa SELECT ... FOR UPDATE SKIP LOCKED para
+    que varios workers no compitan por la misma fila. No se toman jobs si ya hay
+    SYNC_GLOBAL_CONCURRENCY en curso, ni de servidores IMAP que ya tienen
+    SYNC_MAX_PER_HOST conexiones.
+    """
+    db = SessionLocal()
+    try:
+        with claim_lock():
+            while True:
+                now = datetime.utcnow()
+                running = (
+                    db.query(SyncJob.imap_host, func.count(SyncJob.id))
+                    .filter(
+                        SyncJob.status == SyncJobStatus.running,
+                        SyncJob.lease_expires_at >= now,
+                    )
+                    .group_by(SyncJob.imap_host)
+                    .all()
+                )
+                if sum(count for _, count in running) >= SYNC_GLOBAL_CONCURRENCY:
+                    db.rollback()
+                    return None
+                full_hosts = [
+                    host for host, count in running if host and count >= SYNC_MAX_PER_HOST
+                ]
+
+                query = db.query(SyncJob).filter(
+                    or_(
+                        SyncJob.status == SyncJobStatus.pending,
+                        and_(
+                            SyncJob.status == SyncJobStatus.running,
+                            SyncJob.lease_expires_at < now,
+                        ),
+                    )
+                )
+                if full_hosts:
+                    query = query.filter(
+                        or_(
+                            SyncJob.imap_host.is_(None),
+                            SyncJob.imap_host.notin_(full_hosts),
+                        )
+                    )
+                query = query.order_by(SyncJob.id)
+                if engine.dialect.name == "postgresql":
+                    query = query.with_for_update(skip_locked=True)
+                job = query.first()
+                if job is None:
+                    db.rollback()
+                    return None
+
+                if (job.attempts or 0) >= SYNC_MAX_ATTEMPTS:
+                    logger.warning(
+                        f"Job {job.id} abandonado tras {job.attempts} intentos"
+                    )
+                    job.status = SyncJobStatus.error
+                    job.error_message = "El worker se detuvo demasiadas veces"
+                    job.finished_at = now
+                    db.commit()
+                    continue
+
+                job.status = SyncJobStatus.running
+                job.worker_id = worker_id
+                job.lease_expires_at = now + timedelta(seconds=SYNC_LEASE_SECONDS)
+                job.attempts = (job.attempts or 0) + 1
+                job.started_at = now
+                db.commit()
+                return job.id
+    finally:
+        db.close()
+
+
+def update_released_job(db, job_id: int, values) -> bool:
+    """Actualiza el job solo si ningún worker lo tiene tomado (sin commit).
+
+    Un job pausado sigue tomado hasta que el worker termina el lote en curso y
+    execute_job libera el lease; si el lease venció, el worker murió. Devuelve
+    False si el job sigue tomado.
+    """
+    updated = (
+        db.query(SyncJob)
+        .filter(
+            SyncJob.id == job_id,
+            or_(
+                SyncJob.lease_expires_at.is_(None),
+                SyncJob.lease_expires_at < datetime.utcnow(),
+            ),
+        )
+        .update(values, synchronize_session=False)
+    )
+    return bool(updated)
+
+
+def renew_leases(worker_id: str, job_ids):
+    """Extiende el lease de los jobs que este worker sigue ejecutando.
+
+    También los pausados: el worker los mantiene hasta terminar el lote en curso.
+    """
+    if not job_ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(SyncJob).filter(
+            SyncJob.id.in_(list(job_ids)),
+            SyncJob.worker_id == worker_id,
+            SyncJob.status.in_([SyncJobStatus.running, SyncJobStatus.paused]),
+        ).update(
+            {
+                "lease_expires_at": datetime.utcnow()
+                + timedelta(seconds=SYNC_LEASE_SECONDS)
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def execute_job(job_id: int, worker_id: str):
+    """Ejecuta un job ya tomado por este worker y guarda su resultado."""
+    db = SessionLocal()
+    try:
+        job = db.query(SyncJob).filter(SyncJob.id == job_id).first()
+        user_id = job.user_id
+        kind = job.kind or JOB_KIND_SYNC
+        user = db.query(User).filter(User.id == user_id).first()
+        user_email = user.email if user else None
+        db.rollback()  # no mantener la transacción abierta durante el sync
+
+        values = {"lease_expires_at": None}
+        if user_email is None:
+            values.update(status=SyncJobStatus.error, error_message="Usuario no encontrado")
+        else:
+            try:
+                if kind == JOB_KIND_BACKFILL:
+                    result = backfill.backfill_user(user_email, job_id=job_id)
+                else:
+                    result = sync_emails_to_db(user_email)
+            except Exception as e:
+                logger.error(f"Error en sincronización job={job_id}: {e}", exc_info=True)
+                values.update(status=SyncJobStatus.error, error_message=sync_error_message(e))
+            else:
+                paused = result.get("paused", False)
+                if not paused:
+                    # Si se detuvo, el status ya es el que pidió detenerlo (paused)
+                    values["status"] = SyncJobStatus.done
+                values.update(
+                    imported=result["imported"],
+                    skipped=result["skipped"],
+                    errors=result["errors"],
+                    metrics=result.get("metrics"),
+                )
+                logger.info(
+                    f"Sincronización {'pausada' if paused else 'completada'}: "
+                    f"job={job_id} {result['imported']} correos importados"
+                )
+        values["finished_at"] = datetime.utcnow()
+
+        # Solo se guarda si el job sigue siendo de este worker
+        updated = (
+            db.query(SyncJob)
+            .filter(SyncJob.id == job_id, SyncJob.worker_id == worker_id)
+            .update(values, synchronize_session=False)
+        )
+        if updated:
+            record_mailbox_sync(db, user_id, values.get("error_message"))
+        db.commit()
+        if not updated:
+            logger.warning(f"Job {job_id} fue tomado por otro worker, descartando resultado")
+    except Exception as e:
+        logger.error(f"Error ejecutando job={job_id}: {e}", exc_info=True)
+        db.rollback()
+    finally:
+        db.close()
+
+
+class SyncJobRunner:
+    """Toma jobs de la tabla sync_jobs y los ejecuta con concurrencia limitada.
+
+    Lo usan tanto la API (ejecución dentro del proceso) como app.sync_worker.
+    Mientras un job corre, un hilo renueva su lease; si el proceso muere el lease
+    vence y otro worker lo reintenta.
+    """
+
+    def __init__(self, concurrency=SYNC_WORKERS, worker_id=None, poll_interval=None):
+        self.concurrency = concurrency
+        self.worker_id = worker_id or (
+            f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        )
+        self.poll_interval = poll_interval or SYNC_POLL_INTERVAL
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="sync-worker"
+        )
+        self._slots = threading.Semaphore(concurrency)
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._heartbeat_stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for target, name in (
+            (self._poll_loop, "sync-poller"),
+            (self._heartbeat_loop, "sync-heartbeat"),
+        ):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(
+            f"Worker de sincronización {self.worker_id} iniciado (concurrencia={self.concurrency})"
+        )
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Deja de tomar jobs y espera a que terminen los que están en curso.
+
+        Con timeout se espera como máximo esos segundos; los jobs que sigan
+        corriendo pierden su lease y otro worker los reintenta.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._threads[0].join()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._active and (deadline is None or time.monotonic() < deadline):
+            self._heartbeat_stop.wait(0.2)
+
+        self._heartbeat_stop.set()
+        self._threads[1].join()
+        self._executor.shutdown(wait=False)
+        # Con jobs todavía en curso no se espera a los procesos del backfill
+        backfill.shutdown_shared_pool(wait=not self._active)
+        logger.info(f"Worker de sincronización {self.worker_id} detenido")
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            if not self._slots.acquire(timeout=self.poll_interval):
+                continue
+            try:
+                job_id = None if self._stop.is_set() else claim_job(self.worker_id)
+            except Exception as e:
+                logger.error(f"Error tomando jobs: {e}", exc_info=True)
+                job_id = None
+
+            if job_id is None:
+                self._slots.release()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            with self._active_lock:
+                self._active.add(job_id)
+            self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        try:
+            execute_job(job_id, self.worker_id)
+        finally:
+            with self._active_lock:
+                self._active.discard(job_id)
+            self._slots.release()
+
+    def _heartbeat_loop(self):
+        while not self._heartbeat_stop.wait(SYNC_LEASE_SECONDS / 3):
+            with self._active_lock:
+                job_ids = set(self._active)
+            try:
+                renew_leases(self.worker_id, job_ids)
+            except Exception as e:
+                logger.error(f"Error renovando leases: {e}", exc_info=True)
+
+
+def start_in_process_runner():
+    """Inicia el runner dentro de la API salvo que SYNC_IN_PROCESS=0."""
+    global _runner
+    if SYNC_IN_PROCESS and _runner is None:
+        _runner = SyncJobRunner(concurrency=SYNC_WORKERS)
+        _runner.start()
+
+
+def stop_in_process_runner():
+    global _runner
+    if _runner is not None:
+        _runner.stop(timeout=0)
+        _runner = None
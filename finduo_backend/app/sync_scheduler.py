@@ -0,0 +1,99 @@
+import logging
+import os
+import random
+import threading
+from datetime import datetime
+
+from sqlalchemy import or_
+
+from .database import SessionLocal, engine
+from .models import Mailbox, SyncJob, SyncJobStatus
+from .mailboxes import next_sync_time
+from .sync_jobs import claim_lock, enqueue_sync_job, wake_runner
+
+logger = logging.getLogger(__name__)
+
+
+# Si es "1" el proceso (API o sync_worker) encola sincronizaciones periódicas
+SYNC_SCHEDULER_ENABLED = os.getenv("SYNC_SCHEDULER_ENABLED", "0") == "1"
+
+# Segundos entre revisiones de buzones pendientes
+SYNC_SCHEDULER_TICK = float(os.getenv("SYNC_SCHEDULER_TICK", "30"))
+
+# Máximo de buzones encolados por revisión y de jobs pendientes en la cola
+SYNC_SCHEDULER_BATCH = int(os.getenv("SYNC_SCHEDULER_BATCH", "200"))
+SYNC_SCHEDULER_MAX_PENDING = int(os.getenv("SYNC_SCHEDULER_MAX_PENDING", "1000"))
+
+
+def schedule_due_mailboxes(now=None) -> int:
+    """Encola un job por cada buzón cuya próxima sincronización ya venció.
+
+    La próxima sincronización se reprograma con variación aleatoria para que los
+    buzones no coincidan. Si la cola ya tiene SYNC_SCHEDULER_MAX_PENDING jobs no
+    se encola nada. Devuelve la cantidad de buzones encolados.
+    """
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        with claim_lock():
+            pending = (
+                db.query(SyncJob).filter(SyncJob.status == SyncJobStatus.pending).count()
+            )
+            room = min(SYNC_SCHEDULER_BATCH, SYNC_SCHEDULER_MAX_PENDING - pending)
+            if room <= 0:
+                db.rollback()
+                return 0
+
+            query = (
+                db.query(Mailbox)
+                .filter(
+                    Mailbox.enabled.is_(True),
+                    or_(Mailbox.next_sync_at.is_(None), Mailbox.next_sync_at <= now),
+                )
+                .order_by(Mailbox.next_sync_at)
+                .limit(room)
+            )
+            if engine.dialect.name == "postgresql":
+                query = query.with_for_update(skip_locked=True)
+
+            mailboxes = query.all()
+            for mailbox in mailboxes:
+                enqueue_sync_job(db, mailbox.user, imap_host=mailbox.imap_host, commit=False)
+                mailbox.next_sync_at = next_sync_time(now)
+            db.commit()
+    finally:
+        db.close()
+
+    if mailboxes:
+        logger.info(f"Scheduler: {len(mailboxes)} buzones encolados")
+        wake_runner()
+    return len(mailboxes)
+
+
+class SyncScheduler:
+    """Hilo que revisa periódicamente los buzones registrados."""
+
+    def __init__(self, tick=None):
+        self.tick = tick or SYNC_SCHEDULER_TICK
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._loop, name="sync-scheduler", daemon=True
+        )
+        self._thread.start()
+        logger.info("Scheduler de sincronización iniciado")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _loop(self):
+        # Variación en el intervalo para que varias réplicas no revisen a la vez
+        while not self._stop.wait(self.tick * random.uniform(0.8, 1.2)):
+            try:
+                schedule_due_mailboxes()
+            except Exception as e:
+                logger.error(f"Error en scheduler de sincronización: {e}", exc_info=True)
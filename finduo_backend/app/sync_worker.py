@@ -0,0 +1,79 @@
+"""Worker de sincronización de correo independiente de la API.
+
+Uso: python -m app.sync_worker [--concurrency N]
+
+Toma jobs pendientes de la tabla sync_jobs (FOR UPDATE SKIP LOCKED en Postgres,
+lock file en SQLite), así que se pueden levantar varios contenedores en
+paralelo. Con SIGTERM/SIGINT deja de tomar jobs y espera a que terminen los que
+están en curso. Para que la API no ejecute jobs por su cuenta configurar
+SYNC_IN_PROCESS=0. Con SYNC_SCHEDULER_ENABLED=1 además encola sincronizaciones
+periódicas de los buzones registrados. Con --metrics-port expone las métricas
+de las sincronizaciones de este worker en formato Prometheus.
+"""
+import argparse
+import logging
+import os
+import signal
+import threading
+
+from .database import init_db
+from .logging_config import setup_logging
+from .metrics import start_http_server
+from .sync_jobs import SyncJobRunner
+from .sync_scheduler import SYNC_SCHEDULER_ENABLED, SyncScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de sincronización FinDuo")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("SYNC_WORKER_CONCURRENCY", "4")),
+        help="Sincronizaciones simultáneas en este worker",
+    )
+    parser.add_argument(
+        "--shutdown-timeout",
+        type=float,
+        default=float(os.getenv("SYNC_WORKER_SHUTDOWN_TIMEOUT", "60")),
+        help="Segundos a esperar los jobs en curso al detenerse",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("SYNC_WORKER_METRICS_PORT", "0")),
+        help="Puerto HTTP para /metrics (0 = desactivado)",
+    )
+    args = parser.parse_args()
+
+    setup_logging()
+    init_db()
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"Señal {signum} recibida, deteniendo worker...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    runner = SyncJobRunner(concurrency=args.concurrency)
+    runner.start()
+    scheduler = SyncScheduler() if SYNC_SCHEDULER_ENABLED else None
+    if scheduler:
+        scheduler.start()
+
+    while not stop.wait(1):
+        pass
+
+    if scheduler:
+        scheduler.stop()
+    runner.stop(timeout=args.shutdown_timeout)
+
+
+if __name__ == "__main__":
+    main()
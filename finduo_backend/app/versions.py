@@ -0,0 +1,128 @@
+"""Versión de los datos de cada usuario y sala duo, para los ETag de la API.
+
+users.data_version y duo_rooms.data_version solo aumentan. Toda escritura que
+cambia lo que devuelve /transactions o /me las incrementa en la misma
+transacción de base de datos; así el ETag de una respuesta se calcula sin
+consultar las transacciones y un If-None-Match que coincide se responde con
+304 sin consultarlas ni serializarlas.
+
+Cada transacción escrita guarda además la versión nueva de sus dueños
+(Transaction.version y room_version) y cada borrado deja una lápida con ella;
+/transactions/changes devuelve lo que tiene una versión mayor que la del
+cursor. El UPDATE de data_version bloquea la fila del dueño hasta el commit,
+así que las versiones de un dueño se hacen visibles en orden: si un cliente
+vio la versión N, todo lo escrito con versión <= N ya estaba confirmado.
+"""
+import hashlib
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from sqlalchemy import update
+
+from .models import DuoRoom, Transaction, TransactionTombstone, User
+
+
+def bump(db, user_ids=(), room_ids=()):
+    """Incrementa la versión de los usuarios y salas indicados (sin commit).
+
+    Devuelve las versiones nuevas: ({user_id: versión}, {room_id: versión}).
+    """
+    user_ids = sorted(set(user_ids))
+    room_ids = sorted(set(room_ids))
+    user_versions = {}
+    room_versions = {}
+    if user_ids:
+        user_versions = dict(
+            db.execute(
+                update(User)
+                .where(User.id.in_(user_ids))
+                .values(data_version=User.data_version + 1)
+                .returning(User.id, User.data_version)
+                .execution_options(synchronize_session=False)
+            ).all()
+        )
+    if room_ids:
+        room_versions = dict(
+            db.execute(
+                update(DuoRoom)
+                .where(DuoRoom.id.in_(room_ids))
+                .values(data_version=DuoRoom.data_version + 1)
+                .returning(DuoRoom.id, DuoRoom.data_version)
+                .execution_options(synchronize_session=False)
+            ).all()
+        )
+    return user_versions, room_versions
+
+
+def bump_for(db, transactions):
+    """Incrementa la versión de los dueños (usuario y sala) de las transacciones."""
+    transactions = list(transactions)
+    return bump(
+        db,
+        user_ids=[t.user_id for t in transactions],
+        room_ids=[t.duo_room_id for t in transactions if t.duo_room_id is not None],
+    )
+
+
+def touch(db, transactions):
+    """Incrementa la versión de los dueños y la marca en las transacciones (sin commit).
+
+    Los objetos Transaction se marcan en la sesión; las filas (el RETURNING de
+    una importación) se marcan con un UPDATE por id.
+    """
+    transactions = list(transactions)
+    user_versions, room_versions = bump_for(db, transactions)
+    pending = defaultdict(list)
+    for t in transactions:
+        user_version = user_versions[t.user_id]
+        room_version = room_versions.get(t.duo_room_id)
+        if isinstance(t, Transaction):
+            t.version = user_version
+            t.room_version = room_version
+        else:
+            pending[(user_version, room_version)].append(t.id)
+    for (user_version, room_version), ids in pending.items():
+        db.execute(
+            update(Transaction)
+            .where(Transaction.id.in_(ids))
+            .values(version=user_version, room_version=room_version)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def delete(db, transaction):
+    """Borra la transacción y deja su lápida con la versión nueva de los dueños (sin commit)."""
+    user_versions, room_versions = bump_for(db, [transaction])
+    db.add(
+        TransactionTombstone(
+            transaction_id=transaction.id,
+            user_id=transaction.user_id,
+            duo_room_id=transaction.duo_room_id,
+            version=user_versions[transaction.user_id],
+            room_version=room_versions.get(transaction.duo_room_id),
+        )
+    )
+    db.delete(transaction)
+
+
+def etag(*parts, query=None) -> str:
+    """ETag fuerte con las versiones de los datos y, si hay, los parámetros del request.
+
+    query son los query params (una página o un filtro distinto es otra
+    representación y necesita otro ETag).
+    """
+    value = "-".join(str(part) for part in parts)
+    if query:
+        encoded = urlencode(sorted(query)).encode()
+        value += "-" + hashlib.sha256(encoded).hexdigest()[:16]
+    return f'"{value}"'
+
+
+def matches(if_none_match, tag) -> bool:
+    """Si el If-None-Match del request incluye el ETag (comparación débil, RFC 9110)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (c.strip() for c in if_none_match.split(","))
+    return tag in (c[2:] if c.startswith("W/") else c for c in candidates)
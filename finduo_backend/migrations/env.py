@@ -0,0 +1,61 @@
+"""Entorno de Alembic: usa el engine de app.database y los modelos de app.models.
+
+Se ejecuta desde la línea de comandos (alembic upgrade head) o desde
+app.database.init_db(), que pasa su propia conexión en
+config.attributes["connection"].
+"""
+from alembic import context
+from sqlalchemy import text
+
+from app import models  # noqa: F401  (registra los modelos en Base)
+from app.database import Base, engine
+
+config = context.config
+target_metadata = Base.metadata
+
+# Clave del advisory lock de Postgres: si arrancan varios contenedores a la vez
+# solo uno migra y el resto espera
+MIGRATION_LOCK_KEY = 7318001
+
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite no soporta la mayoría de los ALTER TABLE
+        render_as_batch=connection.dialect.name == "sqlite",
+        # Algunas migraciones usan autocommit_block (CREATE INDEX CONCURRENTLY)
+        transaction_per_migration=True,
+    )
+    postgres = connection.dialect.name == "postgresql"
+    if postgres:
+        # Lock de sesión: sobrevive a los commits de cada migración
+        connection.execute(text(f"SELECT pg_advisory_lock({MIGRATION_LOCK_KEY})"))
+        connection.commit()
+    try:
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        if postgres:
+            connection.execute(text(f"SELECT pg_advisory_unlock({MIGRATION_LOCK_KEY})"))
+            connection.commit()
+
+
+def run_migrations_offline():
+    context.configure(
+        url=engine.url.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        literal_binds=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif config.attributes.get("connection") is not None:
+    run_migrations(config.attributes["connection"])
+else:
+    with engine.connect() as connection:
+        run_migrations(connection)
+        connection.commit()
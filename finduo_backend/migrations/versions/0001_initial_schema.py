@@ -0,0 +1,162 @@
+"""Esquema inicial (el que creaba init_db antes de las migraciones)
+
+Las bases creadas por el init_db anterior no tienen tabla alembic_version y
+pueden venir de cualquier versión previa, así que esta migración no falla si
+algo ya existe: crea las tablas que falten y agrega las columnas, índices y
+valores de enum que falten. Las migraciones siguientes ya son normales.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Copia del esquema a esta fecha; no importar app.models, que sigue cambiando
+metadata = sa.MetaData()
+
+sa.Table(
+    "users",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, index=True),
+    sa.Column("email", sa.String, unique=True, index=True),
+    sa.Column("name", sa.String),
+    sa.Column("password_hash", sa.String, nullable=True),
+    sa.Column("created_at", sa.DateTime),
+)
+sa.Table(
+    "duo_rooms",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, index=True),
+    sa.Column("name", sa.String),
+    sa.Column("invite_code", sa.String, unique=True, index=True),
+    sa.Column("created_at", sa.DateTime),
+)
+sa.Table(
+    "duo_memberships",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, index=True),
+    sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+    sa.Column("room_id", sa.Integer, sa.ForeignKey("duo_rooms.id")),
+    sa.Column("role", sa.Enum("owner", "partner", name="duorole")),
+    sa.Column("status", sa.Enum("pending", "active", name="duostatus")),
+)
+sa.Table(
+    "transactions",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, index=True),
+    sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+    sa.Column("duo_room_id", sa.Integer, sa.ForeignKey("duo_rooms.id"), nullable=True),
+    sa.Column("type", sa.String, index=True),
+    sa.Column("description", sa.String),
+    sa.Column("amount", sa.Integer),
+    sa.Column("currency", sa.String),
+    sa.Column("date_time", sa.DateTime),
+    sa.Column("source_message_id", sa.String(255), nullable=True),
+    sa.Index("ix_transactions_user_source", "user_id", "source_message_id", unique=True),
+)
+sa.Table(
+    "email_sync_states",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, index=True),
+    sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+    sa.Column("folder", sa.String, nullable=False),
+    sa.Column("uidvalidity", sa.BigInteger, nullable=False),
+    sa.Column("last_uid", sa.BigInteger, nullable=False),
+    sa.Column("updated_at", sa.DateTime),
+    sa.UniqueConstraint("user_id", "folder", name="uq_email_sync_state_user_folder"),
+)
+sa.Table(
+    "sync_jobs",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, index=True),
+    sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False, index=True),
+    sa.Column(
+        "status",
+        sa.Enum("pending", "running", "paused", "done", "error", name="syncjobstatus"),
+        index=True,
+    ),
+    sa.Column("kind", sa.String, nullable=True),
+    sa.Column("imap_host", sa.String, nullable=True),
+    sa.Column("imported", sa.Integer),
+    sa.Column("skipped", sa.Integer),
+    sa.Column("errors", sa.Integer),
+    sa.Column("error_message", sa.String, nullable=True),
+    sa.Column("metrics", sa.JSON, nullable=True),
+    sa.Column("worker_id", sa.String, nullable=True),
+    sa.Column("lease_expires_at", sa.DateTime, nullable=True),
+    sa.Column("attempts", sa.Integer),
+    sa.Column("created_at", sa.DateTime),
+    sa.Column("started_at", sa.DateTime, nullable=True),
+    sa.Column("finished_at", sa.DateTime, nullable=True),
+)
+sa.Table(
+    "backfill_checkpoints",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, index=True),
+    sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+    sa.Column("folder", sa.String, nullable=False),
+    sa.Column("uidvalidity", sa.BigInteger, nullable=True),
+    sa.Column("last_uid", sa.BigInteger, nullable=False),
+    sa.Column("processed", sa.Integer),
+    sa.Column("total", sa.Integer, nullable=True),
+    sa.Column("finished", sa.Boolean),
+    sa.Column("updated_at", sa.DateTime),
+    sa.UniqueConstraint("user_id", "folder", name="uq_backfill_checkpoint_user_folder"),
+)
+sa.Table(
+    "mailboxes",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, index=True),
+    sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), unique=True, nullable=False),
+    sa.Column("imap_host", sa.String, nullable=False),
+    sa.Column("imap_port", sa.Integer, nullable=False),
+    sa.Column("username", sa.String, nullable=False),
+    sa.Column("password_encrypted", sa.String, nullable=False),
+    sa.Column("enabled", sa.Boolean, nullable=False),
+    sa.Column("next_sync_at", sa.DateTime, nullable=True, index=True),
+    sa.Column("last_synced_at", sa.DateTime, nullable=True),
+    sa.Column("last_error", sa.String, nullable=True),
+    sa.Column("created_at", sa.DateTime),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if op.get_context().as_sql:
+        # alembic upgrade --sql: solo el DDL de una base vacía
+        metadata.create_all(bind=bind, checkfirst=False)
+        return
+    metadata.create_all(bind=bind, checkfirst=True)
+
+    # Columnas agregadas después de crear la tabla (siempre opcionales)
+    inspector = sa.inspect(bind)
+    for table in metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=bind.dialect)
+                op.execute(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+    if bind.dialect.name == "postgresql":
+        # Los enums nativos no reciben solos los valores agregados después
+        # (ADD VALUE no se puede usar en la misma transacción en que se agrega)
+        with op.get_context().autocommit_block():
+            for table in metadata.sorted_tables:
+                for column in table.columns:
+                    if isinstance(column.type, sa.Enum):
+                        for value in column.type.enums:
+                            op.execute(
+                                f"ALTER TYPE {column.type.name} ADD VALUE IF NOT EXISTS '{value}'"
+                            )
+
+
+def downgrade():
+    metadata.drop_all(bind=op.get_bind())
@@ -0,0 +1,39 @@
+"""Índices compuestos para el listado de transacciones y la membresía duo
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_transactions_user_date", "transactions", ["user_id", "date_time DESC", "id DESC"]),
+    ("ix_transactions_room_date", "transactions", ["duo_room_id", "date_time DESC", "id DESC"]),
+    ("ix_duo_memberships_user_status", "duo_memberships", ["user_id", "status"]),
+]
+
+
+def upgrade():
+    # En Postgres se crean con CONCURRENTLY para no bloquear escrituras en
+    # transactions, y eso no puede correr dentro de una transacción
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                [sa.text(column) for column in columns],
+                if_not_exists=True,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,95 @@
+"""Tabla spending_rollups con los totales por período y tipo
+
+Se llena con las transacciones existentes; desde ahí la mantienen las
+escrituras de transacciones (ver app/rollups.py).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def _period_starts(value):
+    day = value.date()
+    return [
+        ("day", day),
+        ("week", day - timedelta(days=day.weekday())),
+        ("month", day.replace(day=1)),
+    ]
+
+
+def upgrade():
+    rollups = op.create_table(
+        "spending_rollups",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("owner_type", sa.String(8), nullable=False),
+        sa.Column("owner_id", sa.Integer, nullable=False),
+        sa.Column("granularity", sa.String(8), nullable=False),
+        sa.Column("period_start", sa.Date, nullable=False),
+        sa.Column("type", sa.String, nullable=False),
+        sa.Column("count", sa.Integer, nullable=False),
+        sa.Column("total", sa.BigInteger, nullable=False),
+        sa.UniqueConstraint(
+            "owner_type",
+            "owner_id",
+            "granularity",
+            "period_start",
+            "type",
+            name="uq_spending_rollup_key",
+        ),
+    )
+    if op.get_context().as_sql:
+        return
+
+    transactions = sa.table(
+        "transactions",
+        sa.column("user_id", sa.Integer),
+        sa.column("duo_room_id", sa.Integer),
+        sa.column("type", sa.String),
+        sa.column("amount", sa.Integer),
+        sa.column("date_time", sa.DateTime),
+    )
+    totals = defaultdict(lambda: [0, 0])
+    result = op.get_bind().execute(
+        sa.select(transactions).where(transactions.c.date_time.isnot(None))
+    )
+    for row in result:
+        owners = [("user", row.user_id)]
+        if row.duo_room_id is not None:
+            owners.append(("room", row.duo_room_id))
+        for owner_type, owner_id in owners:
+            for granularity, start in _period_starts(row.date_time):
+                key = (owner_type, owner_id, granularity, start, row.type or "")
+                totals[key][0] += 1
+                totals[key][1] += row.amount or 0
+
+    rows = [
+        dict(
+            owner_type=owner_type,
+            owner_id=owner_id,
+            granularity=granularity,
+            period_start=start,
+            type=tx_type,
+            count=count,
+            total=total,
+        )
+        for (owner_type, owner_id, granularity, start, tx_type), (count, total) in totals.items()
+    ]
+    for i in range(0, len(rows), BATCH_SIZE):
+        op.bulk_insert(rollups, rows[i : i + BATCH_SIZE])
+
+
+def downgrade():
+    op.drop_table("spending_rollups")
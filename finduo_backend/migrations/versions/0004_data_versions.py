@@ -0,0 +1,27 @@
+"""data_version en users y duo_rooms para los ETag
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ("users", "duo_rooms"):
+        op.add_column(
+            table,
+            sa.Column("data_version", sa.BigInteger, nullable=False, server_default="0"),
+        )
+
+
+def downgrade():
+    for table in ("users", "duo_rooms"):
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("data_version")
@@ -0,0 +1,77 @@
+"""updated_at, versión por fila y lápidas de transacciones para /transactions/changes
+
+Las transacciones existentes quedan con version 0 (y room_version 0 si son de
+una sala), así un cliente sin cursor las recibe todas y uno con cursor no las
+vuelve a recibir.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_transactions_user_version", ["user_id", "version", "id"]),
+    ("ix_transactions_room_version", ["duo_room_id", "room_version", "id"]),
+]
+
+
+def upgrade():
+    op.add_column("transactions", sa.Column("updated_at", sa.DateTime, nullable=True))
+    op.add_column(
+        "transactions",
+        sa.Column("version", sa.BigInteger, nullable=False, server_default="0"),
+    )
+    op.add_column("transactions", sa.Column("room_version", sa.BigInteger, nullable=True))
+    op.execute("UPDATE transactions SET room_version = 0 WHERE duo_room_id IS NOT NULL")
+
+    op.create_table(
+        "transaction_tombstones",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("transaction_id", sa.Integer, nullable=False),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("duo_room_id", sa.Integer, sa.ForeignKey("duo_rooms.id"), nullable=True),
+        sa.Column("version", sa.BigInteger, nullable=False),
+        sa.Column("room_version", sa.BigInteger, nullable=True),
+        sa.Column("deleted_at", sa.DateTime),
+    )
+    op.create_index(
+        "ix_transaction_tombstones_user_version",
+        "transaction_tombstones",
+        ["user_id", "version"],
+    )
+    op.create_index(
+        "ix_transaction_tombstones_room_version",
+        "transaction_tombstones",
+        ["duo_room_id", "room_version"],
+    )
+
+    # Como en 0002: CONCURRENTLY en Postgres, fuera de la transacción
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES:
+            op.create_index(
+                name,
+                "transactions",
+                columns,
+                if_not_exists=True,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _ in INDEXES:
+            op.drop_index(
+                name, table_name="transactions", if_exists=True, postgresql_concurrently=True
+            )
+    op.drop_table("transaction_tombstones")
+    with op.batch_alter_table("transactions") as batch:
+        batch.drop_column("room_version")
+        batch.drop_column("version")
+        batch.drop_column("updated_at")
@@ -0,0 +1,201 @@
+"""Genera correos bancarios sintéticos para benchmarks y pruebas de carga.
+
+Cada correo es un FetchedMessage con encabezados (From, Subject, Date) y el
+texto plano del cuerpo: compras, transferencias y correos que no son
+transacciones (publicidad, avisos largos).
+
+También se pueden escribir como correos completos (RFC 822) en un mbox o un
+Maildir para servirlos con scripts/fake_imap.py:
+
+    python scripts/bank_corpus.py --count 10000 --mbox /tmp/banco.mbox
+"""
+import argparse
+import base64
+import html
+import mailbox
+import os
+import quopri
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.imap_client import FetchedMessage  # noqa: E402
+
+PURCHASE_SENDER = "Banco de Chile <enviodigital@bancochile.cl>"
+TRANSFER_SENDER = "Banco de Chile <serviciodetransferencias@bancochile.cl>"
+
+MERCHANTS = [
+    "SUPERMERCADO LIDER",
+    "FARMACIAS AHUMADA",
+    "COPEC",
+    "UBER TRIP",
+    "STARBUCKS COSTANERA",
+    "MERCADOPAGO*TIENDA",
+]
+
+FILLER = (
+    "Te recordamos que nunca te solicitaremos tus claves por correo. "
+    "Si no reconoces esta operación comunícate con nosotros. "
+)
+
+
+def _amount(rng):
+    return f"{rng.randint(1, 500) * 1000 + rng.randint(0, 999):,}".replace(",", ".")
+
+
+def purchase_message(rng, uid, when):
+    amount = _amount(rng)
+    merchant = rng.choice(MERCHANTS)
+    body = (
+        f"Estimado cliente:\nTe informamos que se ha realizado una compra por ${amount} "
+        f"con cargo a Cuenta ****{rng.randint(1000, 9999)} en {merchant} el "
+        f"{when:%d/%m/%Y %H:%M}.\n{FILLER * 3}"
+    )
+    headers = {
+        "From": PURCHASE_SENDER,
+        "Subject": "Cargo en Cuenta",
+        "Date": f"{when:%a, %d %b %Y %H:%M:%S} -0300",
+    }
+    return FetchedMessage(uid, headers, body)
+
+
+def transfer_message(rng, uid, when):
+    amount = _amount(rng)
+    body = (
+        f"Transferencia a terceros realizada con éxito.\nMonto ${amount}\n"
+        f"Fecha {when:%d/%m/%Y %H:%M}\n{FILLER * 3}"
+    )
+    headers = {
+        "From": TRANSFER_SENDER,
+        "Subject": "Aviso de transferencia de fondos",
+        "Date": f"{when:%a, %d %b %Y %H:%M:%S} -0300",
+    }
+    return FetchedMessage(uid, headers, body)
+
+
+def noise_message(rng, uid, when):
+    # Correos largos sin transacción: el peor caso para los regex con .*?
+    body = "Nuevos beneficios para ti este mes. " + FILLER * rng.randint(20, 60)
+    headers = {
+        "From": PURCHASE_SENDER,
+        "Subject": "Novedades de tu banco",
+        "Date": f"{when:%a, %d %b %Y %H:%M:%S} -0300",
+    }
+    return FetchedMessage(uid, headers, body)
+
+
+def generate(count, seed=0, mix=(0.5, 0.3, 0.2)):
+    """Lista de count correos con la proporción (compras, transferencias, otros)."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, 8, 0)
+    builders = (purchase_message, transfer_message, noise_message)
+    messages = []
+    for uid in range(1, count + 1):
+        when = start + timedelta(minutes=37 * uid)
+        builder = rng.choices(builders, weights=mix)[0]
+        messages.append(builder(rng, uid, when))
+    return messages
+
+
+def _html(body):
+    paragraphs = "".join(
+        f"<p>{html.escape(line)}</p>" for line in body.split("\n") if line.strip()
+    )
+    return (
+        "<html><head><style>p {font-family: Arial; font-size: 12px}</style></head>"
+        f"<body><table><tr><td>{paragraphs}</td></tr></table></body></html>"
+    )
+
+
+def _text_part(subtype, text):
+    return (
+        f"Content-Type: text/{subtype}; charset=utf-8\n"
+        "Content-Transfer-Encoding: quoted-printable\n\n"
+    ).encode() + quopri.encodestring(text.encode("utf-8"))
+
+
+def _multipart(subtype, boundary, parts):
+    body = b"".join(b"\n--" + boundary.encode() + b"\n" + part for part in parts)
+    return (
+        f'Content-Type: multipart/{subtype}; boundary="{boundary}"\n\n'
+    ).encode() + body + f"\n--{boundary}--\n".encode()
+
+
+def to_rfc822(message, seed=0, rng=None):
+    """Arma el correo completo (bytes RFC 822) de un FetchedMessage de generate().
+
+    Como los correos reales del banco, algunos traen solo HTML, otros texto y
+    HTML (multipart/alternative) y unos pocos un PDF adjunto. Se arma a mano
+    porque el paquete email tarda milisegundos por correo.
+    """
+    rng = rng or random.Random(f"{seed}-{message.uid}")
+    headers = "".join(
+        f"{name}: {message.headers[name]}\n" for name in ("From", "Subject", "Date")
+    )
+    headers += (
+        "To: cliente@example.com\n"
+        f"Message-ID: <{seed}.{message.uid}@corpus.bancochile.cl>\n"
+        "MIME-Version: 1.0\n"
+    )
+
+    style = rng.random()
+    if style < 0.4:
+        content = _text_part("plain", message.body)
+    elif style < 0.7:
+        content = _multipart(
+            "alternative",
+            f"alt-{message.uid}",
+            [_text_part("plain", message.body), _text_part("html", _html(message.body))],
+        )
+    else:
+        content = _text_part("html", _html(message.body))
+    if rng.random() < 0.05:
+        attachment = (
+            b"Content-Type: application/pdf; name=comprobante.pdf\n"
+            b"Content-Disposition: attachment; filename=comprobante.pdf\n"
+            b"Content-Transfer-Encoding: base64\n\n"
+        ) + base64.encodebytes(rng.randbytes(rng.randint(20, 200) * 1024))
+        content = _multipart("mixed", f"mix-{message.uid}", [content, attachment])
+    return headers.encode() + content
+
+
+def write_mbox(path, messages, seed=0):
+    box = mailbox.mbox(path)
+    box.lock()
+    try:
+        for message in messages:
+            box.add(to_rfc822(message, seed))
+        box.flush()
+    finally:
+        box.unlock()
+        box.close()
+
+
+def write_maildir(path, messages, seed=0):
+    box = mailbox.Maildir(path, create=True)
+    for message in messages:
+        box.add(to_rfc822(message, seed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Corpus sintético de correos del banco")
+    parser.add_argument("--count", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mbox", help="Escribe los correos en este archivo mbox")
+    parser.add_argument("--maildir", help="Escribe los correos en este Maildir")
+    args = parser.parse_args()
+
+    messages = generate(args.count, args.seed)
+    if args.mbox:
+        write_mbox(args.mbox, messages, args.seed)
+    if args.maildir:
+        write_maildir(args.maildir, messages, args.seed)
+    if not (args.mbox or args.maildir):
+        for message in messages:
+            print(message.headers["Subject"], "|", message.body[:120].replace("\n", " "))
+
+
+if __name__ == "__main__":
+    main()
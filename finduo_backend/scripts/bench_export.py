@@ -0,0 +1,113 @@
+"""Memoria y velocidad de GET /transactions/export según el tamaño del historial.
+
+Uso: python scripts/bench_export.py [--rows 10000 100000 300000]
+
+Crea una base SQLite temporal con un usuario y N transacciones y consume
+app.main.export_chunks (lo que envía la StreamingResponse) en CSV y NDJSON.
+Mide con tracemalloc el pico de memoria de Python durante el export y lo
+compara con armar la misma respuesta completa en memoria, como haría un
+export sobre /transactions. El pico del export debe quedar constante al
+crecer N.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def _populate(db, count):
+    from sqlalchemy import delete, insert
+
+    from app.models import Transaction, User
+
+    db.execute(delete(Transaction))
+    user = db.query(User).first()
+    if user is None:
+        user = User(email="bench@finduo.cl", name="Bench")
+        db.add(user)
+        db.flush()
+    start = datetime(2015, 1, 1)
+    for offset in range(0, count, 50000):
+        db.execute(
+            insert(Transaction),
+            [
+                {
+                    "user_id": user.id,
+                    "type": ("purchase", "transfer_out", "transfer_in")[i % 3],
+                    "description": f"Compra en comercio {i % 500}",
+                    "amount": 1000 + i % 90000,
+                    "currency": "CLP",
+                    "date_time": start + timedelta(minutes=7 * i),
+                }
+                for i in range(offset, min(offset + 50000, count))
+            ],
+        )
+    db.commit()
+    return user.id
+
+
+def _measure(produce):
+    """(MB de pico, segundos, bytes generados) de consumir produce()."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    size = produce()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6, elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria del export de transacciones")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 300000])
+    args = parser.parse_args()
+
+    # DATABASE_URL se lee al importar app, así que va antes de importarla
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="finduo-export-"), "bench.db"
+    )
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.database import SessionLocal, init_db
+    from app.main import TRANSACTION_FIELDS, export_chunks, transactions_query
+    from app.responses import json_response
+
+    def streamed(export_format, user_id):
+        return lambda: sum(len(chunk) for chunk in export_chunks(export_format, user_id=user_id))
+
+    def in_memory(user_id):
+        def produce():
+            db = SessionLocal()
+            try:
+                rows = db.execute(transactions_query(user_id=user_id)).all()
+                return len(json_response([dict(zip(TRANSACTION_FIELDS, row)) for row in rows]).body)
+            finally:
+                db.close()
+
+        return produce
+
+    init_db()
+    print(f"{'filas':>7} {'variante':<10} {'pico MB':>8} {'filas/s':>10} {'MB salida':>10}")
+    for count in args.rows:
+        db = SessionLocal()
+        try:
+            user_id = _populate(db, count)
+        finally:
+            db.close()
+        for name, produce in (
+            ("csv", streamed("csv", user_id)),
+            ("ndjson", streamed("ndjson", user_id)),
+            ("en memoria", in_memory(user_id)),
+        ):
+            peak, elapsed, size = _measure(produce)
+            print(
+                f"{count:>7} {name:<10} {peak:>8.1f} {count / elapsed:>10.0f} {size / 1e6:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Compara el logging anterior con app.logging_config durante una sincronización.
+
+Uso: python scripts/bench_logging.py [--count 5000] [--seed 0] [--requests 2000]
+
+Genera un corpus con scripts/bank_corpus.py y lo sirve con scripts/fake_imap.py.
+Luego corre cada configuración en un proceso aparte, con stdout y stderr
+redirigidos a archivos como los recoge la plataforma:
+
+- legacy: lo que hacía email_sync al importarse (basicConfig en DEBUG con un
+  handler a stdout y otro a stderr, escribiendo en el hilo que loguea).
+- queue: setup_logging() con sus valores por defecto (INFO, JSON, un handler
+  en el hilo del QueueListener).
+
+Mide la duración de sync_emails_to_db, la latencia desde un TestClient de la
+API de un request que escribe una línea de log y cuánto tarda cada llamada a
+logger.info en el hilo que la hace.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, ".."))
+sys.path.insert(0, SCRIPTS_DIR)
+
+import bank_corpus  # noqa: E402
+import fake_imap  # noqa: E402
+
+BENCH_EMAIL = "bench@finduo.cl"
+MODES = ("legacy", "queue")
+LOG_CALLS = 20000
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _configure(mode):
+    import logging
+
+    from app.logging_config import setup_logging, stop_logging
+
+    if mode == "legacy":
+        stop_logging()
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+            handlers=[logging.StreamHandler(sys.stdout), logging.StreamHandler(sys.stderr)],
+            force=True,
+        )
+    else:
+        setup_logging()
+
+
+def child(mode, requests, result_path):
+    """Corre en un proceso nuevo con IMAP_* y DATABASE_URL ya configurados."""
+    import logging
+
+    from fastapi.testclient import TestClient
+
+    from app.database import SessionLocal, init_db
+    from app.email_sync import sync_emails_to_db
+    from app.main import app
+    from app.models import User
+
+    _configure(mode)
+    init_db()
+    db = SessionLocal()
+    user = User(email=BENCH_EMAIL, name="Benchmark")
+    db.add(user)
+    db.commit()
+
+    start = time.perf_counter()
+    sync_emails_to_db(BENCH_EMAIL, locations=["INBOX"])
+    sync_seconds = time.perf_counter() - start
+    db.close()
+
+    # Un request que escribe una línea de log, como los que encolan jobs
+    request_logger = logging.getLogger("app.main")
+
+    @app.get("/_bench/log")
+    def bench_log():
+        request_logger.info("Request de benchmark")
+        return {"status": "ok"}
+
+    client = TestClient(app)
+    client.get("/_bench/log")
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get("/_bench/log")
+        latencies.append(time.perf_counter() - start)
+
+    # Lo que paga el hilo que loguea por cada llamada
+    per_call = []
+    for i in range(LOG_CALLS):
+        start = time.perf_counter()
+        request_logger.info("Correo %s: No se pudo parsear (no coincide con patrones)", i)
+        per_call.append(time.perf_counter() - start)
+
+    with open(result_path, "w") as f:
+        json.dump({"sync": sync_seconds, "latencies": latencies, "per_call": per_call}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la configuración de logging")
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.requests, args.result)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="finduo-bench-logging-")
+    path = os.path.join(workdir, "corpus.mbox")
+    bank_corpus.write_mbox(path, bank_corpus.generate(args.count, args.seed), args.seed)
+
+    context = multiprocessing.get_context("spawn")
+    ready, stop = context.Queue(), context.Event()
+    process = context.Process(
+        target=fake_imap.serve,
+        args=({"INBOX": path},),
+        kwargs={"ready": ready, "stop": stop},
+        daemon=True,
+    )
+    process.start()
+    port = ready.get(timeout=600)
+
+    print(f"{args.count} correos")
+    try:
+        for mode in MODES:
+            env = dict(
+                os.environ,
+                IMAP_HOST="127.0.0.1",
+                IMAP_PORT=str(port),
+                IMAP_SECURITY="none",
+                EMAIL_USER=BENCH_EMAIL,
+                EMAIL_PASSWORD="bench",
+                EMAIL_INITIAL_SYNC_LIMIT=str(args.count),
+                DATABASE_URL=f"sqlite:///{os.path.join(workdir, mode + '.db')}",
+                SYNC_IN_PROCESS="0",
+            )
+            result_path = os.path.join(workdir, mode + ".json")
+            log_path = os.path.join(workdir, mode + ".log")
+            with open(log_path, "wb") as log:
+                subprocess.run(
+                    [sys.executable, __file__, "--child", mode,
+                     "--requests", str(args.requests), "--result", result_path],
+                    env=env, stdout=log, stderr=log, check=True,
+                )
+            with open(result_path) as f:
+                result = json.load(f)
+            latencies = result["latencies"]
+            print(
+                f"  {mode:<7} sync {result['sync']:7.3f}s"
+                f"  request p50 {_percentile(latencies, 0.5) * 1000:5.2f}ms"
+                f"  p95 {_percentile(latencies, 0.95) * 1000:5.2f}ms"
+                f"  logger.info p50 {_percentile(result['per_call'], 0.5) * 1e6:5.1f}µs"
+                f"  log {os.path.getsize(log_path) / 1e6:5.1f}MB"
+            )
+    finally:
+        stop.set()
+        process.join(5)
+
+
+if __name__ == "__main__":
+    main()
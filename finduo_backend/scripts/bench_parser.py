@@ -0,0 +1,213 @@
+"""Compara el parser de correos bancarios anterior con app.bank_parser.
+
+Uso: python scripts/bench_parser.py [--count 10000] [--seed 0]
+
+El parser anterior (compilaba los regex en cada llamada y probaba todas las
+plantillas de compra y luego las de transferencia) se copia aquí sin los logs
+como línea base.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import bank_parser  # noqa: E402
+from bank_corpus import generate  # noqa: E402
+
+
+def legacy_parse_purchase(body: str):
+    patterns = [
+        re.compile(
+            r"compra por \$([\d\.]+)\s+con cargo a Cuenta \*+(\d+)\s+en (.+?) el (\d{2}/\d{2}/\d{4}) (\d{2}:\d{2})",
+            re.IGNORECASE | re.DOTALL,
+        ),
+        re.compile(
+            r"compra por \$([\d\.]+)\s+con cargo a Cuenta\s+(\d+)\s+en (.+?) el (\d{2}/\d{2}/\d{4}) (\d{2}:\d{2})",
+            re.IGNORECASE | re.DOTALL,
+        ),
+        re.compile(
+            r"cargo.*?cuenta.*?\$([\d\.]+).*?en (.+?)(?: el| fecha|,)\s*(\d{2}/\d{2}/\d{4})(?:\s+(\d{2}:\d{2}))?",
+            re.IGNORECASE | re.DOTALL,
+        ),
+        re.compile(
+            r"(?:cargo|compra).*?\$([\d\.]+).*?(?:en|en|de)\s+(.+?)(?:\s+el|\s+fecha|,)\s*(\d{2}/\d{2}/\d{4})(?:\s+(\d{2}:\d{2}))?",
+            re.IGNORECASE | re.DOTALL,
+        ),
+        re.compile(
+            r"compra.*?\$([\d\.]+).*?en (.+?) el (\d{2}/\d{2}/\d{4}) (\d{2}:\d{2})",
+            re.IGNORECASE | re.DOTALL,
+        ),
+        re.compile(
+            r"\$([\d\.]+).*?(?:cargo|compra|pago).*?(\d{2}/\d{2}/\d{4})(?:\s+(\d{2}:\d{2}))?",
+            re.IGNORECASE | re.DOTALL,
+        ),
+    ]
+
+    for pattern in patterns:
+        m = pattern.search(body)
+        if m:
+            try:
+                groups = m.groups()
+                if len(groups) >= 3:
+                    amount = int(groups[0].replace(".", "").replace(",", "").strip())
+                    if len(groups) >= 4:
+                        merchant = groups[1].strip()
+                        date_str = groups[2]
+                        time_str = (
+                            groups[3] if len(groups) > 3 and groups[3] else "00:00"
+                        )
+                    elif len(groups) == 3:
+                        merchant = "Compra"
+                        date_str = groups[1] if "/" in groups[1] else groups[2]
+                        time_str = groups[2] if ":" in str(groups[2]) else "00:00"
+                    else:
+                        continue
+                    merchant = merchant[:100].strip() if merchant else "Compra"
+                    if time_str and ":" in str(time_str):
+                        dt = datetime.strptime(
+                            f"{date_str} {time_str}", "%d/%m/%Y %H:%M"
+                        )
+                    else:
+                        dt = datetime.strptime(f"{date_str}", "%d/%m/%Y")
+                    return dict(
+                        type="purchase", amount=amount, description=merchant, date_time=dt
+                    )
+            except (ValueError, IndexError, AttributeError):
+                continue
+
+    return None
+
+
+def legacy_parse_transfer(body: str):
+    patterns = [
+        re.compile(r"monto\s+\$([\d\.]+)", re.IGNORECASE),
+        re.compile(
+            r"transferencia.*?a\s+terceros.*?\$([\d\.]+)", re.IGNORECASE | re.DOTALL
+        ),
+        re.compile(r"transferencia.*?\$([\d\.]+)", re.IGNORECASE | re.DOTALL),
+        re.compile(r"\$([\d\.]+).*?transferencia", re.IGNORECASE | re.DOTALL),
+        re.compile(r"monto.*?(\d+[\.\d]*)", re.IGNORECASE),
+    ]
+
+    amount = None
+    for pattern in patterns:
+        m = pattern.search(body)
+        if m:
+            try:
+                amount = int(m.group(1).replace(".", "").replace(",", "").strip())
+                break
+            except (ValueError, IndexError):
+                continue
+
+    if not amount:
+        return None
+
+    date_patterns = [
+        re.compile(r"(\d{2}/\d{2}/\d{4})\s+(\d{2}:\d{2})", re.IGNORECASE),
+        re.compile(r"(\d{2}-\d{2}-\d{4})\s+(\d{2}:\d{2})", re.IGNORECASE),
+    ]
+
+    dt = datetime.utcnow()
+    for pattern in date_patterns:
+        m = pattern.search(body)
+        if m:
+            try:
+                date_str, time_str = m.groups()
+                if "/" in date_str:
+                    dt = datetime.strptime(f"{date_str} {time_str}", "%d/%m/%Y %H:%M")
+                else:
+                    dt = datetime.strptime(f"{date_str} {time_str}", "%d-%m-%Y %H:%M")
+                break
+            except ValueError:
+                continue
+
+    return dict(
+        type="transfer_out",
+        amount=amount,
+        description="Transferencia a terceros",
+        date_time=dt,
+    )
+
+
+def legacy_parse(message):
+    # Mismo orden que import_messages antes del motor: compra y luego transferencia
+    return legacy_parse_purchase(message.body) or legacy_parse_transfer(message.body)
+
+
+def engine_parse(message):
+    parsed = bank_parser.parse(message)
+    return parsed._asdict() if parsed else None
+
+
+def fake_banks(count):
+    specs = []
+    for i in range(count):
+        specs.append(
+            {
+                "name": f"banco{i}_compra",
+                "bank": f"Banco {i}",
+                "kind": bank_parser.PURCHASE,
+                "senders": [f"avisos@banco{i}.cl"],
+                "subject": f"compra banco{i}",
+                "keywords": [f"banco{i}", f"tarjeta{i}"],
+                "required": ["$"],
+                "patterns": [
+                    rf"tarjeta{i}.*?\$(?P<amount>[\d\.]+).*?en (?P<merchant>.+?) el (?P<date>\d{{2}}/\d{{2}}/\d{{4}})"
+                ],
+                "description": "Compra",
+            }
+        )
+    return specs
+
+
+def run(name, parse, messages):
+    start = time.perf_counter()
+    results = [parse(message) for message in messages]
+    elapsed = time.perf_counter() - start
+    parsed = sum(1 for r in results if r)
+    print(
+        f"{name:8s} {len(messages)} correos en {elapsed:.2f}s "
+        f"({len(messages) / elapsed:,.0f} correos/s, {parsed} transacciones)"
+    )
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--extra-banks",
+        type=int,
+        default=0,
+        help="Registra N bancos ficticios para medir el costo de agregar plantillas",
+    )
+    args = parser.parse_args()
+    if args.extra_banks:
+        bank_parser.register_templates(fake_banks(args.extra_banks))
+
+    messages = generate(args.count, seed=args.seed)
+    legacy, legacy_time = run("anterior", legacy_parse, messages)
+    engine, engine_time = run("motor", engine_parse, messages)
+    print(f"aceleración: {legacy_time / engine_time:.1f}x")
+
+    # El monto y el tipo deben coincidir; la descripción puede mejorar porque la
+    # primera plantilla de compra ahora toma el comercio y no el número de cuenta
+    mismatches = [
+        message.uid
+        for message, old, new in zip(messages, legacy, engine)
+        if (old and (old["type"], old["amount"])) != (new and (new["type"], new["amount"]))
+    ]
+    print(f"diferencias de tipo/monto: {len(mismatches)}")
+    if mismatches:
+        print(f"  UIDs: {mismatches[:20]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
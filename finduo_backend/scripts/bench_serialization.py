@@ -0,0 +1,167 @@
+"""Costo por fila del listado de transacciones: antes y después de orjson.
+
+Uso: python scripts/bench_serialization.py [--rows 10000 100000] [--repeat 3]
+
+Crea una base SQLite temporal con un usuario y N transacciones y mide, por
+fila, cada etapa de GET /transactions sin HTTP:
+
+- legacy: objetos Transaction completos, dict armado con isoformat() y lo que
+  hacía FastAPI con el dict devuelto (jsonable_encoder + json.dumps).
+- tuples: transactions_query (solo las columnas del listado, como tuplas),
+  dict con zip y app.responses.json_response (orjson).
+
+De cada etapa se toma la mejor de --repeat corridas. Al final compara que las
+dos variantes produzcan el mismo JSON.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+STAGES = ("query", "dicts", "json")
+
+
+def _populate(db, count):
+    from sqlalchemy import delete, insert
+
+    from app.models import Transaction, User
+
+    db.execute(delete(Transaction))
+    user = db.query(User).first()
+    if user is None:
+        user = User(email="bench@finduo.cl", name="Bench")
+        db.add(user)
+        db.flush()
+    start = datetime(2020, 1, 1)
+    db.execute(
+        insert(Transaction),
+        [
+            {
+                "user_id": user.id,
+                "type": ("purchase", "transfer_out", "transfer_in")[i % 3],
+                "description": f"Compra en comercio {i % 500}",
+                "amount": 1000 + i % 90000,
+                "currency": "CLP",
+                "date_time": start + timedelta(minutes=7 * i),
+            }
+            for i in range(count)
+        ],
+    )
+    db.commit()
+    return user.id
+
+
+def _legacy(db, user_id):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from app.models import Transaction
+
+    times = {}
+    t0 = time.perf_counter()
+    txs = (
+        db.query(Transaction)
+        .filter(Transaction.user_id == user_id)
+        .order_by(Transaction.date_time.desc(), Transaction.id.desc())
+        .all()
+    )
+    t1 = time.perf_counter()
+    result = [
+        {
+            "id": t.id,
+            "type": t.type,
+            "description": t.description,
+            "amount": t.amount,
+            "currency": t.currency,
+            "date_time": t.date_time.isoformat(),
+        }
+        for t in txs
+    ]
+    t2 = time.perf_counter()
+    body = JSONResponse(jsonable_encoder(result)).body
+    t3 = time.perf_counter()
+    times["query"], times["dicts"], times["json"] = t1 - t0, t2 - t1, t3 - t2
+    return times, body
+
+
+def _tuples(db, user_id):
+    from app.main import TRANSACTION_FIELDS, transactions_query
+    from app.responses import json_response
+
+    times = {}
+    t0 = time.perf_counter()
+    rows = db.execute(transactions_query(user_id=user_id)).all()
+    t1 = time.perf_counter()
+    result = [dict(zip(TRANSACTION_FIELDS, row)) for row in rows]
+    t2 = time.perf_counter()
+    body = json_response(result).body
+    t3 = time.perf_counter()
+    times["query"], times["dicts"], times["json"] = t1 - t0, t2 - t1, t3 - t2
+    return times, body
+
+
+def _run(variant, user_id, repeat):
+    from app.database import SessionLocal
+
+    best = {stage: float("inf") for stage in STAGES}
+    body = None
+    for _ in range(repeat):
+        # Sesión nueva en cada corrida: el identity map empieza vacío, como en un request
+        db = SessionLocal()
+        try:
+            times, body = variant(db, user_id)
+        finally:
+            db.close()
+        for stage in STAGES:
+            best[stage] = min(best[stage], times[stage])
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Costo por fila de GET /transactions")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # DATABASE_URL se lee al importar app, así que va antes de importarla
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="finduo-serialization-"), "bench.db"
+    )
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.database import SessionLocal, init_db
+
+    init_db()
+    print(f"{'filas':>7} {'variante':<8} " + " ".join(f"{s + ' µs':>10}" for s in STAGES) + f" {'total µs':>10}")
+    for count in args.rows:
+        db = SessionLocal()
+        try:
+            user_id = _populate(db, count)
+        finally:
+            db.close()
+        totals = {}
+        bodies = {}
+        for name, variant in (("legacy", _legacy), ("tuples", _tuples)):
+            best, bodies[name] = _run(variant, user_id, args.repeat)
+            per_row = {stage: best[stage] / count * 1e6 for stage in STAGES}
+            totals[name] = sum(per_row.values())
+            print(
+                f"{count:>7} {name:<8} "
+                + " ".join(f"{per_row[stage]:>10.2f}" for stage in STAGES)
+                + f" {totals[name]:>10.2f}"
+            )
+        same = json.loads(bodies["legacy"]) == json.loads(bodies["tuples"])
+        print(
+            f"{count:>7} {'':<8} {totals['legacy'] / totals['tuples']:.1f}x más rápido; "
+            f"mismo JSON: {'sí' if same else 'NO'}"
+        )
+        if not same:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
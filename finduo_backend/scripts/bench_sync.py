@@ -0,0 +1,214 @@
+"""Benchmark de la sincronización completa contra un servidor IMAP local.
+
+Uso: python scripts/bench_sync.py [--count 10000] [--seed 0] [--mbox PATH]
+         [--mode stages,sync,backfill] [--workers N] [--in-process]
+
+Genera un corpus con scripts/bank_corpus.py (o usa --mbox), lo sirve con
+scripts/fake_imap.py en otro proceso (con --in-process en un hilo de este) y
+apunta la API a él con IMAP_HOST/IMAP_PORT/IMAP_SECURITY=none y una base SQLite
+temporal (o DATABASE_URL). Luego mide:
+
+- stages: cada etapa por separado (UID SEARCH, UID FETCH, decodificación y
+  parseo, inserción con commit), con latencia por lote p50/p95/máx.
+- sync: sync_emails_to_db de punta a punta (el pipeline de /sync-email).
+- backfill: app.backfill.backfill_user sin límite de velocidad.
+
+Entre modos se borran las transacciones y el estado de sincronización.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, ".."))
+sys.path.insert(0, SCRIPTS_DIR)
+
+import bank_corpus  # noqa: E402
+import fake_imap  # noqa: E402
+
+BENCH_EMAIL = "bench@finduo.cl"
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _report(name, latencies, messages):
+    total = sum(latencies)
+    print(
+        f"  {name:<14} {total:8.3f}s {messages / total if total else 0:10.0f} msgs/s"
+        f"  lote p50 {_percentile(latencies, 0.5) * 1000:7.1f}ms"
+        f"  p95 {_percentile(latencies, 0.95) * 1000:7.1f}ms"
+        f"  máx {max(latencies, default=0) * 1000:7.1f}ms"
+    )
+
+
+def _timed(iterator):
+    """Itera midiendo cuánto tarda cada next()."""
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield item, time.perf_counter() - start
+
+
+def _reset(db, user):
+    from app.models import EmailSyncState, Transaction
+
+    db.query(Transaction).filter(Transaction.user_id == user.id).delete()
+    db.query(EmailSyncState).filter(EmailSyncState.user_id == user.id).delete()
+    db.commit()
+
+
+def bench_stages(db, user):
+    from app.email_sync import BANK_SENDERS, _decode_and_parse, import_parsed, open_imap_session
+    from app.imap_client import FETCH_CHUNK_SIZE
+    from app.mailboxes import get_credentials
+    from app.pipeline import batched
+
+    with open_imap_session(get_credentials(db, user)) as session:
+        start = time.perf_counter()
+        session.select(session.resolve_folder("INBOX"))
+        uids = session.search_from(BANK_SENDERS)
+        search = time.perf_counter() - start
+
+        fetch, parse, insert = [], [], []
+        totals = dict(imported=0, skipped=0, errors=0)
+        batches = batched(session.fetch_raw(uids), FETCH_CHUNK_SIZE)
+        for raws, seconds in _timed(batches):
+            fetch.append(seconds)
+            start = time.perf_counter()
+            _, results = _decode_and_parse(raws)
+            parse.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            result = import_parsed(db, user, results)
+            db.commit()
+            insert.append(time.perf_counter() - start)
+            for key, value in result.items():
+                totals[key] += value
+
+    print(f"stages: {len(uids)} correos, {totals['imported']} transacciones")
+    _report("search", [search], len(uids))
+    _report("fetch", fetch, len(uids))
+    _report("decode+parse", parse, len(uids))
+    _report("insert", insert, len(uids))
+
+
+def bench_sync(count):
+    from app.email_sync import sync_emails_to_db
+
+    start = time.perf_counter()
+    result = sync_emails_to_db(BENCH_EMAIL, locations=["INBOX"])
+    elapsed = time.perf_counter() - start
+    print(
+        f"sync: {elapsed:.3f}s {count / elapsed:.0f} msgs/s "
+        f"({result['imported']} importadas, {result['errors']} errores)"
+    )
+
+
+def bench_backfill(count, workers):
+    from app.backfill import backfill_user
+
+    result = backfill_user(BENCH_EMAIL, ["INBOX"], workers=workers, max_rate=0)
+    print(
+        f"backfill: {result['seconds']:.3f}s {count / result['seconds']:.0f} msgs/s "
+        f"({result['imported']} importadas, {result['errors']} errores)"
+    )
+    for stage, values in result["stages"].items():
+        if values["messages"]:
+            print(f"  {stage:<14} {values['seconds']:8.3f}s {values['per_second'] or 0:10.0f} msgs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de sincronización IMAP")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mbox", help="mbox o Maildir existente en lugar de generar uno")
+    parser.add_argument("--mode", default="stages,sync,backfill")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos del backfill")
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Servidor IMAP en un hilo de este proceso (compite por el GIL)",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="finduo-bench-")
+    path = args.mbox
+    if path is None:
+        path = os.path.join(workdir, "corpus.mbox")
+        start = time.perf_counter()
+        bank_corpus.write_mbox(path, bank_corpus.generate(args.count, args.seed), args.seed)
+        print(f"corpus: {args.count} correos en {time.perf_counter() - start:.1f}s ({path})")
+
+    if args.in_process:
+        messages = fake_imap.load_messages(path)
+        server = fake_imap.FakeImapServer({"INBOX": messages}).start()
+        port, stop, process = server.port, None, None
+    else:
+        context = multiprocessing.get_context("spawn")
+        ready, stop = context.Queue(), context.Event()
+        process = context.Process(
+            target=fake_imap.serve,
+            args=({"INBOX": path},),
+            kwargs={"ready": ready, "stop": stop},
+            daemon=True,
+        )
+        process.start()
+        port = ready.get(timeout=600)
+    count = len(fake_imap.load_messages(path)) if args.mbox else args.count
+
+    # La configuración se lee al importar app, así que va antes de importarla
+    os.environ.update(
+        IMAP_HOST="127.0.0.1",
+        IMAP_PORT=str(port),
+        IMAP_SECURITY="none",
+        EMAIL_USER=BENCH_EMAIL,
+        EMAIL_PASSWORD="bench",
+        EMAIL_INITIAL_SYNC_LIMIT=str(count),
+    )
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    import logging
+
+    from app.database import SessionLocal, init_db
+    from app.models import User
+
+    logging.disable(logging.WARNING)
+    init_db()
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == BENCH_EMAIL).first()
+        if user is None:
+            user = User(email=BENCH_EMAIL, name="Benchmark")
+            db.add(user)
+            db.commit()
+        modes = args.mode.split(",")
+        for mode in modes:
+            _reset(db, user)
+            if mode == "stages":
+                bench_stages(db, user)
+            elif mode == "sync":
+                bench_sync(count)
+            elif mode == "backfill":
+                bench_backfill(count, args.workers)
+            else:
+                print(f"modo desconocido: {mode}")
+    finally:
+        db.close()
+        if process is not None:
+            stop.set()
+            process.join(5)
+        else:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Verifica que las consultas frecuentes de la API usen los índices compuestos.
+
+Uso: python scripts/check_query_plans.py [--database-url URL] [--users 300] [--per-user 200]
+
+Crea el esquema con las migraciones en una base de prueba (SQLite temporal por
+defecto; para Postgres pasar --database-url de una base vacía, no la de
+producción), la llena con datos sintéticos, ejecuta ANALYZE y revisa el plan
+de cada consulta con EXPLAIN QUERY PLAN (SQLite) o EXPLAIN (Postgres). Falla
+con código 1 si una consulta no usa el índice esperado o si necesita ordenar
+aparte en lugar de leer el índice en orden.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+PAGE_SIZE = 50
+
+
+def _explain_construct():
+    from sqlalchemy.ext.compiler import compiles
+    from sqlalchemy.sql.expression import ClauseElement, Executable
+
+    class Explain(Executable, ClauseElement):
+        inherit_cache = False
+
+        def __init__(self, statement):
+            self.statement = statement
+
+    @compiles(Explain)
+    def _compile(element, compiler, **kw):
+        prefix = "EXPLAIN QUERY PLAN " if compiler.dialect.name == "sqlite" else "EXPLAIN "
+        return prefix + compiler.process(element.statement, **kw)
+
+    return Explain
+
+
+def _populate(db, users, per_user, seed):
+    from sqlalchemy import insert
+
+    from app.models import DuoMembership, DuoRoom, DuoStatus, Transaction, User
+
+    rng = random.Random(seed)
+    db.execute(insert(User), [{"email": f"plan{i}@finduo.cl", "name": f"U{i}"} for i in range(users)])
+    user_ids = [u.id for u in db.query(User.id)]
+    db.execute(insert(DuoRoom), [{"invite_code": f"PLAN{i}"} for i in range(users // 2)])
+    room_ids = [r.id for r in db.query(DuoRoom.id)]
+    db.execute(
+        insert(DuoMembership),
+        [
+            {
+                "user_id": user_id,
+                "room_id": room_ids[i // 2 % len(room_ids)],
+                "status": DuoStatus.active if i % 3 else DuoStatus.pending,
+            }
+            for i, user_id in enumerate(user_ids)
+        ],
+    )
+    start = datetime(2020, 1, 1)
+    rows = []
+    for i, user_id in enumerate(user_ids):
+        for _ in range(per_user):
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "duo_room_id": room_ids[i // 2 % len(room_ids)] if i % 4 else None,
+                    "type": rng.choice(["purchase", "transfer_out", "transfer_in"]),
+                    "description": "plan",
+                    "amount": rng.randint(1000, 100000),
+                    "currency": "CLP",
+                    # Minutos enteros: hay fechas repetidas, como con los correos
+                    "date_time": start + timedelta(minutes=rng.randint(0, 5 * 365 * 24 * 60)),
+                }
+            )
+    db.execute(insert(Transaction), rows)
+    db.commit()
+    return user_ids[len(user_ids) // 2], room_ids[len(room_ids) // 2]
+
+
+def _queries(db, user_id, room_id):
+    from sqlalchemy import select
+
+    from app.main import active_duo_room_query, transactions_query
+    from app.models import Transaction
+
+    first = db.execute(transactions_query(user_id=user_id)).first()
+    after = (first.date_time, first.id)
+    month = dict(date_from=datetime(2022, 3, 1), date_to=datetime(2022, 4, 1))
+    # (nombre, consulta, índice esperado, ¿debe salir ordenada del índice?)
+    return [
+        ("listado individual", transactions_query(user_id=user_id).limit(PAGE_SIZE + 1),
+         "ix_transactions_user_date", True),
+        ("listado individual con cursor",
+         transactions_query(user_id=user_id, after=after).limit(PAGE_SIZE + 1),
+         "ix_transactions_user_date", True),
+        ("listado individual de un mes",
+         transactions_query(user_id=user_id, **month).limit(PAGE_SIZE + 1),
+         "ix_transactions_user_date", True),
+        ("listado individual por tipo",
+         transactions_query(user_id=user_id, types=["purchase"]).limit(PAGE_SIZE + 1),
+         "ix_transactions_user_date", True),
+        ("listado duo", transactions_query(room_id=room_id).limit(PAGE_SIZE + 1),
+         "ix_transactions_room_date", True),
+        ("listado duo con cursor",
+         transactions_query(room_id=room_id, after=after).limit(PAGE_SIZE + 1),
+         "ix_transactions_room_date", True),
+        ("cambios individuales",
+         select(Transaction).where(Transaction.user_id == user_id, Transaction.version > 0)
+         .order_by(Transaction.version, Transaction.id).limit(PAGE_SIZE + 1),
+         "ix_transactions_user_version", True),
+        ("cambios duo",
+         select(Transaction).where(Transaction.duo_room_id == room_id, Transaction.room_version > 0)
+         .order_by(Transaction.room_version, Transaction.id).limit(PAGE_SIZE + 1),
+         "ix_transactions_room_version", True),
+        ("membresía duo activa", active_duo_room_query(user_id), "ix_duo_memberships_user_status",
+         False),
+        ("transacciones sin límite",
+         select(Transaction).where(Transaction.user_id == user_id)
+         .order_by(Transaction.date_time.desc(), Transaction.id.desc()),
+         "ix_transactions_user_date", True),
+    ]
+
+
+def _check(dialect, plan, index, ordered):
+    """Devuelve el problema encontrado en el plan, o None si está bien."""
+    if dialect == "sqlite":
+        if not any(f"INDEX {index}" in line for line in plan):
+            return f"no usa {index}"
+        if ordered and any("TEMP B-TREE" in line for line in plan):
+            return "ordena aparte (USE TEMP B-TREE)"
+    else:
+        if not any(f"using {index}" in line for line in plan):
+            return f"no usa {index}"
+        if ordered and any(line.strip().lstrip("->").strip().startswith("Sort") for line in plan):
+            return "ordena aparte (nodo Sort)"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Revisa los planes de las consultas frecuentes")
+    parser.add_argument("--database-url", help="Base vacía de prueba (SQLite temporal por defecto)")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--per-user", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # DATABASE_URL se lee al importar app, así que va antes de importarla
+    os.environ["DATABASE_URL"] = args.database_url or (
+        "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="finduo-plans-"), "plans.db")
+    )
+    from sqlalchemy import text
+
+    from app.database import SessionLocal, engine, init_db
+
+    init_db()
+    Explain = _explain_construct()
+    dialect = engine.dialect.name
+    db = SessionLocal()
+    try:
+        user_id, room_id = _populate(db, args.users, args.per_user, args.seed)
+        db.execute(text("ANALYZE"))
+        db.commit()
+
+        failures = 0
+        for name, query, index, ordered in _queries(db, user_id, room_id):
+            rows = db.execute(Explain(query)).all()
+            plan = [row[-1] for row in rows]
+            problem = _check(dialect, plan, index, ordered)
+            print(f"{'FALLA' if problem else 'ok':<6}{name}: {problem or index}")
+            if problem:
+                failures += 1
+                for line in plan:
+                    print(f"        {line}")
+    finally:
+        db.close()
+
+    print(f"{dialect}: {failures} consultas con problemas")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
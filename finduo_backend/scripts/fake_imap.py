@@ -0,0 +1,475 @@
+"""Servidor IMAP4 mínimo en memoria para pruebas y benchmarks de sincronización.
+
+Implementa solo lo que usa app.imap_client: LOGIN, CAPABILITY, LIST,
+SELECT/EXAMINE (con UIDVALIDITY y UIDNEXT), UID SEARCH (UID, FROM, OR, ALL),
+UID FETCH (UID, FLAGS, BODYSTRUCTURE, BODY[HEADER.FIELDS (...)], BODY[sección]
+con rango parcial, BODY[] y RFC822), NOOP, IDLE y LOGOUT. NOOP e IDLE
+avisan con EXISTS los correos agregados con append(). Sin TLS: la API se
+apunta a él con IMAP_HOST, IMAP_PORT e IMAP_SECURITY=none.
+
+Como fixture dentro de un proceso:
+
+    with FakeImapServer({"INBOX": load_messages("/tmp/banco.mbox")}) as server:
+        ...  # conectar a 127.0.0.1:server.port con cualquier usuario/clave
+
+O como servidor independiente:
+
+    python scripts/fake_imap.py --mbox /tmp/banco.mbox --port 1143
+"""
+import argparse
+import email
+import mailbox
+import os
+import re
+import select
+import socketserver
+import threading
+from email import policy
+
+CAPABILITIES = "IMAP4rev1 IDLE UIDPLUS"
+
+_LINE_END_RE = re.compile(rb"\r?\n")
+_HEADER_END_RE = re.compile(rb"\r\n\r\n")
+_ITEM_RE = re.compile(
+    r"(?P<body>BODY(?:\.PEEK)?\[(?P<section>[^\]]*)\](?:<(?P<start>\d+)\.(?P<size>\d+)>)?)"
+    r"|(?P<name>[A-Z0-9.]+)",
+    re.IGNORECASE,
+)
+_ARG_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(\((?:[^()]|\([^()]*\))*\))|(\S+)')
+
+
+def load_messages(path):
+    """Correos (bytes) de un mbox o un Maildir, en orden."""
+    if os.path.isdir(path):
+        box = mailbox.Maildir(path, factory=None, create=False)
+        keys = sorted(box.keys())
+    else:
+        box = mailbox.mbox(path, factory=None, create=False)
+        keys = list(box.keys())
+    try:
+        return [box.get_bytes(key) for key in keys]
+    finally:
+        box.close()
+
+
+def _quote(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _params(part):
+    params = [(k, v) for k, v in part.get_params(header="content-type")[1:]]
+    if not params:
+        return "NIL"
+    return "(" + " ".join(f"{_quote(k.upper())} {_quote(v)}" for k, v in params) + ")"
+
+
+def _payload_bytes(part):
+    payload = part.get_payload(decode=False)
+    if isinstance(payload, str):
+        return payload.encode("ascii", errors="surrogateescape")
+    return payload or b""
+
+
+def _bodystructure(part):
+    if part.is_multipart():
+        children = "".join(_bodystructure(child) for child in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+
+    payload = _payload_bytes(part)
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        _params(part),
+        _quote(part.get("Content-ID")) if part.get("Content-ID") else "NIL",
+        "NIL",
+        _quote((part.get("Content-Transfer-Encoding") or "7bit").upper()),
+        str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    disposition = part.get_content_disposition()
+    fields += [
+        "NIL",
+        f"({_quote(disposition.upper())} NIL)" if disposition else "NIL",
+    ]
+    return "(" + " ".join(fields) + ")"
+
+
+class StoredMessage:
+    """Un correo del servidor; la estructura MIME se calcula al primer FETCH."""
+
+    __slots__ = ("uid", "raw", "header_end", "sender", "_structure", "_sections")
+
+    def __init__(self, uid, raw):
+        self.uid = uid
+        self.raw = _LINE_END_RE.sub(b"\r\n", raw)
+        m = _HEADER_END_RE.search(self.raw)
+        self.header_end = m.end() if m else len(self.raw)
+        self.sender = self._header(b"from").lower()
+        self._structure = None
+        self._sections = None
+
+    def _header(self, name):
+        # Busca solo en las cabeceras, sin parsear el correo completo
+        for line in self.raw[: self.header_end].split(b"\r\n"):
+            key, _, value = line.partition(b":")
+            if key.strip().lower() == name:
+                return value.strip()
+        return b""
+
+    def _parse(self):
+        message = email.message_from_bytes(self.raw, policy=policy.compat32)
+        self._structure = _bodystructure(message)
+        sections = {}
+
+        def walk(part, prefix):
+            if part.is_multipart():
+                for i, child in enumerate(part.get_payload()):
+                    walk(child, f"{prefix}.{i + 1}" if prefix else str(i + 1))
+            else:
+                sections[prefix or "1"] = _payload_bytes(part).replace(b"\n", b"\r\n").replace(
+                    b"\r\r\n", b"\r\n"
+                )
+
+        walk(message, "")
+        self._sections = sections
+
+    @property
+    def bodystructure(self):
+        if self._structure is None:
+            self._parse()
+        return self._structure
+
+    def section(self, name):
+        upper = name.upper()
+        if upper == "":
+            return self.raw
+        if upper == "HEADER":
+            return self.raw[: self.header_end]
+        if upper == "TEXT":
+            return self.raw[self.header_end :]
+        if upper.startswith("HEADER.FIELDS"):
+            wanted = set(upper[upper.index("(") + 1 : upper.rindex(")")].lower().split())
+            lines, keep = [], False
+            for line in self.raw[: self.header_end].split(b"\r\n"):
+                if line[:1] in (b" ", b"\t"):
+                    if keep:
+                        lines.append(line)
+                    continue
+                keep = line.partition(b":")[0].strip().lower().decode() in wanted
+                if keep:
+                    lines.append(line)
+            return b"\r\n".join(lines) + b"\r\n\r\n"
+        if self._sections is None:
+            self._parse()
+        return self._sections.get(name, b"")
+
+
+class Folder:
+    def __init__(self, messages, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = [StoredMessage(uid, raw) for uid, raw in enumerate(messages, 1)]
+
+    @property
+    def uidnext(self):
+        return self.messages[-1].uid + 1 if self.messages else 1
+
+
+def _uid_ranges(spec, last_uid):
+    ranges = []
+    for piece in spec.split(","):
+        start, _, end = piece.partition(":")
+        start = last_uid if start == "*" else int(start)
+        end = start if not end else (last_uid if end == "*" else int(end))
+        ranges.append((min(start, end), max(start, end)))
+    return ranges
+
+
+def _in_ranges(uid, ranges):
+    return any(start <= uid <= end for start, end in ranges)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.folder = None
+        # Correos de la carpeta seleccionada que ya se informaron con EXISTS
+        self.seen = 0
+
+    def send(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode())
+
+    def handle(self):
+        self.send(f"* OK [CAPABILITY {self.server.capabilities}] FinDuo fake IMAP\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode("utf-8", errors="replace").strip().partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                command, _, args = args.partition(" ")
+                command = "UID " + command.upper()
+            handler = getattr(self, "do_" + command.replace(" ", "_"), None)
+            if handler is None:
+                self.send(f"{tag} BAD comando no soportado: {command}\r\n")
+                continue
+            try:
+                if handler(tag, args) is False:
+                    return
+            except (ValueError, IndexError) as e:
+                self.send(f"{tag} BAD {e}\r\n")
+
+    def do_CAPABILITY(self, tag, args):
+        self.send(
+            f"* CAPABILITY {self.server.capabilities}\r\n{tag} OK CAPABILITY completed\r\n"
+        )
+
+    def do_LOGIN(self, tag, args):
+        expected = self.server.credentials
+        if expected and tuple(
+            m.group(1) if m.group(1) is not None else m.group(0)
+            for m in _ARG_RE.finditer(args)
+        ) != expected:
+            self.send(f"{tag} NO [AUTHENTICATIONFAILED] credenciales inválidas\r\n")
+            return
+        self.send(f"{tag} OK LOGIN completed\r\n")
+
+    def do_LOGOUT(self, tag, args):
+        self.send(f"* BYE\r\n{tag} OK LOGOUT completed\r\n")
+        return False
+
+    def _new_messages(self):
+        """EXISTS si llegaron correos a la carpeta seleccionada desde el último aviso."""
+        if self.folder is None or len(self.folder.messages) <= self.seen:
+            return ""
+        self.seen = len(self.folder.messages)
+        return f"* {self.seen} EXISTS\r\n"
+
+    def do_NOOP(self, tag, args):
+        self.send(f"{self._new_messages()}{tag} OK NOOP completed\r\n")
+
+    def do_LIST(self, tag, args):
+        for name in self.server.folders:
+            self.send(f'* LIST (\\HasNoChildren) "/" {_quote(name)}\r\n')
+        self.send(f"{tag} OK LIST completed\r\n")
+
+    def do_SELECT(self, tag, args):
+        name = args.strip()
+        if name.startswith('"'):
+            name = re.sub(r"\\(.)", r"\1", name[1:-1])
+        folder = self.server.folders.get(name)
+        if folder is None:
+            self.folder = None
+            self.send(f"{tag} NO carpeta inexistente\r\n")
+            return
+        self.folder = folder
+        self.seen = len(folder.messages)
+        self.send(
+            f"* {len(folder.messages)} EXISTS\r\n* 0 RECENT\r\n"
+            f"* OK [UIDVALIDITY {folder.uidvalidity}] UIDs válidos\r\n"
+            f"* OK [UIDNEXT {folder.uidnext}] próximo UID\r\n"
+            f"{tag} OK [READ-ONLY] SELECT completed\r\n"
+        )
+
+    do_EXAMINE = do_SELECT
+
+    def _criteria(self, tokens):
+        """Convierte criterios de SEARCH en un predicado sobre StoredMessage."""
+        token = tokens.pop(0).upper()
+        if token == "ALL":
+            return lambda message: True
+        if token == "UID":
+            ranges = _uid_ranges(tokens.pop(0), self.folder.uidnext - 1)
+            return lambda message: _in_ranges(message.uid, ranges)
+        if token == "FROM":
+            needle = tokens.pop(0).lower().encode()
+            return lambda message: needle in message.sender
+        if token == "OR":
+            left, right = self._criteria(tokens), self._criteria(tokens)
+            return lambda message: left(message) or right(message)
+        if token == "NOT":
+            inner = self._criteria(tokens)
+            return lambda message: not inner(message)
+        raise ValueError(f"criterio no soportado: {token}")
+
+    def do_UID_SEARCH(self, tag, args):
+        if self.folder is None:
+            self.send(f"{tag} NO ninguna carpeta seleccionada\r\n")
+            return
+        tokens = [
+            m.group(1) if m.group(1) is not None else m.group(0)
+            for m in _ARG_RE.finditer(args)
+        ]
+        if tokens and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        predicates = []
+        while tokens:
+            predicates.append(self._criteria(tokens))
+        uids = [
+            str(message.uid)
+            for message in self.folder.messages
+            if all(predicate(message) for predicate in predicates)
+        ]
+        self.send(f"* SEARCH {' '.join(uids)}\r\n{tag} OK SEARCH completed\r\n")
+
+    def do_UID_FETCH(self, tag, args):
+        if self.folder is None:
+            self.send(f"{tag} NO ninguna carpeta seleccionada\r\n")
+            return
+        spec, _, items = args.partition(" ")
+        items = items.strip()
+        if items.startswith("(") and items.endswith(")"):
+            items = items[1:-1]
+        wanted = list(_ITEM_RE.finditer(items))
+        ranges = _uid_ranges(spec, self.folder.uidnext - 1)
+
+        out = []
+        for seq, message in enumerate(self.folder.messages, 1):
+            if not _in_ranges(message.uid, ranges):
+                continue
+            parts = [f"* {seq} FETCH (UID {message.uid}".encode()]
+            for item in wanted:
+                if item.group("body") or (item.group("name") or "").upper() == "RFC822":
+                    section = item.group("section") if item.group("body") else ""
+                    data = message.section(section)
+                    key = f"BODY[{section}]" if item.group("body") else "RFC822"
+                    if item.group("start") is not None:
+                        start = int(item.group("start"))
+                        data = data[start : start + int(item.group("size"))]
+                        key += f"<{start}>"
+                    parts.append(f" {key} {{{len(data)}}}\r\n".encode() + data)
+                    continue
+                name = item.group("name").upper()
+                if name == "BODYSTRUCTURE":
+                    parts.append(f" BODYSTRUCTURE {message.bodystructure}".encode())
+                elif name == "FLAGS":
+                    parts.append(b" FLAGS (\\Seen)")
+                elif name == "RFC822.SIZE":
+                    parts.append(f" RFC822.SIZE {len(message.raw)}".encode())
+            parts.append(b")\r\n")
+            out.append(b"".join(parts))
+        out.append(f"{tag} OK FETCH completed\r\n".encode())
+        self.send(b"".join(out))
+
+    def do_IDLE(self, tag, args):
+        self.send("+ idling\r\n")
+        while True:
+            self.send(self._new_messages())
+            readable, _, _ = select.select([self.request], [], [], 0.2)
+            if not readable:
+                continue
+            line = self.rfile.readline()
+            if not line or line.strip().upper() == b"DONE":
+                break
+        self.send(f"{tag} OK IDLE terminated\r\n")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeImapServer:
+    """Servidor IMAP en un hilo, con carpetas {nombre: [bytes del correo]}.
+
+    Con username y password solo acepta esas credenciales; si no, cualquiera.
+    Con idle=False no anuncia IDLE, como los servidores que no lo soportan.
+    """
+
+    def __init__(
+        self, folders, host="127.0.0.1", port=0, username=None, password=None, idle=True
+    ):
+        self._server = _Server((host, port), _Handler, bind_and_activate=True)
+        self._server.folders = {
+            name: Folder(messages, uidvalidity)
+            for uidvalidity, (name, messages) in enumerate(folders.items(), 1)
+        }
+        self._server.credentials = (username, password) if username else None
+        self._server.capabilities = (
+            CAPABILITIES if idle else CAPABILITIES.replace(" IDLE", "")
+        )
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def folder(self, name):
+        return self._server.folders[name]
+
+    def append(self, name, raw):
+        """Agrega un correo a la carpeta; las sesiones en IDLE reciben EXISTS."""
+        folder = self._server.folders[name]
+        folder.messages.append(StoredMessage(folder.uidnext, raw))
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-imap", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def serve(folders, host="127.0.0.1", port=0, ready=None, stop=None):
+    """Corre el servidor hasta que stop (un Event) se active.
+
+    Pensado como target de multiprocessing.Process: folders puede traer rutas a
+    mbox/Maildir en lugar de listas de correos, y por ready (una Queue) se
+    informa el puerto asignado.
+    """
+    folders = {
+        name: load_messages(value) if isinstance(value, str) else value
+        for name, value in folders.items()
+    }
+    with FakeImapServer(folders, host, port) as server:
+        if ready is not None:
+            ready.put(server.port)
+        if stop is None:
+            threading.Event().wait()
+        else:
+            stop.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor IMAP de prueba")
+    parser.add_argument("--mbox", required=True, help="mbox o Maildir con los correos")
+    parser.add_argument("--folder", default="INBOX")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1143)
+    args = parser.parse_args()
+
+    messages = load_messages(args.mbox)
+    with FakeImapServer({args.folder: messages}, args.host, args.port) as server:
+        print(
+            f"{len(messages)} correos en {args.folder}; "
+            f"IMAP_HOST={server.host} IMAP_PORT={server.port} IMAP_SECURITY=none"
+        )
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Prueba de carga de los endpoints de lectura más usados.
+
+Uso: python scripts/load_test.py --database-url URL [--baseline-ref REF]
+         [--concurrency 10 50 200] [--duration 15] [--timeout 10]
+         [--users 50] [--per-user 500]
+
+Levanta la API con uvicorn (un proceso, como en producción) y la carga con
+clientes concurrentes en lazo cerrado (cada cliente manda el siguiente
+request apenas recibe la respuesta) durante --duration segundos por nivel
+de concurrencia. Los requests rotan entre GET /transactions?limit=50,
+/transactions/changes, /summary y /me de usuarios distintos, sin
+If-None-Match, así que todos consultan la base. Un request que tarda más de
+--timeout segundos cuenta como error. El generador de carga corre en la misma
+máquina: con pocos núcleos y cientos de clientes se lleva buena parte de la
+CPU, así que esos niveles sirven para comparar variantes, no como capacidad.
+
+--database-url debe ser una base vacía de prueba (Postgres para medir lo
+que pasa en producción; SQLite temporal por defecto). Con --baseline-ref se
+mide además la API de ese commit (por ejemplo, el anterior al stack async)
+sobre la misma base, desde un git worktree temporal, y se imprimen las dos
+tablas para comparar requests/s con el mismo p99.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+SECRET_KEY = "load-test-secret"
+ENDPOINTS = (
+    "/transactions?limit=50",
+    "/transactions/changes?limit=50",
+    "/summary?period=month",
+    "/me",
+)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _populate(users, per_user, seed):
+    """Crea usuarios con transacciones y devuelve un token por usuario."""
+    from sqlalchemy import insert
+
+    from app.auth import create_access_token
+    from app.database import SessionLocal
+    from app.models import Transaction, User
+
+    rng = random.Random(seed)
+    db = SessionLocal()
+    try:
+        emails = [f"load{i}@finduo.cl" for i in range(users)]
+        db.execute(insert(User), [{"email": email, "name": "Load"} for email in emails])
+        user_ids = [u.id for u in db.query(User.id).order_by(User.id)]
+        start = datetime(2022, 1, 1)
+        for user_id in user_ids:
+            db.execute(
+                insert(Transaction),
+                [
+                    {
+                        "user_id": user_id,
+                        "type": rng.choice(["purchase", "transfer_out", "transfer_in"]),
+                        "description": "Compra en comercio",
+                        "amount": rng.randint(1000, 100000),
+                        "currency": "CLP",
+                        "date_time": start + timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60)),
+                    }
+                    for _ in range(per_user)
+                ],
+            )
+        db.commit()
+    finally:
+        db.close()
+    # Los resúmenes de /summary se leen de spending_rollups
+    db = SessionLocal()
+    try:
+        from app import rollups
+
+        rollups.apply(db, db.query(Transaction).all())
+        db.commit()
+    finally:
+        db.close()
+    return [create_access_token({"sub": email}) for email in emails]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(backend_dir, database_url, port):
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        SECRET_KEY=SECRET_KEY,
+        SYNC_IN_PROCESS="0",
+        SYNC_SCHEDULER_ENABLED="0",
+        LOG_LEVEL="WARNING",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=backend_dir,
+        env=env,
+    )
+    import httpx
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"La API de {backend_dir} no arrancó")
+
+
+async def _load(base_url, tokens, concurrency, duration, timeout):
+    import httpx
+
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def client(n):
+        nonlocal errors
+        i = n
+        while time.monotonic() < deadline:
+            token = tokens[i % len(tokens)]
+            path = ENDPOINTS[i % len(ENDPOINTS)]
+            i += concurrency
+            t0 = time.perf_counter()
+            try:
+                response = await http.get(path, headers={"Authorization": f"Bearer {token}"})
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - t0)
+            if not ok:
+                errors += 1
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as http:
+        started = time.monotonic()
+        await asyncio.gather(*(client(n) for n in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return len(latencies) / elapsed, latencies, errors
+
+
+def _run(name, backend_dir, database_url, tokens, levels, duration, timeout):
+    port = _free_port()
+    process = _start_server(backend_dir, database_url, port)
+    try:
+        # Calentar conexiones del pool y cachés antes de medir
+        asyncio.run(_load(f"http://127.0.0.1:{port}", tokens, 10, 2, timeout))
+        print(f"\n{name}")
+        print(f"{'clientes':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errores':>8}", flush=True)
+        for concurrency in levels:
+            rps, latencies, errors = asyncio.run(
+                _load(f"http://127.0.0.1:{port}", tokens, concurrency, duration, timeout)
+            )
+            print(
+                f"{concurrency:>8} {rps:>8.0f} {_percentile(latencies, 0.5) * 1000:>8.1f} "
+                f"{_percentile(latencies, 0.99) * 1000:>8.1f} {errors:>8}",
+                flush=True,
+            )
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # Con el threadpool bloqueado uvicorn no termina solo
+            process.kill()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API")
+    parser.add_argument("--database-url", help="Base vacía de prueba (SQLite temporal por defecto)")
+    parser.add_argument("--baseline-ref", help="Commit con el que comparar (git worktree temporal)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--timeout", type=float, default=10, help="Segundos por request")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--per-user", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # DATABASE_URL y SECRET_KEY se leen al importar app, así que van antes
+    database_url = args.database_url or (
+        "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="finduo-load-"), "load.db")
+    )
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["SECRET_KEY"] = SECRET_KEY
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.database import init_db
+
+    init_db()
+    tokens = _populate(args.users, args.per_user, args.seed)
+
+    runs = [("actual", os.path.abspath(BACKEND_DIR))]
+    worktree = None
+    if args.baseline_ref:
+        worktree = tempfile.mkdtemp(prefix="finduo-baseline-")
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", worktree, args.baseline_ref],
+            cwd=BACKEND_DIR,
+            check=True,
+            capture_output=True,
+        )
+        backend = os.path.relpath(
+            os.path.abspath(BACKEND_DIR),
+            subprocess.run(
+                ["git", "rev-parse", "--show-toplevel"],
+                cwd=BACKEND_DIR, check=True, capture_output=True, text=True,
+            ).stdout.strip(),
+        )
+        runs.insert(0, (f"base ({args.baseline_ref})", os.path.join(worktree, backend)))
+    try:
+        for name, backend_dir in runs:
+            _run(
+                name, backend_dir, database_url, tokens, args.concurrency, args.duration,
+                args.timeout,
+            )
+    finally:
+        if worktree:
+            subprocess.run(
+                ["git", "worktree", "remove", "--force", worktree], cwd=BACKEND_DIR, check=False
+            )
+            shutil.rmtree(worktree, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 #!/bin/bash
 # Script de inicio para Railway
 # Lee la variable PORT y ejecuta uvicorn
+# Con "./start.sh worker" inicia el worker de sincronización de correo
+
+if [ "$1" = "worker" ]; then
+    exec python -m app.sync_worker
+fi
 
 PORT=${PORT:-8000}
 exec uvicorn app.main:app --host 0.0.0.0 --port $PORT
-
@@ -84,14 +84,35 @@ class TransactionService {
       print('Respuesta del servidor: ${resp.statusCode}');
       print('Body: ${resp.body}');
       
-      if (resp.statusCode == 200) {
-        final data = jsonDecode(resp.body) as Map<String, dynamic>;
-        final imported = data['imported'] as int;
-        print('Sincronización exitosa. Importados: $imported');
-        return imported;
-      } else {
+      // La API encola la sincronización (202) y devuelve el job
+      if (resp.statusCode != 200 && resp.statusCode != 202) {
         throw Exception('Error al sincronizar correo (${resp.statusCode}): ${resp.body}');
       }
+      var job = jsonDecode(resp.body) as Map<String, dynamic>;
+      final jobId = job['job_id'] as int;
+      final deadline = DateTime.now().add(const Duration(minutes: 5));
+
+      while (job['status'] != 'done' && job['status'] != 'error') {
+        if (DateTime.now().isAfter(deadline)) {
+          throw Exception('Timeout: La sincronización está tomando demasiado tiempo');
+        }
+        await Future.delayed(const Duration(seconds: 2));
+        final statusResp = await http
+            .get(Uri.parse('${ApiConfig.baseUrl}/sync-email/$jobId'))
+            .timeout(const Duration(seconds: 30));
+        if (statusResp.statusCode != 200) {
+          throw Exception(
+              'Error al consultar la sincronización (${statusResp.statusCode}): ${statusResp.body}');
+        }
+        job = jsonDecode(statusResp.body) as Map<String, dynamic>;
+      }
+
+      if (job['status'] == 'error') {
+        throw Exception('Error al sincronizar correo: ${job['error']}');
+      }
+      final imported = job['imported'] as int;
+      print('Sincronización exitosa. Importados: $imported');
+      return imported;
     } catch (e) {
       print('Error en syncEmail: $e');
       rethrow;